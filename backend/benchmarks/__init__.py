@@ -0,0 +1,54 @@
+"""
+Microbenchmarks for the expense tracker backend.
+
+Run from the backend directory, e.g.:
+  python -m benchmarks.bench_renderers
+"""
+
+import os
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def setup_django():
+    """Configure Django for a standalone benchmark script"""
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'expense_tracker_api.settings')
+
+    import django
+    django.setup()
+
+
+def create_benchmark_db(path=None):
+    """
+    Create a throwaway migrated database (in-memory for SQLite).
+
+    Pass a file `path` when several threads write concurrently: the shared
+    in-memory SQLite database locks whole tables, a file in WAL mode does not.
+    """
+    from django.db import connection
+    from django.test.utils import setup_test_environment
+
+    if path and connection.vendor == 'sqlite':
+        connection.settings_dict['TEST'] = {**connection.settings_dict.get('TEST', {}), 'NAME': path}
+        connection.settings_dict['OPTIONS'] = {**connection.settings_dict.get('OPTIONS', {}), 'timeout': 30}
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    if path and connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode=WAL')
+
+
+def timeit(func, repeat=5, number=20):
+    """Return the best per-call time in milliseconds"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = (time.perf_counter() - start) / number
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000
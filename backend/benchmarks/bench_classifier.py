@@ -0,0 +1,61 @@
+"""
+Training and prediction speed of the local category classifier.
+
+Usage:
+  python -m benchmarks.bench_classifier [--history 2000]
+
+Trains one user's model from synthetic history and reports per-call
+prediction latency and hold-out accuracy for category and payment method.
+"""
+
+import argparse
+import random
+import time
+
+from benchmarks import setup_django
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--history', type=int, default=2000)
+    parser.add_argument('--predictions', type=int, default=5000)
+    args = parser.parse_args()
+
+    setup_django()
+
+    from expenses.benchdata import make_expense
+    from expenses.classifier import UserClassifier
+
+    rng = random.Random(3)
+    expenses = [make_expense(rng, 'bench') for _ in range(args.history + args.predictions)]
+    # Give each merchant a habitual payment method so there is something to learn
+    habits = {}
+    for expense in expenses:
+        expense.payment_method = habits.setdefault(expense.merchant_name, rng.choice(['cash', 'credit_card', 'upi']))
+
+    train, test = expenses[:args.history], expenses[args.history:]
+    model = UserClassifier()
+    start = time.perf_counter()
+    for expense in train:
+        model.learn(expense.merchant_name, expense.items, expense.category, expense.payment_method)
+    train_ms = (time.perf_counter() - start) * 1000
+
+    hits_category = hits_payment = 0
+    start = time.perf_counter()
+    for expense in test:
+        prediction = model.predict(expense.merchant_name, expense.items)
+        hits_category += prediction['category']['value'] == expense.category
+        hits_payment += prediction['payment_method']['value'] == expense.payment_method
+    predict_us = (time.perf_counter() - start) * 1e6 / len(test)
+
+    print(f"Classifier benchmark ({len(train)} training expenses, {len(test)} predictions)")
+    print("=" * 64)
+    print(f"train: {train_ms:.1f} ms total ({train_ms * 1000 / len(train):.1f} us/expense)")
+    print(f"predict: {predict_us:.1f} us/call")
+    print(f"accuracy: category {100 * hits_category / len(test):.1f}%  "
+          f"payment_method {100 * hits_payment / len(test):.1f}%")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,331 @@
+"""
+Offline receipt-extraction benchmark: speed and quality of an extractor.
+
+Usage:
+  python -m benchmarks.bench_extraction RECEIPTS_DIR [--extractor DOTTED.PATH] [--concurrency 4]
+      [--lite] [--preprocess] [--max-edge 1600] [--cache DIR] [--output results.json]
+      [--compare baseline.json]
+  python -m benchmarks.bench_extraction [path_to_image]   (one image, default ./a.png)
+
+RECEIPTS_DIR holds receipt images (png, jpg, jpeg, webp, tif, tiff) or PDFs, each
+optionally with ground truth in a JSON file of the same name, e.g.
+coffee.jpg + coffee.json:
+
+  {"merchant_name": "Starbucks", "amount": 7.45, "date": "2024-05-01", "category": "food"}
+
+Every image goes through the extractor named by --extractor (default
+settings.RECEIPT_EXTRACTOR), one fresh instance per receipt, on
+--concurrency threads. The report has latency percentiles, throughput,
+tokens per receipt (from the ExtractionCall rows the Gemini extractor
+records; stand-ins without them report none) and field accuracy against
+the ground truth:
+
+- amount: within 0.01
+- date: same YYYY-MM-DD
+- merchant: same normalized merchant name, or one contains the other
+- category: same category (not scored with --lite, which leaves it to the
+  local classifier)
+
+--preprocess sends a grayscale, autocontrasted JPEG no larger than
+--max-edge pixels instead of the original file (PDFs and multi-page TIFFs
+are sent as they are). --cache keeps results in a
+directory keyed by the sent image's SHA-256, the extractor and the mode, so
+reruns skip the model; cached receipts count towards accuracy but not
+latency or tokens.
+
+Results (configuration, summary and per-receipt rows) are written to
+--output as JSON; --compare prints the summary's change against an earlier
+results file.
+
+With a single image path, the extraction is printed instead (a quick check
+of GEMINI_API_KEY and the model).
+"""
+
+import argparse
+import hashlib
+import io
+import json
+import os
+import statistics
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from benchmarks import create_benchmark_db, setup_django
+from benchmarks.bench_replica import percentile
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp', '.tif', '.tiff', '.pdf')
+
+FIELDS = ('amount', 'date', 'merchant', 'category')
+
+
+def load_dataset(directory):
+    """[(name, image bytes, ground truth dict or None)] sorted by file name"""
+    receipts = []
+    for name in sorted(os.listdir(directory)):
+        stem, extension = os.path.splitext(name)
+        if extension.lower() not in IMAGE_EXTENSIONS:
+            continue
+        with open(os.path.join(directory, name), 'rb') as f:
+            image = f.read()
+        truth_path = os.path.join(directory, f'{stem}.json')
+        truth = None
+        if os.path.exists(truth_path):
+            with open(truth_path) as f:
+                truth = json.load(f)
+        receipts.append((name, image, truth))
+    return receipts
+
+
+def preprocess(image_bytes, max_edge):
+    """Grayscale, autocontrasted JPEG with the longer edge at most `max_edge` pixels"""
+    from PIL import Image, ImageOps
+
+    if image_bytes.startswith(b'%PDF-'):
+        return image_bytes
+    image = Image.open(io.BytesIO(image_bytes))
+    if getattr(image, 'n_frames', 1) > 1:
+        return image_bytes
+    image = ImageOps.exif_transpose(image)
+    image = ImageOps.autocontrast(image.convert('L'))
+    image.thumbnail((max_edge, max_edge))
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=85)
+    return buffer.getvalue()
+
+
+def score(data, truth, lite):
+    """{field: True/False} for the ground-truth fields the extraction can be judged on"""
+    from expenses.merchants import normalize_merchant_name
+
+    data = data or {}
+    scores = {}
+    if truth.get('amount') is not None:
+        try:
+            scores['amount'] = abs(float(data.get('amount') or 0) - float(truth['amount'])) <= 0.01
+        except (TypeError, ValueError):
+            scores['amount'] = False
+    if truth.get('date'):
+        scores['date'] = data.get('date') == truth['date']
+    if truth.get('merchant_name'):
+        expected = normalize_merchant_name(truth['merchant_name'])
+        actual = normalize_merchant_name(data.get('merchant_name') or '')
+        scores['merchant'] = bool(actual) and (actual == expected or actual in expected or expected in actual)
+    if truth.get('category') and not lite:
+        scores['category'] = data.get('category') == truth['category']
+    return scores
+
+
+class ResultCache:
+    """Extraction results on disk, one JSON file per key"""
+
+    def __init__(self, directory, extractor_path, lite):
+        self.directory = directory
+        self.prefix = f'{extractor_path}:{"lite" if lite else "full"}:'
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, image_bytes):
+        key = hashlib.sha256(self.prefix.encode() + image_bytes).hexdigest()
+        return os.path.join(self.directory, f'{key}.json')
+
+    def get(self, image_bytes):
+        try:
+            with open(self._path(image_bytes)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, image_bytes, result):
+        path = self._path(image_bytes)
+        with open(f'{path}.tmp', 'w') as f:
+            json.dump(result, f, default=str)
+        os.replace(f'{path}.tmp', path)
+
+
+def extract_one(extractor_path, name, image_bytes, truth, args, cache):
+    from django.db import connection
+    from django.utils.module_loading import import_string
+
+    from expenses.models import ExtractionCall
+
+    sent = preprocess(image_bytes, args.max_edge) if args.preprocess else image_bytes
+    row = {'file': name, 'bytes': len(image_bytes), 'sent_bytes': len(sent), 'cached': False, 'tokens': None}
+    result = cache.get(sent) if cache else None
+    if result is not None:
+        row.update(cached=True, latency_ms=None)
+    else:
+        extractor = import_string(extractor_path)()
+        start = time.perf_counter()
+        try:
+            result = extractor.extract_receipt_data(io.BytesIO(sent), lite=args.lite)
+        except Exception as e:
+            result = {'success': False, 'error': str(e), 'data': None}
+        row['latency_ms'] = (time.perf_counter() - start) * 1000
+        scan_id = getattr(extractor, 'scan_id', None)
+        if scan_id:
+            calls = ExtractionCall.objects.filter(scan_id=scan_id)
+            row['tokens'] = sum(tokens or 0 for tokens in calls.values_list('total_tokens', flat=True))
+            row['final_tier'] = max(calls.values_list('tier', flat=True), default=0)
+        if cache and result.get('success'):
+            cache.put(sent, {key: result.get(key) for key in ('success', 'data', 'error')})
+        connection.close()
+
+    row.update(success=bool(result.get('success')), error=result.get('error'), data=result.get('data'))
+    row['scores'] = score(result.get('data'), truth, args.lite) if truth else {}
+    return row
+
+
+def summarize(rows, wall_seconds):
+    measured = sorted(row['latency_ms'] for row in rows if row['latency_ms'] is not None)
+    tokens = [row['tokens'] for row in rows if row['tokens'] is not None]
+    summary = {
+        'receipts': len(rows),
+        'successes': sum(row['success'] for row in rows),
+        'cached': sum(row['cached'] for row in rows),
+        'wall_seconds': wall_seconds,
+        'throughput_per_s': len(rows) / wall_seconds if wall_seconds else None,
+        'latency_ms': {
+            'p50': statistics.median(measured) if measured else None,
+            'p90': percentile(measured, 90) if measured else None,
+            'p95': percentile(measured, 95) if measured else None,
+            'p99': percentile(measured, 99) if measured else None,
+            'max': measured[-1] if measured else None,
+        },
+        'tokens_per_receipt': statistics.mean(tokens) if tokens else None,
+        'tokens_total': sum(tokens) if tokens else None,
+        'escalated': sum(1 for row in rows if row.get('final_tier')),
+        'accuracy': {},
+    }
+    for field in FIELDS:
+        judged = [row['scores'][field] for row in rows if field in row['scores']]
+        if judged:
+            summary['accuracy'][field] = sum(judged) / len(judged)
+    return summary
+
+
+def print_summary(summary, config):
+    latency = summary['latency_ms']
+
+    def ms(value):
+        return f"{value:7.0f} ms" if value is not None else '      - '
+
+    print(f"Receipt extraction ({summary['receipts']} receipts, {config['extractor']}, "
+          f"concurrency {config['concurrency']}, {'lite' if config['lite'] else 'full'}"
+          f"{', preprocessed' if config['preprocess'] else ''})")
+    print("=" * 78)
+    print(f"success      {summary['successes']}/{summary['receipts']}  cached {summary['cached']}  "
+          f"escalated {summary['escalated']}")
+    print(f"latency      p50 {ms(latency['p50'])}  p95 {ms(latency['p95'])}  p99 {ms(latency['p99'])}  "
+          f"max {ms(latency['max'])}")
+    throughput = summary['throughput_per_s']
+    print(f"throughput   {throughput:.2f} receipts/s over {summary['wall_seconds']:.1f} s")
+    if summary['tokens_per_receipt'] is not None:
+        print(f"tokens       {summary['tokens_per_receipt']:.0f} per receipt, {summary['tokens_total']} total")
+    else:
+        print("tokens       -")
+    accuracy = '  '.join(f"{field} {value:6.1%}" for field, value in summary['accuracy'].items())
+    print(f"accuracy     {accuracy or '- (no ground truth)'}")
+
+
+def print_comparison(summary, baseline):
+    print()
+    print(f"Change against {baseline['created_at']} ({baseline['config']['extractor']})")
+    print("=" * 78)
+    pairs = [
+        ('latency p50 (ms)', summary['latency_ms']['p50'], baseline['summary']['latency_ms']['p50']),
+        ('latency p95 (ms)', summary['latency_ms']['p95'], baseline['summary']['latency_ms']['p95']),
+        ('throughput (/s)', summary['throughput_per_s'], baseline['summary']['throughput_per_s']),
+        ('tokens / receipt', summary['tokens_per_receipt'], baseline['summary']['tokens_per_receipt']),
+    ]
+    pairs += [
+        (f'{field} accuracy', summary['accuracy'].get(field), baseline['summary']['accuracy'].get(field))
+        for field in FIELDS
+    ]
+    for label, current, previous in pairs:
+        if current is None or previous is None:
+            continue
+        print(f"{label:<20} {previous:10.3f} -> {current:10.3f}  ({current - previous:+.3f})")
+
+
+def check_single_image(path, extractor_path, lite):
+    """The old smoke test: extract one image and print the result"""
+    from django.conf import settings
+    from django.utils.module_loading import import_string
+
+    if extractor_path == 'expenses.gemini_service.GeminiReceiptExtractor' and not settings.GEMINI_API_KEY:
+        print("GEMINI_API_KEY not found in .env")
+        return 1
+    print(f"Using image: {path} ({os.path.getsize(path)} bytes), extractor {extractor_path}")
+    with open(path, 'rb') as f:
+        result = import_string(extractor_path)().extract_receipt_data(io.BytesIO(f.read()), lite=lite)
+    if not result.get('success'):
+        print(f"Extraction failed: {result.get('error')}")
+        return 1
+    print(json.dumps(result['data'], indent=2, default=str))
+    if result.get('raw_text'):
+        print("\nRaw text:")
+        print(result['raw_text'])
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path', nargs='?', default='./a.png', help="Receipts directory, or one image")
+    parser.add_argument('--extractor', help="Extractor class (default settings.RECEIPT_EXTRACTOR)")
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--lite', action='store_true', help="Use the lite prompt (no category or description)")
+    parser.add_argument('--preprocess', action='store_true')
+    parser.add_argument('--max-edge', type=int, default=1600)
+    parser.add_argument('--cache', help="Directory for cached extraction results")
+    parser.add_argument('--output', default='extraction_results.json')
+    parser.add_argument('--compare', help="Earlier results file to compare with")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.path):
+        print(f"Not found: {args.path}")
+        return 1
+
+    with tempfile.TemporaryDirectory() as scratch:
+        setup_django()
+        # A file database: the worker threads record model calls concurrently
+        create_benchmark_db(os.path.join(scratch, 'bench.sqlite3'))
+
+        from django.conf import settings
+
+        extractor_path = args.extractor or settings.RECEIPT_EXTRACTOR
+        if os.path.isfile(args.path):
+            return check_single_image(args.path, extractor_path, args.lite)
+
+        receipts = load_dataset(args.path)
+        if not receipts:
+            print(f"No receipt images in {args.path}")
+            return 1
+        cache = ResultCache(args.cache, extractor_path, args.lite) if args.cache else None
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max(args.concurrency, 1)) as pool:
+            rows = list(pool.map(
+                lambda receipt: extract_one(extractor_path, *receipt, args, cache), receipts
+            ))
+        summary = summarize(rows, time.perf_counter() - start)
+
+    config = {
+        'dataset': os.path.abspath(args.path), 'extractor': extractor_path, 'concurrency': args.concurrency,
+        'lite': args.lite, 'preprocess': args.preprocess, 'max_edge': args.max_edge if args.preprocess else None,
+        'cache': bool(cache), 'model_tiers': getattr(settings, 'GEMINI_MODEL_TIERS', None),
+    }
+    print_summary(summary, config)
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(summary, json.load(f))
+
+    with open(args.output, 'w') as f:
+        json.dump({'created_at': datetime.now().isoformat(timespec='seconds'), 'config': config,
+                   'summary': summary, 'receipts': rows}, f, indent=2, default=str)
+    print(f"\nResults written to {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
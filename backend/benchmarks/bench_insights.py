@@ -0,0 +1,84 @@
+"""
+Vectorized insights vs. a per-user Python loop, over many users.
+
+Usage:
+  python -m benchmarks.bench_insights [--users 100000] [--days 90] [--db-users 2000]
+
+The in-memory part times compute_statistics() on a synthetic
+(users x days) matrix against the equivalent pure-Python loop (on a sample
+of users, extrapolated). With --db-users > 0 it also seeds that many users
+and times the full nightly compute_all() including the grouped query.
+"""
+
+import argparse
+import statistics
+import time
+from datetime import date
+
+from benchmarks import create_benchmark_db, setup_django
+
+
+def python_statistics(row, window_7=7, window_30=30):
+    """Reference per-row implementation, the way it would be written without NumPy"""
+    spend = [v for v in row if v > 0]
+    return {
+        'total': sum(row),
+        'median': statistics.median(spend) if spend else 0.0,
+        'volatility': statistics.stdev(row) if len(row) > 1 else 0.0,
+        'rolling_7': sum(row[-window_7:]) / window_7,
+        'rolling_30': sum(row[-window_30:]) / window_30,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--days', type=int, default=90)
+    parser.add_argument('--db-users', type=int, default=0)
+    args = parser.parse_args()
+
+    setup_django()
+
+    import numpy as np
+
+    from expenses.insights import compute_statistics
+
+    rng = np.random.default_rng(11)
+    # Roughly one expense every three days per user
+    matrix = np.where(rng.random((args.users, args.days)) < 0.35,
+                      rng.gamma(2.0, 25.0, (args.users, args.days)), 0.0)
+    today = date.today()
+    start = date.fromordinal(today.toordinal() - args.days + 1)
+
+    t0 = time.perf_counter()
+    compute_statistics(matrix, start, today)
+    vectorized = time.perf_counter() - t0
+
+    sample = min(args.users, 5000)
+    rows = matrix[:sample].tolist()
+    t0 = time.perf_counter()
+    for row in rows:
+        python_statistics(row)
+    loop = (time.perf_counter() - t0) * args.users / sample
+
+    print(f"Insights benchmark ({args.users} users x {args.days} days)")
+    print("=" * 64)
+    print(f"vectorized compute_statistics: {vectorized * 1000:9.1f} ms")
+    print(f"python loop (extrapolated):     {loop * 1000:9.1f} ms  ({loop / vectorized:.0f}x slower)")
+
+    if args.db_users:
+        create_benchmark_db()
+        from expenses.benchdata import seed_expenses
+        from expenses.insights import compute_all
+
+        usernames = [f'user{i}' for i in range(args.db_users)]
+        seed_expenses(args.db_users * 20, usernames=usernames, batch_size=5000)
+        t0 = time.perf_counter()
+        stored = compute_all(days=args.days)
+        print(f"compute_all over the database:  {(time.perf_counter() - t0) * 1000:9.1f} ms "
+              f"({stored} users, {args.db_users * 20} expenses)")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
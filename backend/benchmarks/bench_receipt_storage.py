@@ -0,0 +1,101 @@
+"""
+Disk use and preview bandwidth of plain vs content-addressed receipt storage.
+
+Usage:
+  python -m benchmarks.bench_receipt_storage [--receipts 200] [--duplicates 0.3]
+
+Builds a synthetic corpus of phone-camera sized receipt photos, where a
+fraction of uploads are re-uploads of an earlier photo, and stores it with
+both backends in temporary directories. Preview bandwidth is what a list
+screen of 50 expenses downloads: full images vs. the 256px thumbnails.
+"""
+
+import argparse
+import io
+import os
+import random
+import tempfile
+import time
+
+from benchmarks import setup_django
+
+
+def make_receipt(rng, width=1500, height=2600):
+    """A noisy, text-like receipt photo encoded as JPEG"""
+    from PIL import Image, ImageDraw, ImageFilter
+
+    image = Image.new('RGB', (width, height), (rng.randint(225, 250),) * 3)
+    draw = ImageDraw.Draw(image)
+    for y in range(120, height - 120, 46):
+        x = 100
+        while x < width - 200:
+            w = rng.randint(20, 160)
+            draw.rectangle([x, y, x + w, y + 22], fill=(rng.randint(10, 80),) * 3)
+            x += w + rng.randint(15, 40)
+    image = image.filter(ImageFilter.GaussianBlur(0.8))
+    noise = Image.effect_noise((width, height), 12).convert('RGB')
+    image = Image.blend(image, noise, 0.08)
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=88)
+    return buffer.getvalue()
+
+
+def dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--receipts', type=int, default=200)
+    parser.add_argument('--duplicates', type=float, default=0.3,
+                        help="Fraction of uploads that repeat an earlier photo")
+    parser.add_argument('--preview-size', type=int, default=256)
+    args = parser.parse_args()
+
+    setup_django()
+
+    from django.core.files.base import ContentFile
+    from django.core.files.storage import FileSystemStorage
+
+    from expenses.storage import ReceiptStorage, thumbnail_name
+
+    rng = random.Random(7)
+    unique = [make_receipt(rng) for _ in range(max(1, int(args.receipts * (1 - args.duplicates))))]
+    corpus = unique + [rng.choice(unique) for _ in range(args.receipts - len(unique))]
+    rng.shuffle(corpus)
+
+    with tempfile.TemporaryDirectory() as plain_dir, tempfile.TemporaryDirectory() as cas_dir:
+        plain = FileSystemStorage(location=plain_dir)
+        cas = ReceiptStorage(location=cas_dir)
+
+        results = {}
+        for label, storage in [('plain', plain), ('content-addressed', cas)]:
+            names = []
+            start = time.perf_counter()
+            for data in corpus:
+                names.append(storage.save('receipts/receipt.jpg', ContentFile(data)))
+            elapsed = time.perf_counter() - start
+            results[label] = (storage, names, elapsed, dir_size(storage.location))
+
+        print(f"Receipt storage benchmark ({len(corpus)} uploads, {len(unique)} unique)")
+        print("=" * 72)
+        for label, (storage, names, elapsed, size) in results.items():
+            preview = names[:50]
+            if label == 'plain':
+                preview_bytes = sum(storage.size(n) for n in preview)
+            else:
+                preview_bytes = sum(storage.size(thumbnail_name(n, args.preview_size)) for n in preview)
+            print(f"{label:<18} disk={size / 1e6:8.2f} MB  upload={elapsed * 1000 / len(corpus):7.1f} ms/file  "
+                  f"preview(50)={preview_bytes / 1e3:9.1f} kB")
+
+        plain_size = results['plain'][3]
+        cas_size = results['content-addressed'][3]
+        print(f"\nDisk use reduced by {100 * (1 - cas_size / plain_size):.1f}% (including thumbnails)")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
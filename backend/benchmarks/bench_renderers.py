@@ -0,0 +1,60 @@
+"""
+Compare DRF's JSONRenderer with ORJSONRenderer on the list and analytics payloads.
+
+Usage:
+  python -m benchmarks.bench_renderers [--expenses 5000]
+
+Reports the best render time per call and the bytes on the wire for an
+uncompressed, gzip and brotli encoded body.
+"""
+
+import argparse
+import gzip
+
+from benchmarks import create_benchmark_db, setup_django, timeit
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--expenses', type=int, default=5000)
+    args = parser.parse_args()
+
+    setup_django()
+    create_benchmark_db()
+
+    from rest_framework.renderers import JSONRenderer
+    from rest_framework.test import APIRequestFactory
+
+    from expenses.benchdata import seed_expenses
+    from expenses.middleware import brotli
+    from expenses.renderers import ORJSONRenderer
+    from expenses.views import ExpenseViewSet
+
+    seed_expenses(args.expenses)
+
+    factory = APIRequestFactory()
+    payloads = {}
+    for name, actions, url in [
+        ('list', {'get': 'list'}, '/api/expenses/'),
+        ('analytics', {'get': 'analytics'}, '/api/expenses/analytics/?period=all'),
+    ]:
+        view = ExpenseViewSet.as_view(actions)
+        payloads[name] = view(factory.get(url)).data
+
+    renderers = [('JSONRenderer', JSONRenderer()), ('ORJSONRenderer', ORJSONRenderer())]
+
+    print(f"Render benchmark ({args.expenses} expenses)")
+    print("=" * 78)
+    print(f"{'payload':<10} {'renderer':<15} {'ms/render':>10} {'raw B':>10} {'gzip B':>10} {'br B':>10}")
+    for name, data in payloads.items():
+        for renderer_name, renderer in renderers:
+            body = renderer.render(data)
+            ms = timeit(lambda: renderer.render(data), repeat=3, number=5)
+            gz = len(gzip.compress(body, compresslevel=6))
+            br = len(brotli.compress(body, quality=5)) if brotli else float('nan')
+            print(f"{name:<10} {renderer_name:<15} {ms:>10.2f} {len(body):>10} {gz:>10} {br:>10}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
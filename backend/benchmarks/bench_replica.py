@@ -0,0 +1,143 @@
+"""
+Write latency under concurrent analytics load, with and without the read replica.
+
+Usage:
+  python -m benchmarks.bench_replica [--expenses 20000] [--readers 4] [--writes 200]
+
+A throwaway primary SQLite file (WAL mode) is seeded and copied to a
+replica file with expenses.routers.copy_sqlite_replica(). The writer
+thread then creates --writes expenses through POST /api/expenses/ while
+--readers threads keep requesting analytics, summary and budget status, in
+three scenarios: no readers, readers on the primary, and readers on the
+replica (REPLICA_DATABASE set). Readers use their own usernames, so the
+writer's read-your-writes marker does not pin them to the primary.
+
+Requests go through Django's test client. Readers run in forked
+processes, so they contend with the writer for the database and the CPU
+but not for the GIL. The first few writes are discarded as warm-up.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import statistics
+import tempfile
+import time
+
+from benchmarks import create_benchmark_db, setup_django
+
+READ_PATHS = [
+    '/api/expenses/analytics/?period=all',
+    '/api/expenses/summary/',
+    '/api/budgets/status/',
+]
+
+
+def percentile(sorted_values, q):
+    return sorted_values[min(int(q / 100 * len(sorted_values)), len(sorted_values) - 1)]
+
+
+def reader(index, stop, reads, sources):
+    from django.db import connections
+    from django.test import Client
+
+    client = Client(HTTP_X_USERNAME=f'reader{index}')
+    count, served_by = 0, set()
+    while not stop.is_set():
+        response = client.get(READ_PATHS[count % len(READ_PATHS)])
+        served_by.add(response.get('X-Read-Source'))
+        count += 1
+    with reads.get_lock():
+        reads.value += count
+    sources.put(served_by)
+    connections.close_all()
+
+
+def run_scenario(readers, writes, replica, warmup=10):
+    from django.db import connections
+    from django.test import Client
+    from django.test.utils import override_settings
+
+    context = multiprocessing.get_context('fork')
+    stop, reads, sources = context.Event(), context.Value('i', 0), context.SimpleQueue()
+
+    with override_settings(REPLICA_DATABASE='replica' if replica else None):
+        # Children must open their own database connections
+        connections.close_all()
+        processes = [context.Process(target=reader, args=(i, stop, reads, sources)) for i in range(readers)]
+        for process in processes:
+            process.start()
+
+        client = Client(HTTP_X_USERNAME='writer')
+        latencies, errors = [], 0
+        start = None
+        for i in range(warmup + writes):
+            if i == warmup:
+                latencies, start = [], time.perf_counter()
+            body = json.dumps({
+                'username': 'writer', 'merchant_name': f'Shop {i % 20}', 'amount': '12.50',
+                'category': 'food', 'payment_method': 'cash',
+            })
+            began = time.perf_counter()
+            response = client.post('/api/expenses/', data=body, content_type='application/json')
+            latencies.append((time.perf_counter() - began) * 1000)
+            errors += response.status_code != 201
+        elapsed = time.perf_counter() - start
+
+        stop.set()
+        served_by = set()
+        for process in processes:
+            served_by |= sources.get()
+            process.join()
+
+    latencies.sort()
+    return {
+        'p50': statistics.median(latencies),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+        'errors': errors,
+        'reads_per_s': reads.value / elapsed,
+        'sources': sorted(source for source in served_by if source),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--expenses', type=int, default=20000)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--writes', type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as scratch:
+        # The replica alias is only defined when REPLICA_DB_NAME is set at startup
+        os.environ['REPLICA_DB_NAME'] = os.path.join(scratch, 'replica.sqlite3')
+        setup_django()
+        create_benchmark_db(os.path.join(scratch, 'primary.sqlite3'))
+
+        from django.test.utils import override_settings
+
+        from expenses.benchdata import seed_budgets, seed_expenses
+        from expenses.routers import copy_sqlite_replica
+
+        usernames = [f'user{i}' for i in range(20)]
+        seed_expenses(args.expenses, usernames=usernames, days=365)
+        seed_budgets(usernames)
+        copy_sqlite_replica()
+
+        print(f"Write latency under analytics load ({args.expenses} expenses, {args.readers} readers, "
+              f"{args.writes} writes)")
+        print("=" * 78)
+        scenarios = [('no readers', 0, False), ('readers on primary', args.readers, False),
+                     ('readers on replica', args.readers, True)]
+        with override_settings(CLASSIFIER_SNAPSHOT_PATH='', METRICS_ENABLED=False, SLOW_REQUEST_MS=10 ** 9):
+            for label, readers, replica in scenarios:
+                result = run_scenario(readers, args.writes, replica)
+                print(f"{label:<20} write p50={result['p50']:6.1f} ms  p95={result['p95']:6.1f} ms  "
+                      f"p99={result['p99']:6.1f} ms  errors={result['errors']}  "
+                      f"reads={result['reads_per_s']:6.1f}/s  served by {','.join(result['sources']) or '-'}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,82 @@
+"""
+Time to first field: scan_receipt vs. the streamed scan_receipt_stream.
+
+Usage:
+  python -m benchmarks.bench_scan_stream [--scans 10] [--latency 3.0]
+
+Both endpoints run against benchmarks.extractors.StubReceiptExtractor with
+`latency` seconds of simulated model time; the streaming stub spreads that
+time over the fields as a streamed response would. For scan_receipt the
+first field is only visible with the complete response. For the stream the
+time of the first `field` event, of the `expense` event and of the end of
+the stream are reported.
+"""
+
+import argparse
+import statistics
+import tempfile
+import time
+
+from benchmarks import create_benchmark_db, setup_django
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scans', type=int, default=10)
+    parser.add_argument('--latency', type=float, default=3.0)
+    args = parser.parse_args()
+
+    setup_django()
+    create_benchmark_db()
+
+    from django.core.files.uploadedfile import SimpleUploadedFile
+    from django.test import Client
+    from django.test.utils import override_settings
+
+    from benchmarks.extractors import StubReceiptExtractor
+    from benchmarks.load_api import make_receipt_photos
+
+    StubReceiptExtractor.latency = args.latency
+    photos = make_receipt_photos(args.scans * 2)
+    client = Client()
+    blocking, first_field, saved, total = [], [], [], []
+
+    with tempfile.TemporaryDirectory() as media_dir, override_settings(
+        MEDIA_ROOT=media_dir, CLASSIFIER_SNAPSHOT_PATH='',
+        RECEIPT_EXTRACTOR='benchmarks.extractors.StubReceiptExtractor',
+    ):
+        for i in range(args.scans):
+            upload = SimpleUploadedFile('receipt.jpg', photos[2 * i], content_type='image/jpeg')
+            start = time.perf_counter()
+            response = client.post('/api/expenses/scan_receipt/', {'receipt_image': upload})
+            assert response.status_code == 201, response.content
+            blocking.append(time.perf_counter() - start)
+
+            upload = SimpleUploadedFile('receipt.jpg', photos[2 * i + 1], content_type='image/jpeg')
+            start = time.perf_counter()
+            response = client.post('/api/expenses/scan_receipt_stream/', {'receipt_image': upload})
+            first = expense = None
+            for chunk in response.streaming_content:
+                now = time.perf_counter() - start
+                if first is None and chunk.startswith(b'event: field'):
+                    first = now
+                elif chunk.startswith(b'event: expense'):
+                    expense = now
+                elif chunk.startswith(b'event: error'):
+                    raise SystemExit(chunk.decode())
+            total.append(time.perf_counter() - start)
+            first_field.append(first)
+            saved.append(expense)
+
+    def ms(values):
+        return f"{statistics.median(values) * 1000:7.0f} ms"
+
+    print(f"Scan time to first field ({args.scans} scans, {args.latency:.1f} s simulated model time)")
+    print("=" * 78)
+    print(f"scan_receipt         first field {ms(blocking)}  saved {ms(blocking)}  total {ms(blocking)}")
+    print(f"scan_receipt_stream  first field {ms(first_field)}  saved {ms(saved)}  total {ms(total)}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,114 @@
+"""
+Upload handling of scan_receipt: the old temp-file pipeline vs. the single-pass one.
+
+Usage:
+  python -m benchmarks.bench_scan_upload [--receipts 20] [--width 1500] [--height 2600]
+
+Both pipelines parse the same multipart request body, validate the image,
+decode it as the extractor does and store it with ReceiptStorage (hash,
+thumbnails, write). The old one uses Django's default upload handlers
+(temporary file above 2.5 MB), copies the upload to a NamedTemporaryFile
+for the extractor and hashes it again in storage. The new one uses
+ReceiptUploadParser's hashing handler and passes the one buffer along.
+
+Bytes read/written through syscalls come from /proc/self/io (Linux), so
+they include page-cache hits: they count I/O passes, not device traffic.
+"""
+
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from benchmarks import setup_django
+from benchmarks.bench_receipt_storage import make_receipt
+
+
+def io_counters():
+    """(read bytes, written bytes) through syscalls so far, or None off Linux"""
+    try:
+        with open('/proc/self/io') as f:
+            values = dict(line.split(': ') for line in f.read().splitlines())
+    except OSError:
+        return None
+    return int(values['rchar']), int(values['wchar'])
+
+
+def legacy_pipeline(request, storage):
+    from django import forms
+    from PIL import Image
+
+    upload = forms.ImageField().clean(request.FILES['receipt_image'])
+    suffix = os.path.splitext(upload.name)[1] or '.jpg'
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
+        for chunk in upload.chunks():
+            tmp.write(chunk)
+        temp_path = tmp.name
+    try:
+        Image.open(temp_path).load()
+        return storage.save(upload.name, upload)
+    finally:
+        os.remove(temp_path)
+
+
+def single_pass_pipeline(request, storage):
+    from PIL import Image
+
+    from expenses.uploads import HashingUploadHandler, InPlaceImageField
+
+    request.upload_handlers = [HashingUploadHandler(request)]
+    upload = InPlaceImageField().clean(request.FILES['receipt_image'])
+    upload.seek(0)
+    Image.open(upload).load()
+    return storage.save(upload.name, upload)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--receipts', type=int, default=20)
+    parser.add_argument('--width', type=int, default=1500)
+    parser.add_argument('--height', type=int, default=2600)
+    args = parser.parse_args()
+
+    setup_django()
+
+    from django.core.files.uploadedfile import SimpleUploadedFile
+    from django.test import RequestFactory
+
+    from expenses.storage import ReceiptStorage
+
+    rng = random.Random(3)
+    photos = [make_receipt(rng, args.width, args.height) for _ in range(args.receipts)]
+    factory = RequestFactory()
+    average_size = sum(len(p) for p in photos) / len(photos)
+
+    print(f"Scan upload benchmark ({args.receipts} receipts, {average_size / 1e6:.2f} MB average)")
+    print("=" * 78)
+    for label, pipeline in [('temp file (old)', legacy_pipeline), ('single pass', single_pass_pipeline)]:
+        with tempfile.TemporaryDirectory() as media_dir:
+            storage = ReceiptStorage(location=media_dir)
+            timings, read_bytes, written_bytes = [], 0, 0
+            for data in photos:
+                request = factory.post('/api/expenses/scan_receipt/', {
+                    'receipt_image': SimpleUploadedFile('receipt.jpg', data, content_type='image/jpeg'),
+                })
+                before = io_counters()
+                start = time.perf_counter()
+                pipeline(request, storage)
+                timings.append(time.perf_counter() - start)
+                after = io_counters()
+                if before and after:
+                    read_bytes += after[0] - before[0]
+                    written_bytes += after[1] - before[1]
+                request.close()
+
+        count = len(photos)
+        print(f"{label:<16} median={statistics.median(timings) * 1000:7.1f} ms  "
+              f"read={read_bytes / count / 1e6:6.2f} MB/scan  written={written_bytes / count / 1e6:6.2f} MB/scan")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
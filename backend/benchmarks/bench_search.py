@@ -0,0 +1,69 @@
+"""
+Latency of the FTS5 expense search at scale.
+
+Usage:
+  python -m benchmarks.bench_search [--expenses 1000000] [--users 1000] [--db /tmp/search.sqlite3]
+
+Seeds synthetic expenses (the triggers keep the index in sync while
+inserting), then times typical queries with and without a username.
+Pass --db to keep the seeded database between runs.
+"""
+
+import argparse
+import statistics
+import time
+
+from benchmarks import create_benchmark_db, setup_django
+
+QUERIES = ['starbucks', 'latte', 'milk', 'star', 'whole foods', 'uber', 'usb cable', 'groceries', 'ibu']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--expenses', type=int, default=100000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--runs', type=int, default=50)
+    parser.add_argument('--db', help="SQLite file to seed/reuse instead of an in-memory database")
+    args = parser.parse_args()
+
+    setup_django()
+    if args.db:
+        from django.conf import settings
+        from django.core.management import call_command
+        from django.db import connections
+        settings.DATABASES['default']['NAME'] = args.db
+        connections['default'].close()
+        connections['default'].settings_dict['NAME'] = args.db
+        call_command('migrate', verbosity=0)
+    else:
+        create_benchmark_db()
+
+    from expenses.benchdata import seed_expenses
+    from expenses.models import Expense
+    from expenses.search import search_expenses
+
+    existing = Expense.objects.count()
+    if existing < args.expenses:
+        usernames = [f'user{i}' for i in range(args.users)]
+        start = time.perf_counter()
+        seed_expenses(args.expenses - existing, usernames=usernames, seed=existing, batch_size=5000)
+        print(f"Seeded {args.expenses - existing} expenses in {time.perf_counter() - start:.1f}s")
+
+    print(f"Search benchmark ({Expense.objects.count()} expenses, {args.users} users)")
+    print("=" * 64)
+    print(f"{'query':<14} {'scope':<8} {'p50 ms':>8} {'p95 ms':>8} {'hits':>6}")
+    for query in QUERIES:
+        for scope, username in [('all', None), ('user', 'user7')]:
+            timings = []
+            for _ in range(args.runs):
+                start = time.perf_counter()
+                hits = search_expenses(query, username=username, limit=50)
+                timings.append((time.perf_counter() - start) * 1000)
+            timings.sort()
+            p95 = timings[int(len(timings) * 0.95) - 1]
+            print(f"{query:<14} {scope:<8} {statistics.median(timings):>8.2f} {p95:>8.2f} {len(hits):>6}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
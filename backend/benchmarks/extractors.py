@@ -0,0 +1,65 @@
+"""
+Receipt extractor stand-in for load tests.
+
+Set RECEIPT_EXTRACTOR = 'benchmarks.extractors.StubReceiptExtractor' to
+exercise scan_receipt without calling Gemini. `latency` simulates the
+model round trip; stream_receipt_data spreads it over the fields, as a
+streamed response would.
+"""
+
+import random
+import time
+
+from expenses.benchdata import ITEMS, MERCHANTS, PAYMENT_METHODS
+
+
+class StubReceiptExtractor:
+    latency = 0.0
+
+    def __init__(self):
+        self.rng = random.Random()
+
+    def extract_receipt_data(self, image_file, lite=False):
+        if self.latency:
+            time.sleep(self.latency)
+        return self._receipt(lite)
+
+    def stream_receipt_data(self, image_file, lite=False):
+        result = self._receipt(lite)
+        data = result['data']
+        steps = len(data) + len(data['items'])
+        for name, value in data.items():
+            if name != 'items':
+                time.sleep(self.latency / steps)
+                yield ('field', name, value)
+        for index, item in enumerate(data['items']):
+            time.sleep(self.latency / steps)
+            yield ('item', index, item)
+        yield ('result', {**result, 'raw_text': None})
+        if not lite:
+            yield ('raw_text', result['raw_text'])
+
+    def _receipt(self, lite):
+        category = self.rng.choice(list(MERCHANTS))
+        items = [
+            {'name': self.rng.choice(ITEMS[category]), 'quantity': 1, 'price': 4.5, 'total': 4.5}
+            for _ in range(self.rng.randint(1, 4))
+        ]
+        data = {
+            'merchant_name': self.rng.choice(MERCHANTS[category]),
+            'amount': round(4.5 * len(items) * 1.08, 2),
+            'currency': 'USD',
+            'date': time.strftime('%Y-%m-%d'),
+            'payment_method': self.rng.choice(PAYMENT_METHODS),
+            'items': items,
+            'tax': round(4.5 * len(items) * 0.08, 2),
+            'tip': 0,
+        }
+        if not lite:
+            data.update({'category': category, 'description': None})
+        return {'success': True, 'data': data, 'raw_text': None if lite else 'stub receipt'}
+
+    def suggest_category(self, merchant_name, items):
+        if self.latency:
+            time.sleep(self.latency / 4)
+        return 'other'
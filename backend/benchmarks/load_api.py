@@ -0,0 +1,256 @@
+"""
+Load test of the REST API endpoints with latency percentiles and query counts.
+
+Usage:
+  python -m benchmarks.load_api [--expenses 5000] [--users 50] [--concurrency 8]
+                                [--requests 200] [--endpoints list,summary,...]
+                                [--output results.json] [--baseline baseline.json]
+
+Requests go through Django's test client in worker threads, so no server
+is needed and the SQL issued by each request can be counted. By default a
+throwaway SQLite file database (WAL mode) is seeded first; with --existing-db the
+configured database is used as is (seed it with `manage.py
+seed_benchmark_data`; scan adds expenses, so use a disposable copy).
+
+scan uploads generated receipt photos and uses
+benchmarks.extractors.StubReceiptExtractor instead of Gemini. On SQLite,
+concurrent scans can fail with "database is locked" (Django 5.0 opens
+deferred transactions, so the busy timeout does not always apply); those
+requests are counted as errors.
+
+Each endpoint is driven on its own for --requests requests at
+--concurrency, and p50/p95/p99 latency, throughput and queries per request
+are reported. --output writes the results as JSON; with --baseline the run
+is compared against an earlier output and the exit status is 1 if p95 or
+throughput got worse by more than --tolerance, or queries or errors went up.
+"""
+
+import argparse
+import io
+import json
+import math
+import os
+import platform
+import random
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks import create_benchmark_db, setup_django
+
+ENDPOINTS = {
+    'list': ('get', '/api/expenses/'),
+    'summary': ('get', '/api/expenses/summary/'),
+    'analytics': ('get', '/api/expenses/analytics/?period=month'),
+    'budget_status': ('get', '/api/budgets/status/'),
+    'scan': ('post', '/api/expenses/scan_receipt/'),
+}
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an ascending list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(q / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+def make_receipt_photos(count, seed=7):
+    """Small distinct JPEGs so storage hashing and thumbnails do real work"""
+    from PIL import Image, ImageDraw
+
+    rng = random.Random(seed)
+    photos = []
+    for _ in range(count):
+        image = Image.new('RGB', (600, 1000), (245, 245, 245))
+        draw = ImageDraw.Draw(image)
+        for y in range(60, 940, 30):
+            width = rng.randint(80, 480)
+            draw.rectangle([50, y, 50 + width, y + 14], fill=(rng.randint(10, 90),) * 3)
+        buffer = io.BytesIO()
+        image.save(buffer, format='JPEG', quality=85)
+        photos.append(buffer.getvalue())
+    return photos
+
+
+class QueryCounter:
+    """connection.execute_wrapper that counts the statements of one request"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def run_endpoint(name, args, usernames, photos):
+    from django.core.files.uploadedfile import SimpleUploadedFile
+    from django.db import connection
+    from django.test import Client
+
+    method, path = ENDPOINTS[name]
+    local = threading.local()
+    counter = iter(range(args.requests + args.warmup))
+    counter_lock = threading.Lock()
+
+    def one_request():
+        with counter_lock:
+            index = next(counter)
+        if not hasattr(local, 'client'):
+            local.client = Client()
+        headers = {'HTTP_X_USERNAME': usernames[index % len(usernames)], 'HTTP_ACCEPT': 'application/json'}
+        queries = QueryCounter()
+        start = time.perf_counter()
+        with connection.execute_wrapper(queries):
+            if method == 'post':
+                upload = SimpleUploadedFile('receipt.jpg', photos[index % len(photos)], content_type='image/jpeg')
+                response = local.client.post(path, {'receipt_image': upload}, **headers)
+            else:
+                response = local.client.get(path, **headers)
+        elapsed = time.perf_counter() - start
+        return index >= args.warmup, elapsed, queries.count, response.status_code < 400
+
+    def worker(jobs):
+        results = [one_request() for _ in range(jobs)]
+        connection.close()
+        return results
+
+    total = args.requests + args.warmup
+    shares = [total // args.concurrency + (1 if i < total % args.concurrency else 0)
+              for i in range(args.concurrency)]
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = [r for batch in pool.map(worker, shares) for r in batch]
+    wall = time.perf_counter() - wall_start
+
+    measured = [r for r in results if r[0]]
+    latencies = sorted(r[1] * 1000 for r in measured)
+    return {
+        'requests': len(measured),
+        'errors': sum(1 for r in measured if not r[3]),
+        'p50_ms': round(percentile(latencies, 50), 2),
+        'p95_ms': round(percentile(latencies, 95), 2),
+        'p99_ms': round(percentile(latencies, 99), 2),
+        'mean_ms': round(sum(latencies) / len(latencies), 2) if latencies else 0.0,
+        'throughput_rps': round(len(results) / wall, 1) if wall else 0.0,
+        'queries_per_request': round(sum(r[2] for r in measured) / len(measured), 1) if measured else 0.0,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Print a comparison table; return the list of regressions"""
+    regressions = []
+    print(f"\nAgainst baseline (tolerance {tolerance:.0%})")
+    print(f"{'endpoint':<15}{'p95 ms':>20}{'req/s':>20}{'queries':>16}")
+    for name, current in results['endpoints'].items():
+        previous = baseline.get('endpoints', {}).get(name)
+        if previous is None:
+            print(f"{name:<15}{'(not in baseline)':>20}")
+            continue
+        p95 = f"{previous['p95_ms']:.1f} -> {current['p95_ms']:.1f}"
+        rps = f"{previous['throughput_rps']:.1f} -> {current['throughput_rps']:.1f}"
+        queries = f"{previous['queries_per_request']:g} -> {current['queries_per_request']:g}"
+        print(f"{name:<15}{p95:>20}{rps:>20}{queries:>16}")
+        if current['p95_ms'] > previous['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {previous['p95_ms']}ms -> {current['p95_ms']}ms")
+        if current['throughput_rps'] < previous['throughput_rps'] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {previous['throughput_rps']} -> {current['throughput_rps']} req/s")
+        if current['queries_per_request'] > previous['queries_per_request']:
+            regressions.append(f"{name}: queries {previous['queries_per_request']} -> {current['queries_per_request']}")
+        if current['errors'] > previous['errors']:
+            regressions.append(f"{name}: errors {previous['errors']} -> {current['errors']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--expenses', type=int, default=5000, help="Rows to seed (ignored with --existing-db)")
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=200, help="Measured requests per endpoint")
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--endpoints', default=','.join(ENDPOINTS))
+    parser.add_argument('--extractor-latency', type=float, default=0.0,
+                        help="Seconds the stub extractor sleeps per scan")
+    parser.add_argument('--existing-db', action='store_true')
+    parser.add_argument('--output', help="Write results as JSON to this file")
+    parser.add_argument('--baseline', help="Compare against a previous --output file")
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    endpoints = [name.strip() for name in args.endpoints.split(',') if name.strip()]
+    unknown = set(endpoints) - set(ENDPOINTS)
+    if unknown:
+        parser.error(f"unknown endpoint(s): {', '.join(sorted(unknown))}")
+
+    setup_django()
+
+    from django.conf import settings
+    from django.test.utils import override_settings, setup_test_environment
+
+    from benchmarks.extractors import StubReceiptExtractor
+
+    usernames = [f'bench{i}' for i in range(args.users)]
+    StubReceiptExtractor.latency = args.extractor_latency
+    photos = make_receipt_photos(min(args.requests, 50)) if 'scan' in endpoints else []
+    results = {
+        'meta': {
+            'expenses': None if args.existing_db else args.expenses,
+            'users': args.users,
+            'concurrency': args.concurrency,
+            'requests': args.requests,
+            'database': settings.DATABASES['default']['ENGINE'],
+            'python': platform.python_version(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'endpoints': {},
+    }
+
+    with tempfile.TemporaryDirectory(prefix='load_api_') as scratch:
+        if args.existing_db:
+            setup_test_environment()
+        else:
+            from expenses.benchdata import seed_budgets, seed_expenses
+
+            create_benchmark_db(path=os.path.join(scratch, 'load_api.sqlite3'))
+            start = time.perf_counter()
+            seed_expenses(args.expenses, usernames=usernames, batch_size=5000, resolve_merchants=True)
+            seed_budgets(usernames)
+            print(f"Seeded {args.expenses} expenses for {args.users} users in {time.perf_counter() - start:.1f}s")
+
+        print(f"\nAPI load test ({args.concurrency} concurrent, {args.requests} requests per endpoint)")
+        print("=" * 68)
+        print(f"{'endpoint':<15}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'req/s':>9}{'queries':>9}{'errors':>8}")
+        with override_settings(
+            MEDIA_ROOT=os.path.join(scratch, 'media'),
+            CLASSIFIER_SNAPSHOT_PATH='',
+            RECEIPT_EXTRACTOR='benchmarks.extractors.StubReceiptExtractor',
+        ):
+            for name in endpoints:
+                stats = run_endpoint(name, args, usernames, photos)
+                results['endpoints'][name] = stats
+                print(f"{name:<15}{stats['p50_ms']:>9.1f}{stats['p95_ms']:>9.1f}{stats['p99_ms']:>9.1f}"
+                      f"{stats['throughput_rps']:>9.1f}{stats['queries_per_request']:>9g}{stats['errors']:>8}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nWrote {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("\nRegressions:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("\nNo regressions")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -48,7 +48,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'expenses.metrics.MetricsMiddleware',
+    'expenses.routers.ReadYourWritesMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'expenses.middleware.CompressionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -89,6 +92,26 @@ DATABASES = {
     }
 }
 
+# Optional read replica for the reporting endpoints (see expenses/routers.py).
+# Locally, REPLICA_DB_NAME can be a second SQLite file refreshed with
+# `manage.py sync_replica`.
+REPLICA_DB_NAME = os.getenv('REPLICA_DB_NAME')
+if REPLICA_DB_NAME:
+    DATABASES['replica'] = {
+        'ENGINE': os.getenv('REPLICA_DB_ENGINE', 'django.db.backends.sqlite3'),
+        'NAME': REPLICA_DB_NAME,
+        'HOST': os.getenv('REPLICA_DB_HOST', ''),
+        'PORT': os.getenv('REPLICA_DB_PORT', ''),
+        'USER': os.getenv('REPLICA_DB_USER', ''),
+        'PASSWORD': os.getenv('REPLICA_DB_PASSWORD', ''),
+        'TEST': {'MIRROR': 'default'},
+    }
+REPLICA_DATABASE = 'replica' if REPLICA_DB_NAME else None
+DATABASE_ROUTERS = ['expenses.routers.ReplicaRouter']
+
+# Seconds a client's reads stay on the primary after its own write
+READ_YOUR_WRITES_SECONDS = int(os.getenv('READ_YOUR_WRITES_SECONDS', '10'))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -130,6 +153,21 @@ STATIC_URL = 'static/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Receipt uploads are buffered in memory up to this size, then spill to disk (see expenses/uploads.py)
+RECEIPT_UPLOAD_MAX_MEMORY_SIZE = int(os.getenv('RECEIPT_UPLOAD_MAX_MEMORY_SIZE', str(10 * 1024 * 1024)))
+
+# Receipt thumbnails (longest edge in pixels) generated at upload time
+RECEIPT_THUMBNAIL_SIZES = [int(s) for s in os.getenv('RECEIPT_THUMBNAIL_SIZES', '128,256,512').split(',')]
+RECEIPT_THUMBNAIL_QUALITY = int(os.getenv('RECEIPT_THUMBNAIL_QUALITY', '75'))
+
+# Multi-page scans (TIFF and PDF): page limit, pages extracted at once, PDF rasterization resolution
+RECEIPT_MAX_PAGES = int(os.getenv('RECEIPT_MAX_PAGES', '10'))
+RECEIPT_PAGE_CONCURRENCY = int(os.getenv('RECEIPT_PAGE_CONCURRENCY', '4'))
+RECEIPT_PDF_DPI = int(os.getenv('RECEIPT_PDF_DPI', '200'))
+# Largest page in pixels: bigger image pages are rejected, bigger PDF pages are
+# rendered at a lower resolution (rejected if that would be below 72 DPI)
+RECEIPT_MAX_PAGE_PIXELS = int(os.getenv('RECEIPT_MAX_PAGE_PIXELS', '25000000'))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -143,12 +181,95 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny',
     ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'expenses.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
     'DEFAULT_PARSER_CLASSES': [
-        'rest_framework.parsers.JSONParser',
+        'expenses.parsers.ORJSONParser',
         'rest_framework.parsers.MultiPartParser',
         'rest_framework.parsers.FormParser',
     ],
 }
 
+# Response compression (brotli when installed, otherwise gzip)
+RESPONSE_COMPRESSION_MIN_BYTES = int(os.getenv('RESPONSE_COMPRESSION_MIN_BYTES', '1024'))
+RESPONSE_COMPRESSION_BROTLI_QUALITY = int(os.getenv('RESPONSE_COMPRESSION_BROTLI_QUALITY', '5'))
+RESPONSE_COMPRESSION_GZIP_LEVEL = int(os.getenv('RESPONSE_COMPRESSION_GZIP_LEVEL', '6'))
+
+# Minimum trigram similarity for a receipt merchant name to join an existing merchant
+MERCHANT_MATCH_THRESHOLD = float(os.getenv('MERCHANT_MATCH_THRESHOLD', '0.6'))
+
+# Local category/payment method classifier
+CLASSIFIER_SHORTCUT_ENABLED = os.getenv('CLASSIFIER_SHORTCUT_ENABLED', 'True') == 'True'
+CLASSIFIER_MIN_SAMPLES = int(os.getenv('CLASSIFIER_MIN_SAMPLES', '20'))
+CLASSIFIER_CONFIDENCE_THRESHOLD = float(os.getenv('CLASSIFIER_CONFIDENCE_THRESHOLD', '0.85'))
+# Share of recent predictions that must be confident for scans to use the lite prompt
+CLASSIFIER_MIN_CONFIDENT_RATE = float(os.getenv('CLASSIFIER_MIN_CONFIDENT_RATE', '0.8'))
+CLASSIFIER_SNAPSHOT_PATH = os.getenv('CLASSIFIER_SNAPSHOT_PATH', str(BASE_DIR / 'classifier.pickle'))
+CLASSIFIER_SNAPSHOT_INTERVAL = int(os.getenv('CLASSIFIER_SNAPSHOT_INTERVAL', '300'))  # seconds
+# Seconds a worker trusts its model's version before re-reading it; other
+# workers' writes reach its predictions within this
+CLASSIFIER_VERSION_TTL = float(os.getenv('CLASSIFIER_VERSION_TTL', '5'))
+
+# Currency all aggregates are reported in (see expenses/fx.py)
+BASE_CURRENCY = os.getenv('BASE_CURRENCY', 'USD').upper()
+
+# Days of history used by /api/expenses/insights/ and compute_insights
+INSIGHTS_WINDOW_DAYS = int(os.getenv('INSIGHTS_WINDOW_DAYS', '90'))
+
+# Most rows one bulk update/delete request may touch (see expenses/bulk.py)
+BULK_MAX_ROWS = int(os.getenv('BULK_MAX_ROWS', '10000'))
+
+# archive_expenses moves expenses older than this many days (rounded down to a
+# month) out of the live table (see expenses/archive.py)
+ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', '730'))
+
+# Offline sync batches (see expenses/sync.py)
+SYNC_BATCH_MAX_MUTATIONS = int(os.getenv('SYNC_BATCH_MAX_MUTATIONS', '500'))
+IDEMPOTENCY_KEY_TTL_HOURS = int(os.getenv('IDEMPOTENCY_KEY_TTL_HOURS', '72'))  # Purged by purge_idempotency_keys
+
+# Request metrics exposed at /metrics (see expenses/metrics.py)
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'True') == 'True'
+METRICS_DIR = os.getenv('METRICS_DIR', '')  # Shared by gunicorn workers; empty = this process only
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', '5'))  # seconds
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')  # Scrapers send "Authorization: Bearer <token>"; unset = staff only
+SLOW_REQUEST_MS = int(os.getenv('SLOW_REQUEST_MS', '1000'))
+SLOW_QUERY_MS = int(os.getenv('SLOW_QUERY_MS', '200'))
+
+# On-demand request profiling (see expenses/profiling.py)
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', 'False') == 'True'
+PROFILING_SAMPLE_RATE = float(os.getenv('PROFILING_SAMPLE_RATE', '0'))  # Fraction of requests profiled without a header
+PROFILING_INTERVAL_MS = float(os.getenv('PROFILING_INTERVAL_MS', '1'))
+PROFILING_TOKEN_MAX_AGE = int(os.getenv('PROFILING_TOKEN_MAX_AGE', '3600'))  # seconds
+PROFILING_MAX_PROFILES = int(os.getenv('PROFILING_MAX_PROFILES', '500'))
+
+# Admin changelists stop counting matching rows at this many; unfiltered
+# lists use the database's row estimate instead of COUNT(*)
+ADMIN_COUNT_LIMIT = int(os.getenv('ADMIN_COUNT_LIMIT', '10000'))
+# Lifetime of cached admin filter choices (distinct currencies)
+ADMIN_FILTER_CACHE_SECONDS = int(os.getenv('ADMIN_FILTER_CACHE_SECONDS', '600'))
+
+# Live summary/budget updates (/api/live/, ASGI only): every expense write
+# then also writes an outbox row, so turn them on only when serving the ASGI
+# application; relay poll interval, stream keepalive and outbox retention
+LIVE_UPDATES_ENABLED = os.getenv('LIVE_UPDATES_ENABLED', 'False') == 'True'
+LIVE_POLL_INTERVAL = float(os.getenv('LIVE_POLL_INTERVAL', '0.5'))
+LIVE_HEARTBEAT_SECONDS = float(os.getenv('LIVE_HEARTBEAT_SECONDS', '20'))
+LIVE_EVENT_TTL_SECONDS = int(os.getenv('LIVE_EVENT_TTL_SECONDS', '600'))
+
 # Gemini API Configuration
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY', '')
+
+# Extraction models, cheapest first; a scan escalates to the next one when the
+# result fails the consistency checks (see expenses/tiering.py)
+GEMINI_MODEL_TIERS = [
+    name.strip() for name in os.getenv('GEMINI_MODEL_TIERS', 'gemini-2.5-flash-lite,gemini-2.5-flash').split(',')
+    if name.strip()
+]
+# Allowed gap between the item totals and the receipt total, as a fraction of the total
+EXTRACTION_TOTAL_TOLERANCE = float(os.getenv('EXTRACTION_TOTAL_TOLERANCE', '0.02'))
+EXTRACTION_CALL_TTL_DAYS = int(os.getenv('EXTRACTION_CALL_TTL_DAYS', '90'))  # Purged by purge_extraction_calls
+
+# Extractor class used by scan_receipt (the load benchmarks swap in a stub)
+RECEIPT_EXTRACTOR = os.getenv('RECEIPT_EXTRACTOR', 'expenses.gemini_service.GeminiReceiptExtractor')
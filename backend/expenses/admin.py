@@ -1,14 +1,161 @@
-from django.contrib import admin
-from .models import Expense, Budget
+import csv
+
+from django.conf import settings
+from django.contrib import admin, messages
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import connection
+from django.http import StreamingHttpResponse
+from django.utils.functional import cached_property
+
+from . import bulk, search
+from .models import Expense, Budget, FxRate, Merchant, MerchantAlias, RequestProfile
+
+EXPORT_COLUMNS = [
+    'id', 'username', 'date', 'merchant_name', 'amount', 'currency', 'amount_base',
+    'category', 'payment_method', 'tax', 'tip', 'description',
+]
+
+
+def _row_estimate(model):
+    """The database's idea of the table's row count, without scanning it; None when unknown"""
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(%s)", [table])
+        elif connection.vendor == 'sqlite':
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")
+            if cursor.fetchone():
+                # Row count from the last ANALYZE
+                cursor.execute("SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1", [table])
+            else:
+                cursor.execute(f"SELECT MAX(rowid) FROM {connection.ops.quote_name(table)}")
+        else:
+            return None
+        row = cursor.fetchone()
+    if not row or row[0] is None:
+        return None
+    return int(str(row[0]).split()[0])
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Never runs a full COUNT(*): an unfiltered list takes the row estimate,
+    a filtered one is counted up to settings.ADMIN_COUNT_LIMIT rows. Pages
+    past a capped count cannot be reached (see is_capped).
+    """
+
+    @cached_property
+    def count(self):
+        limit = settings.ADMIN_COUNT_LIMIT
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = _row_estimate(queryset.model)
+            if estimate is not None and estimate > limit:
+                return estimate
+        return queryset.order_by()[:limit].count()
+
+    @property
+    def is_capped(self):
+        """Whether a filtered count stopped at ADMIN_COUNT_LIMIT, so more rows may match than can be paged"""
+        return bool(self.object_list.query.where) and self.count >= settings.ADMIN_COUNT_LIMIT
+
+
+class ScalableChangeListMixin:
+    """Changelist settings for tables too large to count"""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def changelist_view(self, request, extra_context=None):
+        response = super().changelist_view(request, extra_context)
+        changelist = getattr(response, 'context_data', {}).get('cl')
+        if changelist is not None and getattr(changelist.paginator, 'is_capped', False):
+            limit = settings.ADMIN_COUNT_LIMIT
+            self.message_user(
+                request,
+                f"At least {limit} rows match; only the first {limit} can be paged through. "
+                "Narrow the filters or the search to reach the rest.",
+                messages.WARNING,
+            )
+        return response
+
+
+class CurrencyListFilter(admin.SimpleListFilter):
+    """Currency filter whose choices are cached instead of a DISTINCT scan per page load"""
+    title = 'currency'
+    parameter_name = 'currency'
+
+    def lookups(self, request, model_admin):
+        currencies = cache.get_or_set(
+            'admin-expense-currencies',
+            lambda: list(Expense.objects.order_by('currency').values_list('currency', flat=True).distinct()),
+            settings.ADMIN_FILTER_CACHE_SECONDS,
+        )
+        return [(currency, currency) for currency in currencies]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(currency=self.value())
+        return queryset
+
+
+class _Echo:
+    """File-like object whose write() returns the CSV line for streaming"""
+
+    def write(self, value):
+        return value
+
+
+def _with_header(rows):
+    yield EXPORT_COLUMNS
+    yield from rows
+
+
+def _recategorize_action(category, label):
+    def recategorize(modeladmin, request, queryset):
+        # Set-based in id-ordered batches (budget counters move by grouped deltas)
+        queryset = queryset.order_by('id')
+        updated, last_id = 0, 0
+        while True:
+            ids = list(queryset.filter(id__gt=last_id).values_list('id', flat=True)[:settings.BULK_MAX_ROWS])
+            if not ids:
+                break
+            updated += bulk.bulk_update(ids, {'category': category})
+            last_id = ids[-1]
+        modeladmin.message_user(request, f"Recategorized {updated} expense(s) as {label}")
+    return recategorize
 
 
 @admin.register(Expense)
-class ExpenseAdmin(admin.ModelAdmin):
+class ExpenseAdmin(ScalableChangeListMixin, admin.ModelAdmin):
     list_display = ['merchant_name', 'amount', 'currency', 'category', 'payment_method', 'date', 'created_at']
-    list_filter = ['category', 'payment_method', 'currency', 'date']
+    # Choice lists and fixed date ranges; no date_hierarchy (a DISTINCT date scan per level)
+    list_filter = ['category', 'payment_method', CurrencyListFilter, 'date']
     search_fields = ['merchant_name', 'description']
-    date_hierarchy = 'date'
     ordering = ['-date']
+    actions = ['export_csv']
+    
+    def get_search_results(self, request, queryset, search_term):
+        # Full-text index instead of leading-wildcard LIKE scans
+        return search.filter_queryset(queryset, search_term), False
+    
+    def get_actions(self, request):
+        actions = super().get_actions(request)
+        if self.has_change_permission(request):
+            for category, label in Expense.CATEGORY_CHOICES:
+                name = f'recategorize_{category}'
+                actions[name] = (_recategorize_action(category, label), name, f'Recategorize selected as {label}')
+        return actions
+    
+    @admin.action(description='Export selected to CSV')
+    def export_csv(self, request, queryset):
+        writer = csv.writer(_Echo())
+        rows = queryset.order_by('id').values_list(*EXPORT_COLUMNS).iterator(chunk_size=2000)
+        response = StreamingHttpResponse(
+            (writer.writerow(row) for row in _with_header(rows)), content_type='text/csv'
+        )
+        response['Content-Disposition'] = 'attachment; filename="expenses.csv"'
+        return response
 
 
 @admin.register(Budget)
@@ -16,3 +163,31 @@ class BudgetAdmin(admin.ModelAdmin):
     list_display = ['category', 'amount', 'period', 'created_at']
     list_filter = ['period', 'category']
     ordering = ['category']
+
+
+class MerchantAliasInline(admin.TabularInline):
+    model = MerchantAlias
+    extra = 0
+
+
+@admin.register(Merchant)
+class MerchantAdmin(admin.ModelAdmin):
+    list_display = ['canonical_name', 'normalized_name', 'created_at']
+    search_fields = ['canonical_name', 'normalized_name']
+    inlines = [MerchantAliasInline]
+    ordering = ['canonical_name']
+
+
+@admin.register(FxRate)
+class FxRateAdmin(admin.ModelAdmin):
+    list_display = ['currency', 'date', 'rate']
+    list_filter = ['currency']
+    ordering = ['currency', '-date']
+
+
+@admin.register(RequestProfile)
+class RequestProfileAdmin(admin.ModelAdmin):
+    list_display = ['created_at', 'method', 'path', 'view', 'status_code', 'duration_ms', 'sql_queries', 'samples', 'trigger']
+    list_filter = ['view', 'trigger']
+    readonly_fields = [f.name for f in RequestProfile._meta.fields]
+    ordering = ['-created_at']
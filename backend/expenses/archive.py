@@ -0,0 +1,204 @@
+"""
+Archival of historical expenses.
+
+`manage.py archive_expenses` moves expenses dated before a cutoff (the
+start of a month, ARCHIVE_AFTER_DAYS ago by default) from the live table
+into ArchivedExpense, keeping their ids, and adds them to ArchiveAggregate:
+spend and count per user, month, category, payment method and merchant.
+The live table, its indexes and its full-text index then only hold recent
+history.
+
+Reports spanning the archive combine live rows with archived_totals(),
+which reads whole months from the aggregates and sums only the partial
+months at the window's edges from archived rows. Archived expenses remain
+readable one by one (GET /api/expenses/<id>/ falls back to the archive)
+and through /api/expenses/archived/, but are no longer editable.
+
+The cutoff may not be later than the oldest current budget period, so
+budget counters, the summary's day/week/month figures and the classifier's
+incremental state never depend on archived rows.
+"""
+
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, DateField, Max, Sum
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from . import budgets, classifier, versions
+from .models import ArchiveAggregate, ArchivedExpense, Expense, ExpenseItem
+
+# Columns copied as they are from the live table
+_COPIED_COLUMNS = [f.column for f in ArchivedExpense._meta.concrete_fields if f.name != 'archived_at']
+
+AGGREGATE_KEY = ('username', 'period_start', 'category', 'payment_method', 'merchant_id')
+
+
+def month_start(day):
+    return day.replace(day=1)
+
+
+def next_month(day):
+    return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def start_of_day(day):
+    """Aware midnight of `day` in the current time zone"""
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def default_cutoff(today=None):
+    today = today or timezone.localdate()
+    return month_start(today - timedelta(days=settings.ARCHIVE_AFTER_DAYS))
+
+
+def _aggregate_rows(queryset):
+    """(*AGGREGATE_KEY, total, count) rows of live or archived expenses"""
+    return queryset.annotate(
+        period_start=TruncMonth('date', output_field=DateField())
+    ).values_list(*AGGREGATE_KEY).annotate(total=Sum('amount_base'), count=Count('id')).order_by()
+
+
+def _add_aggregates(ids):
+    added = defaultdict(lambda: [Decimal('0'), 0])
+    for username, period_start, category, payment_method, merchant_id, total, count in _aggregate_rows(
+        Expense.objects.filter(id__in=ids)
+    ):
+        key = (username or '', period_start, category, payment_method, merchant_id)
+        added[key][0] += total or 0
+        added[key][1] += count
+
+    existing = {
+        (a.username, a.period_start, a.category, a.payment_method, a.merchant_id): a
+        for a in ArchiveAggregate.objects.filter(
+            username__in={key[0] for key in added}, period_start__in={key[1] for key in added}
+        )
+    }
+    changed, created = [], []
+    for key, (total, count) in added.items():
+        aggregate = existing.get(key)
+        if aggregate is None:
+            created.append(ArchiveAggregate(**dict(zip(AGGREGATE_KEY, key)), total=total, count=count))
+        else:
+            aggregate.total += total
+            aggregate.count += count
+            changed.append(aggregate)
+    ArchiveAggregate.objects.bulk_update(changed, ['total', 'count'])
+    ArchiveAggregate.objects.bulk_create(created)
+
+
+def _aggregate_totals(archived):
+    return {(username or '', *key): total or 0 for username, *key, total, _ in _aggregate_rows(archived)}
+
+
+def update_amounts(archived, update):
+    """
+    Run `update(archived)`, an UPDATE of the archived rows' amount_base (see
+    fx.load_rates), and move the ArchiveAggregate totals by the difference;
+    returns what `update` returns.
+    """
+    before = _aggregate_totals(archived)
+    result = update(archived)
+    deltas = {key: delta for key, delta in budgets.difference(before, _aggregate_totals(archived)).items() if delta}
+    changed = []
+    for aggregate in ArchiveAggregate.objects.filter(
+        username__in={key[0] for key in deltas}, period_start__in={key[1] for key in deltas}
+    ):
+        delta = deltas.get(tuple(getattr(aggregate, field) for field in AGGREGATE_KEY))
+        if delta:
+            aggregate.total += delta
+            changed.append(aggregate)
+    ArchiveAggregate.objects.bulk_update(changed, ['total'])
+    return result
+
+
+def _move(ids):
+    quote = connection.ops.quote_name
+    columns = ', '.join(quote(column) for column in _COPIED_COLUMNS)
+    placeholders = ', '.join(['%s'] * len(ids))
+    archived_at = connection.ops.adapt_datetimefield_value(timezone.now())
+    # Archived expenses keep their items as JSON only
+    ExpenseItem.objects.filter(expense_id__in=ids).delete()
+    with connection.cursor() as cursor:
+        # Plain SQL: no model instances and no per-row delete signals
+        cursor.execute(
+            f'INSERT INTO {quote(ArchivedExpense._meta.db_table)} ({columns}, {quote("archived_at")}) '
+            f'SELECT {columns}, %s FROM {quote(Expense._meta.db_table)} WHERE id IN ({placeholders})',
+            [archived_at, *ids],
+        )
+        cursor.execute(f'DELETE FROM {quote(Expense._meta.db_table)} WHERE id IN ({placeholders})', ids)
+
+
+def archive_before(cutoff, batch_size=5000):
+    """Move the expenses dated before the `cutoff` day to the archive; returns the row count"""
+    if cutoff > budgets.earliest_tracked_day():
+        raise ValueError(f'Cutoff {cutoff} is inside a current budget period (from {budgets.earliest_tracked_day()})')
+    boundary = start_of_day(cutoff)
+    moved = 0
+    while True:
+        # One transaction per batch keeps write locks short
+        with transaction.atomic():
+            ids = list(Expense.objects.filter(date__lt=boundary).order_by('id').values_list('id', flat=True)[:batch_size])
+            if not ids:
+                break
+            _add_aggregates(ids)
+            usernames = set(Expense.objects.filter(id__in=ids).values_list('username', flat=True).distinct().order_by())
+            _move(ids)
+            versions.bump(usernames)
+            transaction.on_commit(lambda usernames=usernames: classifier.registry.expire(usernames))
+        moved += len(ids)
+    return moved
+
+
+def latest_archived_date():
+    return ArchivedExpense.objects.aggregate(latest=Max('date'))['latest']
+
+
+def _grouped(queryset, group_by, total, count):
+    if group_by is None:
+        row = queryset.aggregate(total=total, count=count)
+        return [(None, row['total'], row['count'])]
+    return queryset.values_list(group_by).annotate(total=total, count=count).order_by()
+
+
+def archived_totals(start=None, end=None, group_by=None, username=None):
+    """
+    (total, count) of archived expenses dated in [start, end), or a dict of
+    them per value of `group_by` ('category', 'payment_method' or 'merchant_id')
+    """
+    aggregates = ArchiveAggregate.objects.all()
+    rows = ArchivedExpense.objects.all()
+    if username is not None:
+        aggregates = aggregates.filter(username=username)
+        rows = rows.filter(username=username or None)
+
+    # Whole months from the aggregates, the partial months at either end from rows
+    partial = []
+    if start is not None:
+        first_day = timezone.localtime(start).date()
+        first_full = month_start(first_day) if start == start_of_day(month_start(first_day)) else next_month(first_day)
+        aggregates = aggregates.filter(period_start__gte=first_full)
+        partial.append(rows.filter(date__gte=start, date__lt=start_of_day(first_full)))
+    if end is not None:
+        last_full = month_start(timezone.localtime(end).date())
+        aggregates = aggregates.filter(period_start__lt=last_full)
+        partial.append(rows.filter(date__gte=start_of_day(last_full), date__lt=end))
+    if start is not None and end is not None and first_full >= last_full:
+        aggregates = aggregates.none()
+        partial = [rows.filter(date__gte=start, date__lt=end)]
+
+    totals = defaultdict(lambda: [Decimal('0.00'), 0])
+    sources = [(aggregates, Sum('total'), Sum('count'))]
+    sources += [(queryset, Sum('amount_base'), Count('id')) for queryset in partial]
+    for queryset, total, count in sources:
+        for key, amount, number in _grouped(queryset, group_by, total, count):
+            totals[key][0] += amount or 0
+            totals[key][1] += number or 0
+
+    if group_by is None:
+        return tuple(totals[None])
+    return {key: tuple(value) for key, value in totals.items()}
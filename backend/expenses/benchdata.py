@@ -0,0 +1,174 @@
+"""
+Synthetic expenses and budgets for benchmarks and load tests.
+
+Used by `manage.py seed_benchmark_data` and the scripts in benchmarks/;
+it lives in the app so the command works wherever manage.py is run from.
+"""
+
+import random
+from datetime import timedelta
+from decimal import Decimal
+
+from django.utils import timezone
+
+MERCHANTS = {
+    'food': ['Starbucks', 'STARBUCKS #1234', 'Whole Foods Market', 'Chipotle', "McDonald's", 'Subway'],
+    'transport': ['Uber', 'Lyft', 'Shell', 'Chevron', 'City Parking'],
+    'shopping': ['Amazon', 'Target', 'Walmart', 'IKEA', 'Best Buy'],
+    'entertainment': ['Netflix', 'AMC Theatres', 'Spotify', 'Steam'],
+    'utilities': ['PG&E', 'Comcast', 'AT&T', 'Water Dept'],
+    'healthcare': ['CVS Pharmacy', 'Walgreens', 'City Clinic'],
+    'education': ['Coursera', 'Barnes & Noble', 'Udemy'],
+    'other': ['Post Office', 'Dry Cleaner', 'Unknown Store'],
+}
+
+ITEMS = {
+    'food': ['Latte', 'Bagel', 'Milk 1L', 'Bananas', 'Burrito Bowl', 'Sandwich', 'Orange Juice'],
+    'transport': ['Ride', 'Unleaded Fuel', 'Parking 2h'],
+    'shopping': ['USB-C Cable', 'T-Shirt', 'Desk Lamp', 'Batteries AA'],
+    'entertainment': ['Monthly Subscription', 'Movie Ticket', 'Popcorn'],
+    'utilities': ['Electricity', 'Internet', 'Mobile Plan'],
+    'healthcare': ['Ibuprofen', 'Vitamins', 'Consultation'],
+    'education': ['Course Fee', 'Notebook', 'Textbook'],
+    'other': ['Stamps', 'Dry Cleaning', 'Misc'],
+}
+
+CATEGORIES = list(MERCHANTS)
+PAYMENT_METHODS = ['cash', 'credit_card', 'debit_card', 'upi', 'other']
+CURRENCIES = ['USD'] * 8 + ['EUR', 'INR']
+PERIODS = ['weekly', 'monthly', 'monthly', 'monthly', 'yearly']
+
+
+def make_expense(rng, username, now=None, days=730):
+    """Return an unsaved Expense with realistic looking fields"""
+    from expenses.models import Expense
+
+    now = now or timezone.now()
+    category = rng.choice(CATEGORIES)
+    items = []
+    for _ in range(rng.randint(1, 6)):
+        quantity = rng.randint(1, 3)
+        price = Decimal(rng.randint(100, 5000)) / 100
+        items.append({
+            'name': rng.choice(ITEMS[category]),
+            'quantity': quantity,
+            'price': float(price),
+            'total': float(price * quantity),
+        })
+    subtotal = sum(Decimal(str(item['total'])) for item in items)
+    tax = (subtotal * Decimal('0.08')).quantize(Decimal('0.01'))
+    return Expense(
+        username=username,
+        merchant_name=rng.choice(MERCHANTS[category]),
+        amount=subtotal + tax,
+        currency=rng.choice(CURRENCIES),
+        category=category,
+        payment_method=rng.choice(PAYMENT_METHODS),
+        date=now - timedelta(seconds=rng.randint(0, days * 86400)),
+        description=rng.choice([None, '', 'Business lunch', 'Weekly groceries', 'Reimbursable']),
+        items=items,
+        tax=tax,
+        tip=Decimal('0.00'),
+    )
+
+
+def seed_expenses(count, usernames=('bench',), seed=42, batch_size=2000, days=730,
+                  resolve_merchants=False, progress=None):
+    """
+    Insert `count` synthetic expenses spread over `usernames`.
+
+    Rows are written with executemany() rather than bulk_create(), whose
+    per-field SQL compilation dominates at tens of millions of rows. With
+    resolve_merchants=True each row is linked to its Merchant (one lookup
+    per distinct name). `progress(inserted)` is called after every batch.
+    """
+    from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+    from expenses.fx import recompute_amount_base
+    from expenses.merchants import resolve_merchant
+    from expenses.models import Expense
+
+    # The connection object itself: the `connection` proxy costs a lookup per value
+    connection = connections[DEFAULT_DB_ALIAS]
+    fields = [f for f in Expense._meta.concrete_fields if not f.primary_key]
+    quote = connection.ops.quote_name
+    sql = 'INSERT INTO %s (%s) VALUES (%s)' % (
+        quote(Expense._meta.db_table),
+        ', '.join(quote(f.column) for f in fields),
+        ', '.join(['%s'] * len(fields)),
+    )
+
+    rng = random.Random(seed)
+    now = timezone.now()
+    merchant_ids = {}
+    inserted = 0
+    while inserted < count:
+        rows = []
+        for i in range(inserted, min(inserted + batch_size, count)):
+            expense = make_expense(rng, usernames[i % len(usernames)], now=now, days=days)
+            expense.created_at = expense.updated_at = now
+            if resolve_merchants:
+                name = expense.merchant_name
+                if name not in merchant_ids:
+                    merchant_ids[name] = resolve_merchant(name)
+                expense.merchant_id = merchant_ids[name]
+            rows.append(tuple(f.get_db_prep_save(getattr(expense, f.attname), connection) for f in fields))
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.executemany(sql, rows)
+        inserted += len(rows)
+        if progress:
+            progress(inserted)
+    # Raw inserts bypass Expense.save(), so fill the base amounts set-based
+    recompute_amount_base(Expense.objects.filter(amount_base__isnull=True))
+
+
+def seed_budgets(usernames, per_user=3, seed=42):
+    """
+    Create up to `per_user` budgets per user and fill their current-period
+    counters with one grouped query per period type.
+    """
+    from datetime import datetime, time
+
+    from django.db.models import Sum
+
+    from expenses.budgets import period_end, period_start, rebuild_counter
+    from expenses.models import Budget, BudgetSpend, Expense
+
+    rng = random.Random(seed)
+    budgets = []
+    for username in usernames:
+        for category in rng.sample(CATEGORIES, min(per_user, len(CATEGORIES))):
+            budgets.append(Budget(
+                username=username,
+                category=category,
+                amount=Decimal(rng.randint(10, 200)) * 10,
+                period=rng.choice(PERIODS),
+            ))
+    Budget.objects.bulk_create(budgets, batch_size=1000, ignore_conflicts=True)
+
+    # bulk_create skips the post_save counter rebuild
+    today = timezone.localdate()
+    counters = []
+    for period in sorted(set(PERIODS)):
+        start = period_start(period, today)
+        end = period_end(period, start)
+        totals = Expense.objects.filter(
+            date__gte=timezone.make_aware(datetime.combine(start, time.min)),
+            date__lt=timezone.make_aware(datetime.combine(end, time.min)),
+        ).values_list('username', 'category').annotate(total=Sum('amount_base')).order_by()
+        spent = {(username, category): total for username, category, total in totals.iterator()}
+        for budget_id, username, category in Budget.objects.filter(
+                period=period, username__isnull=False).values_list(
+                'id', 'username', 'category').iterator():
+            counters.append(BudgetSpend(
+                budget_id=budget_id, period_start=start,
+                spent=spent.get((username, category)) or Decimal('0.00'),
+            ))
+    BudgetSpend.objects.bulk_create(
+        counters, batch_size=1000, update_conflicts=True,
+        unique_fields=['budget', 'period_start'], update_fields=['spent'],
+    )
+    # Budgets shared by all users are few; count them one by one
+    for budget in Budget.objects.filter(username__isnull=True):
+        rebuild_counter(budget)
+    return len(budgets)
@@ -0,0 +1,286 @@
+"""
+Incremental budget spend counters and threshold alerts.
+
+Each budget has one BudgetSpend row per calendar period (day, ISO week,
+month, year). Expense writes adjust the counters of the matching budgets
+with F() updates in the same transaction as the write (see signals.py), and
+record a BudgetAlert the first time a period crosses 80% or 100% of the
+budget. Budget status is then a read of the current counters.
+
+Current and future periods have counters, so a period's counter already
+holds the expenses dated in it ahead of time when it begins. Writes dated
+in a closed period do not move any counter, and status for a past day is
+summed from the expenses instead (the row's `tracked` is False).
+
+A budget without a username applies to every user's expenses in its
+category, the same as the original rolling-window status view.
+"""
+
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, DecimalField, F, Q, Sum, Value, When
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import Budget, BudgetAlert, BudgetSpend, Expense
+
+THRESHOLD_RATIO = Decimal('0.8')
+
+
+def period_start(period, day):
+    """First day of the calendar period containing `day`"""
+    if period == 'daily':
+        return day
+    if period == 'weekly':
+        return day - timedelta(days=day.weekday())
+    if period == 'yearly':
+        return day.replace(month=1, day=1)
+    return day.replace(day=1)
+
+
+def period_end(period, start):
+    """First day after the period beginning at `start`"""
+    if period == 'daily':
+        return start + timedelta(days=1)
+    if period == 'weekly':
+        return start + timedelta(weeks=1)
+    if period == 'yearly':
+        return start.replace(year=start.year + 1)
+    return (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def _local_day(when):
+    if isinstance(when, datetime):
+        if timezone.is_aware(when):
+            when = timezone.localtime(when)
+        return when.date()
+    return when
+
+
+def matching_budgets(username, category):
+    return Budget.objects.filter(category=category).filter(Q(username__isnull=True) | Q(username=username))
+
+
+def apply_delta(username, category, when, amount):
+    """Add `amount` to the counters of every matching budget for the period containing `when`"""
+    if not amount or when is None:
+        return
+    day = _local_day(when)
+    today = timezone.localdate()
+
+    amounts = {}
+    for budget in matching_budgets(username, category):
+        start = period_start(budget.period, day)
+        # Back-dated expenses in a closed period do not affect budget status
+        if start >= period_start(budget.period, today):
+            amounts[(budget, start)] = amount
+    _apply(amounts)
+
+
+def _apply(amounts):
+    """Add {(budget, period_start): amount} to the counters and record the thresholds crossed"""
+    if not amounts:
+        return
+    spent = _increment({(budget.id, start): amount for (budget, start), amount in amounts.items()})
+    for (budget, start), amount in amounts.items():
+        after = spent[(budget.id, start)]
+        _check_thresholds(budget, start, after - amount, after)
+
+
+def _increment(amounts):
+    """
+    Add {(budget_id, period_start): amount} to the counters with one UPDATE,
+    creating the missing ones; returns {(budget_id, period_start): spent}.
+    """
+    match = Q()
+    for budget_id, start in amounts:
+        match |= Q(budget_id=budget_id, period_start=start)
+    increment = Case(
+        *[When(budget_id=budget_id, period_start=start, then=Value(amount))
+          for (budget_id, start), amount in amounts.items()],
+        output_field=DecimalField(max_digits=14, decimal_places=2),
+    )
+    updated = BudgetSpend.objects.filter(match).update(spent=F('spent') + increment, updated_at=timezone.now())
+    if updated < len(amounts):
+        existing = set(BudgetSpend.objects.filter(match).values_list('budget_id', 'period_start'))
+        for (budget_id, start), amount in amounts.items():
+            if (budget_id, start) in existing:
+                continue
+            try:
+                with transaction.atomic():
+                    BudgetSpend.objects.create(budget_id=budget_id, period_start=start, spent=amount)
+            except IntegrityError:
+                # Created concurrently; fall back to the atomic increment
+                BudgetSpend.objects.filter(budget_id=budget_id, period_start=start).update(spent=F('spent') + amount)
+    counters = BudgetSpend.objects.filter(match).values_list('budget_id', 'period_start', 'spent')
+    return {(budget_id, start): spent for budget_id, start, spent in counters}
+
+
+def _check_thresholds(budget, start, before, after):
+    if budget.amount <= 0 or after <= before:
+        return
+    crossed = []
+    if before < budget.amount * THRESHOLD_RATIO <= after:
+        crossed.append('threshold')
+    if before <= budget.amount < after:
+        crossed.append('exceeded')
+    for kind in crossed:
+        BudgetAlert.objects.get_or_create(
+            budget=budget, period_start=start, kind=kind,
+            defaults={
+                'username': budget.username,
+                'category': budget.category,
+                'spent': after,
+                'budget_amount': budget.amount,
+            },
+        )
+
+
+def earliest_tracked_day(today=None):
+    """First day of the oldest current period; older expenses never affect a counter"""
+    today = today or timezone.localdate()
+    return min(period_start(period, today) for period, _ in Budget._meta.get_field('period').choices)
+
+
+def contributions(expenses):
+    """{(username, category, day): amount_base} of the `expenses` that can affect a budget counter"""
+    rows = expenses.filter(date__date__gte=earliest_tracked_day()).annotate(day=TruncDate('date')).values_list(
+        'username', 'category', 'day'
+    ).annotate(total=Sum('amount_base')).order_by()
+    return {(username, category, day): total or 0 for username, category, day, total in rows}
+
+
+def difference(before, after):
+    """Deltas that move counters from the `before` contributions to the `after` ones"""
+    return {key: after.get(key, 0) - before.get(key, 0) for key in before.keys() | after.keys()}
+
+
+def apply_deltas(deltas):
+    """
+    Apply many {(username, category, day): amount} changes at once.
+
+    Each matching budget's counter is incremented once per period with the
+    sum of the deltas dated in it, instead of once per expense (used by
+    bulk.py and fx.py).
+    """
+    deltas = {key: amount for key, amount in deltas.items() if amount}
+    if not deltas:
+        return
+    today = timezone.localdate()
+    categories = {category for _, category, _ in deltas}
+    amounts = defaultdict(Decimal)
+    for budget in Budget.objects.filter(category__in=categories):
+        current = period_start(budget.period, today)
+        for (username, category, day), value in deltas.items():
+            start = period_start(budget.period, day)
+            if (category == budget.category and start >= current
+                    and (budget.username is None or username == budget.username)):
+                amounts[(budget, start)] += value
+    _apply({key: amount for key, amount in amounts.items() if amount})
+
+
+def expense_contribution(values):
+    """(username, category, date, amount_base) of a saved row, or None"""
+    if not values:
+        return None
+    return (values.get('username'), values.get('category'), values.get('date'), values.get('amount_base'))
+
+
+def apply_expense_change(before, after):
+    """Move an expense's contribution from its old values to its new values"""
+    if before == after:
+        return
+    if before and before[3]:
+        apply_delta(before[0], before[1], before[2], -before[3])
+    if after and after[3]:
+        apply_delta(after[0], after[1], after[2], after[3])
+
+
+def _start_of_day(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def _budget_expenses(budget):
+    expenses = Expense.objects.filter(category=budget.category)
+    if budget.username:
+        expenses = expenses.filter(username=budget.username)
+    return expenses
+
+
+def period_spend(budget, start):
+    """Spend of a budget's period beginning at `start`, summed from raw expenses"""
+    end = period_end(budget.period, start)
+    expenses = _budget_expenses(budget).filter(date__gte=_start_of_day(start), date__lt=_start_of_day(end))
+    return expenses.aggregate(total=Sum('amount_base'))['total'] or Decimal('0.00')
+
+
+def rebuild_counter(budget, today=None):
+    """
+    Recompute a budget's counters for the current period and every later
+    one with expenses from raw expenses; returns the current period's spend.
+    """
+    today = today or timezone.localdate()
+    start = period_start(budget.period, today)
+    spent = defaultdict(lambda: Decimal('0.00'), {start: Decimal('0.00')})
+    days = _budget_expenses(budget).filter(date__gte=_start_of_day(start)).annotate(
+        day=TruncDate('date')
+    ).values_list('day').annotate(total=Sum('amount_base')).order_by()
+    for day, total in days:
+        spent[period_start(budget.period, day)] += total or 0
+
+    BudgetSpend.objects.filter(budget=budget, period_start__gt=start).exclude(period_start__in=spent).delete()
+    for period, value in spent.items():
+        BudgetSpend.objects.update_or_create(budget=budget, period_start=period, defaults={'spent': value})
+    return spent[start]
+
+
+def current_spend(budgets, today=None):
+    """
+    {budget_id: (period_start, spent)} for the period containing `today`:
+    from the counters (one query) for current periods, summed from the
+    expenses for past ones, whose counters are not maintained.
+    """
+    current_day = timezone.localdate()
+    today = today or current_day
+    past = {budget.id: budget for budget in budgets
+            if period_start(budget.period, today) != period_start(budget.period, current_day)}
+    starts = {budget.id: period_start(budget.period, today) for budget in budgets if budget.id not in past}
+    counters = BudgetSpend.objects.filter(
+        budget_id__in=starts.keys(), period_start__in=set(starts.values())
+    ).values_list('budget_id', 'period_start', 'spent')
+    spent = {(budget_id, start): value for budget_id, start, value in counters}
+    spend = {
+        budget_id: (start, spent.get((budget_id, start), Decimal('0.00')))
+        for budget_id, start in starts.items()
+    }
+    for budget_id, budget in past.items():
+        start = period_start(budget.period, today)
+        spend[budget_id] = (start, period_spend(budget, start))
+    return spend
+
+
+def status(budgets, today=None):
+    """Status rows of `budgets` for the period containing `today` (the /api/budgets/status/ payload)"""
+    budgets = list(budgets)
+    current_day = timezone.localdate()
+    spend = current_spend(budgets, today)
+    rows = []
+    for budget in budgets:
+        start, spent = spend[budget.id]
+        rows.append({
+            'id': budget.id,
+            'category': budget.category,
+            'budget': budget.amount,
+            'spent': spent,
+            'remaining': budget.amount - spent,
+            'percentage': (spent / budget.amount * 100) if budget.amount > 0 else 0,
+            'period': budget.period,
+            'period_start': start,
+            'is_exceeded': spent > budget.amount,
+            # False: a past period, summed from the expenses rather than read from its counter
+            'tracked': start == period_start(budget.period, current_day),
+        })
+    return rows
@@ -0,0 +1,144 @@
+"""
+Set-based bulk update and delete of expenses.
+
+The rows are selected by id list or by a whitelisted filter, then changed
+with one UPDATE or DELETE inside a transaction. Per-row side effects are
+replaced by aggregate ones:
+
+- budget counters move by grouped sums (budgets.apply_deltas) rather than
+  through the per-row post_save/post_delete signals, which are not sent;
+- amount_base is recomputed set-based when currency or date change;
+- the merchant is resolved once for a new merchant_name;
+- affected users' expense versions are bumped, so every worker retrains
+  their classifiers (this one on next use, others within
+  CLASSIFIER_VERSION_TTL); their precomputed insights are dropped
+  and their live streams refreshed.
+
+The full-text index follows through its SQLite triggers; deleted rows'
+line items (ExpenseItem) go with one DELETE of their own.
+"""
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from . import budgets, classifier, live, versions
+from .fx import recompute_amount_base
+from .merchants import resolve_merchant
+from .models import Budget, Expense, ExpenseItem, UserInsight
+
+# Fields a bulk PATCH may set; not username, which would move expenses to another user
+UPDATE_FIELDS = ['merchant_name', 'category', 'payment_method', 'currency', 'date', 'description']
+
+# Ids per DELETE statement, below every backend's bound-parameter limit
+DELETE_BATCH_SIZE = 500
+
+# Lookups accepted in a filter expression, e.g. {"merchant": 3, "date__gte": "2024-05-01"}
+FILTER_LOOKUPS = {
+    'merchant', 'merchant_name', 'merchant_name__iexact', 'merchant_name__icontains',
+    'category', 'category__in', 'payment_method', 'payment_method__in', 'currency', 'currency__in',
+    'username', 'date__gte', 'date__gt', 'date__lte', 'date__lt', 'date__date',
+    'amount__gte', 'amount__lte', 'created_at__gte', 'created_at__lt',
+}
+
+
+class BulkError(Exception):
+    """Invalid bulk request; the message is returned to the client"""
+
+
+def select_ids(ids=None, filters=None, username=None):
+    """Resolve an id list or filter expression to the ids of the affected rows"""
+    if not ids and not filters:
+        raise BulkError('Provide "ids" or a non-empty "filter"')
+
+    queryset = Expense.objects.all()
+    if ids:
+        if not isinstance(ids, list) or not all(isinstance(i, int) for i in ids):
+            raise BulkError('"ids" must be a list of integers')
+        queryset = queryset.filter(id__in=ids)
+    if filters:
+        if not isinstance(filters, dict):
+            raise BulkError('"filter" must be an object')
+        unknown = set(filters) - FILTER_LOOKUPS
+        if unknown:
+            raise BulkError(f"Unsupported filter(s): {', '.join(sorted(unknown))}")
+    if username:
+        queryset = queryset.filter(username=username)
+
+    limit = settings.BULK_MAX_ROWS
+    try:
+        if filters:
+            queryset = queryset.filter(**filters)
+        selected = list(queryset.values_list('id', flat=True)[:limit + 1])
+    except ValidationError as e:
+        raise BulkError(f"Invalid filter: {' '.join(e.messages)}")
+    except (ValueError, TypeError) as e:
+        raise BulkError(f'Invalid filter: {e}')
+    if len(selected) > limit:
+        raise BulkError(f'More than {limit} expenses match; narrow the selection')
+    return selected
+
+
+def _contributions(ids):
+    return budgets.contributions(Expense.objects.filter(id__in=ids))
+
+
+def _usernames(ids):
+    return set(Expense.objects.filter(id__in=ids).values_list('username', flat=True).distinct().order_by())
+
+
+def _invalidate_caches(usernames):
+    UserInsight.objects.filter(username__in=[u or '' for u in usernames]).delete()
+    if Budget.objects.filter(username__isnull=True).exists():
+        # Shared budgets follow every user's expenses: every stream refreshes
+        live.publish(None, 'refresh')
+    else:
+        live.refresh(username for username in usernames if username)
+    # Every worker's classifier and the cached insights see the new versions
+    versions.bump(usernames)
+    transaction.on_commit(lambda: classifier.registry.expire(usernames))
+
+
+def bulk_update(ids, values):
+    """Apply `values` (already validated) to the expenses in `ids`; returns the row count"""
+    values = {field: value for field, value in values.items() if field in UPDATE_FIELDS}
+    if not ids or not values:
+        return 0
+    if 'merchant_name' in values:
+        values['merchant_id'] = resolve_merchant(values['merchant_name'])
+    # queryset.update() skips auto_now; insights caching relies on updated_at
+    values['updated_at'] = timezone.now()
+
+    with transaction.atomic():
+        before = _contributions(ids)
+        usernames = _usernames(ids)
+        updated = Expense.objects.filter(id__in=ids).update(**values)
+        if 'currency' in values or 'date' in values:
+            recompute_amount_base(Expense.objects.filter(id__in=ids))
+        budgets.apply_deltas(budgets.difference(before, _contributions(ids)))
+        _invalidate_caches(usernames)
+    return updated
+
+
+def bulk_delete(ids):
+    """Delete the expenses in `ids` with one DELETE; returns the row count"""
+    if not ids:
+        return 0
+    with transaction.atomic():
+        before = _contributions(ids)
+        usernames = _usernames(ids)
+        # A plain DELETE: QuerySet.delete() would load every row to send
+        # post_delete, which would also adjust the counters a second time.
+        # Their line items go first (a signal-free bulk DELETE).
+        deleted = 0
+        table = connection.ops.quote_name(Expense._meta.db_table)
+        for offset in range(0, len(ids), DELETE_BATCH_SIZE):
+            batch = ids[offset:offset + DELETE_BATCH_SIZE]
+            ExpenseItem.objects.filter(expense_id__in=batch).delete()
+            with connection.cursor() as cursor:
+                cursor.execute('DELETE FROM %s WHERE id IN (%s)' % (table, ', '.join(['%s'] * len(batch))), batch)
+                deleted += cursor.rowcount
+        budgets.apply_deltas({key: -amount for key, amount in before.items()})
+        _invalidate_caches(usernames)
+    return deleted
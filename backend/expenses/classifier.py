@@ -0,0 +1,357 @@
+"""
+Per-user category and payment method classifier.
+
+A multinomial naive Bayes model over merchant and line item tokens is kept
+in memory for each user. Models are trained from the user's own history on
+first use, updated incrementally as expenses are written (see signals.py),
+and snapshotted to disk periodically so a restarted worker can reuse the
+models that are still current (see versions.py).
+"""
+
+import copy
+import logging
+import math
+import os
+import pickle
+import re
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict, deque
+
+from django.conf import settings
+from django.db import connections
+
+from . import versions
+from .merchants import normalize_merchant_name
+from .models import Expense
+
+logger = logging.getLogger(__name__)
+
+_word_re = re.compile(r'[a-z][a-z0-9]+')
+
+# Recent predictions the shortcut decision looks at
+CONFIDENCE_WINDOW = 50
+
+
+def expense_tokens(merchant_name, items):
+    """Feature tokens for a receipt: merchant words, whole merchant, item words"""
+    normalized = normalize_merchant_name(merchant_name)
+    tokens = [f'm:{normalized}'] if normalized else []
+    tokens += [f'w:{w}' for w in normalized.split()]
+    for item in items or []:
+        name = item.get('name') if isinstance(item, dict) else None
+        if name:
+            tokens += [f'i:{w}' for w in _word_re.findall(str(name).lower())]
+    return tokens
+
+
+class NaiveBayesModel:
+    """Multinomial naive Bayes with add-one smoothing, updatable in place"""
+
+    def __init__(self):
+        self.class_counts = Counter()
+        self.token_counts = defaultdict(Counter)
+        self.class_token_totals = Counter()
+        self.vocabulary = Counter()
+
+    @property
+    def samples(self):
+        return sum(self.class_counts.values())
+
+    def learn(self, tokens, label, weight=1):
+        if not label:
+            return
+        self.class_counts[label] += weight
+        for token in tokens:
+            self.token_counts[label][token] += weight
+            self.class_token_totals[label] += weight
+            self.vocabulary[token] += weight
+        if self.class_counts[label] <= 0:
+            del self.class_counts[label]
+            self.token_counts.pop(label, None)
+            self.class_token_totals.pop(label, None)
+
+    def unlearn(self, tokens, label):
+        if label in self.class_counts:
+            self.learn(tokens, label, weight=-1)
+
+    def predict(self, tokens):
+        """Return (label, posterior probability) or (None, 0.0) when untrained"""
+        total = self.samples
+        if total <= 0:
+            return None, 0.0
+        vocabulary_size = len(self.vocabulary) or 1
+        scores = {}
+        for label, count in self.class_counts.items():
+            counts = self.token_counts[label]
+            denominator = self.class_token_totals[label] + vocabulary_size
+            score = math.log(count / total)
+            for token in tokens:
+                score += math.log((counts.get(token, 0) + 1) / denominator)
+            scores[label] = score
+        best = max(scores, key=scores.get)
+        # Softmax over the log scores gives the posterior of the best label
+        top = scores[best]
+        norm = sum(math.exp(s - top) for s in scores.values())
+        return best, 1.0 / norm
+
+
+class UserClassifier:
+    def __init__(self):
+        self.category = NaiveBayesModel()
+        self.payment_method = NaiveBayesModel()
+        # ExpenseVersion the model reflects (None: unknown, always stale)
+        self.version = None
+        # Whether recent category predictions were confident enough to use
+        self.outcomes = deque(maxlen=CONFIDENCE_WINDOW)
+
+    @property
+    def samples(self):
+        return self.category.samples
+
+    @property
+    def confident_rate(self):
+        return sum(self.outcomes) / len(self.outcomes) if self.outcomes else 0.0
+
+    def learn(self, merchant_name, items, category, payment_method):
+        tokens = expense_tokens(merchant_name, items)
+        self.category.learn(tokens, category)
+        self.payment_method.learn(tokens, payment_method)
+
+    def unlearn(self, merchant_name, items, category, payment_method):
+        tokens = expense_tokens(merchant_name, items)
+        self.category.unlearn(tokens, category)
+        self.payment_method.unlearn(tokens, payment_method)
+
+    def predict(self, merchant_name, items=None):
+        tokens = expense_tokens(merchant_name, items)
+        category, category_confidence = self.category.predict(tokens)
+        payment_method, payment_confidence = self.payment_method.predict(tokens)
+        return {
+            'category': {'value': category, 'confidence': category_confidence},
+            'payment_method': {'value': payment_method, 'confidence': payment_confidence},
+            'samples': self.samples,
+        }
+
+    def record_outcome(self, confident):
+        """Note whether a category prediction was used (True) or the model had to be asked"""
+        self.outcomes.append(bool(confident))
+
+    def shortcut_worthwhile(self):
+        """
+        Whether a lite extraction is likely to pay off: enough history and
+        mostly confident recent predictions. An unconfident prediction costs
+        a suggest_category call on top of the lite extraction.
+        """
+        return (self.samples >= settings.CLASSIFIER_MIN_SAMPLES
+                and self.confident_rate >= settings.CLASSIFIER_MIN_CONFIDENT_RATE)
+
+    def _estimate_outcomes(self, recent):
+        """Seed the outcomes with leave-one-out predictions of the most recent expenses"""
+        threshold = settings.CLASSIFIER_CONFIDENCE_THRESHOLD
+        for merchant_name, items, category, payment_method in recent:
+            self.unlearn(merchant_name, items, category, payment_method)
+            prediction = self.category.predict(expense_tokens(merchant_name, items))
+            self.learn(merchant_name, items, category, payment_method)
+            self.record_outcome(prediction[1] >= threshold)
+
+
+def train(username):
+    """A classifier trained on `username`'s whole history, stamped with the version it reflects"""
+    key = username or ''
+    classifier = UserClassifier()
+    # Read first: a write landing during the scan leaves the model stamped
+    # older than it is, which only means one more retrain
+    classifier.version = versions.current(key)
+    recent = deque(maxlen=CONFIDENCE_WINDOW)
+    rows = Expense.objects.filter(username=key or None).order_by('id').values_list(
+        'merchant_name', 'items', 'category', 'payment_method'
+    )
+    for row in rows.iterator():
+        classifier.learn(*row)
+        recent.append(row)
+    classifier._estimate_outcomes(recent)
+    return classifier
+
+
+class ClassifierRegistry:
+    """
+    In-memory per-user classifiers with periodic pickle snapshots.
+
+    Users are keyed by username ('' for expenses without one, matching the
+    optional X-Username handling in the views). Each model carries the
+    user's ExpenseVersion it was trained to: writes this process commits
+    are applied incrementally when they are the next version, and any other
+    version (writes from other workers, bulk and archive SQL) makes get()
+    retrain the model from history. Training runs without the registry lock,
+    so it never blocks predictions or other users' updates.
+
+    get() reads the stored version at most every CLASSIFIER_VERSION_TTL
+    seconds per user, so predictions normally run without a query: writes
+    this process makes keep the model current (or expire it), and other
+    workers' writes are noticed within the TTL.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._classifiers = {}
+        self._training = set()
+        # When each model's version was last confirmed against the database
+        self._verified = {}
+        self._last_snapshot = time.monotonic()
+        self._snapshot_loaded = False
+
+    def _key(self, username):
+        return username or ''
+
+    def get(self, username, wait=True):
+        """
+        The classifier for `username`, retrained when its version is stale.
+
+        A stale model is served while a background thread retrains it. With
+        no model yet, wait=True trains it in this thread (still without the
+        lock); wait=False starts background training and returns an empty
+        model, so the caller proceeds as for a user without history.
+        """
+        key = self._key(username)
+        with self._lock:
+            if not self._snapshot_loaded:
+                self._load_snapshot()
+            classifier = self._classifiers.get(key)
+            verified = self._verified.get(key)
+        if classifier is not None:
+            now = time.monotonic()
+            if verified is not None and now - verified < settings.CLASSIFIER_VERSION_TTL:
+                return classifier
+            if classifier.version == versions.current(key):
+                with self._lock:
+                    self._verified[key] = now
+                return classifier
+        if classifier is None and wait:
+            return self._install(key, train(key))
+        self._train_in_background(key)
+        return classifier or UserClassifier()
+
+    def loaded(self, username):
+        """Return the classifier only if it is already in memory"""
+        with self._lock:
+            return self._classifiers.get(self._key(username))
+
+    def _install(self, key, classifier):
+        with self._lock:
+            current = self._classifiers.get(key)
+            # Keep a model that incremental updates have already moved past this one
+            if current is None or current.version is None or current.version < classifier.version:
+                self._classifiers[key] = current = classifier
+                # Trained to the version it read, which may already be behind
+                self._verified.pop(key, None)
+            return current
+
+    def _train_in_background(self, key):
+        with self._lock:
+            if key in self._training:
+                return
+            self._training.add(key)
+
+        def run():
+            try:
+                self._install(key, train(key))
+            except Exception:
+                logger.exception("[classifier] training for %r failed", key)
+            finally:
+                with self._lock:
+                    self._training.discard(key)
+                connections.close_all()
+
+        threading.Thread(target=run, name=f'classifier-train-{key}', daemon=True).start()
+
+    def _apply(self, username, version, change):
+        with self._lock:
+            classifier = self.loaded(username)
+            if classifier is None:
+                # Not in memory yet; it will be trained from history on first use
+                return
+            if version is None or classifier.version is None or version != classifier.version + 1:
+                # Missed a write (another process, bulk SQL): get() retrains it
+                self._verified.pop(self._key(username), None)
+                return
+            change(classifier)
+            classifier.version = version
+        self.maybe_snapshot()
+
+    def observe(self, expense, previous=None, version=None):
+        """Incrementally apply a created/updated expense (and undo its old values) committed as `version`"""
+        def change(classifier):
+            if previous:
+                classifier.unlearn(previous.get('merchant_name'), previous.get('items'),
+                                   previous.get('category'), previous.get('payment_method'))
+            classifier.learn(expense.merchant_name, expense.items, expense.category, expense.payment_method)
+        self._apply(expense.username, version, change)
+
+    def forget(self, username, values, version=None):
+        """Incrementally undo a deleted (or moved away) expense committed as `version`"""
+        self._apply(username, version, lambda classifier: classifier.unlearn(
+            values.get('merchant_name'), values.get('items'), values.get('category'), values.get('payment_method')))
+
+    def expire(self, usernames):
+        """Make get() check the stored versions of `usernames` (after writes that bypass observe/forget)"""
+        with self._lock:
+            for username in usernames:
+                self._verified.pop(self._key(username), None)
+
+    def maybe_snapshot(self):
+        interval = settings.CLASSIFIER_SNAPSHOT_INTERVAL
+        if not settings.CLASSIFIER_SNAPSHOT_PATH or interval <= 0:
+            return
+        if time.monotonic() - self._last_snapshot >= interval:
+            self.snapshot()
+
+    def snapshot(self):
+        path = settings.CLASSIFIER_SNAPSHOT_PATH
+        if not path:
+            return
+        self._last_snapshot = time.monotonic()
+        with self._lock:
+            keys = list(self._classifiers)
+        # Copy one model at a time under the lock, so predictions and updates
+        # wait for one copy at most; pickling and the file write run unlocked
+        classifiers = {}
+        for key in keys:
+            with self._lock:
+                classifier = self._classifiers.get(key)
+                if classifier is not None:
+                    classifiers[key] = copy.deepcopy(classifier)
+        try:
+            directory = os.path.dirname(os.path.abspath(path))
+            os.makedirs(directory, exist_ok=True)
+            with tempfile.NamedTemporaryFile('wb', dir=directory, delete=False) as tmp:
+                pickle.dump({'classifiers': classifiers}, tmp, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp.name, path)
+        except Exception as e:
+            logger.warning("[classifier] failed to write snapshot %s: %s", path, e)
+
+    def _load_snapshot(self):
+        self._snapshot_loaded = True
+        path = settings.CLASSIFIER_SNAPSHOT_PATH
+        if not path or not os.path.exists(path):
+            return
+        try:
+            with open(path, 'rb') as fh:
+                payload = pickle.load(fh)
+        except Exception as e:
+            logger.warning("[classifier] ignoring unreadable snapshot %s: %s", path, e)
+            return
+        # Models are checked against the stored versions on use; snapshots
+        # from before versions were recorded cannot be and are dropped
+        self._classifiers = {
+            key: classifier for key, classifier in payload.get('classifiers', {}).items()
+            if getattr(classifier, 'version', None) is not None
+        }
+
+
+registry = ClassifierRegistry()
+
+
+def predict(username, merchant_name, items=None):
+    return registry.get(username).predict(merchant_name, items)
@@ -0,0 +1,156 @@
+"""
+Multi-page receipt documents.
+
+A scan upload may be a single image, a multi-page image (TIFF, animated
+formats are treated the same way) or a PDF. load_pages() turns any of them
+into a list of PIL images, one per page, so the extractor can send the
+pages to the model in parallel (see GeminiReceiptExtractor). PDFs are
+rasterized locally with pypdfium2 at RECEIPT_PDF_DPI; the model only ever
+receives images.
+
+No page is decoded or rendered above RECEIPT_MAX_PAGE_PIXELS: PDF pages
+that would be are rendered at a lower resolution, and check_page_sizes()
+rejects image pages over the limit and PDF pages too large even at 72 DPI.
+
+pypdfium2 is optional: without it PDF uploads are rejected at validation
+and images keep working.
+"""
+
+import math
+
+from django.conf import settings
+from PIL import Image, ImageSequence
+
+try:
+    import pypdfium2 as pdfium
+except ImportError:  # PDF receipts need pypdfium2, images do not
+    pdfium = None
+
+PDF_MAGIC = b'%PDF-'
+
+
+def is_pdf(file):
+    """Whether the file-like object holds a PDF (its position is left at the start)"""
+    file.seek(0)
+    head = file.read(1024)
+    file.seek(0)
+    return PDF_MAGIC in head
+
+
+def _open_pdf(file):
+    if pdfium is None:
+        raise ValueError('PDF receipts are not supported on this server (pypdfium2 is not installed)')
+    file.seek(0)
+    data = file.read()
+    file.seek(0)
+    return pdfium.PdfDocument(data)
+
+
+def page_count(file):
+    """Number of pages of an image or PDF upload"""
+    if is_pdf(file):
+        pdf = _open_pdf(file)
+        try:
+            return len(pdf)
+        finally:
+            pdf.close()
+    try:
+        return getattr(Image.open(file), 'n_frames', 1)
+    finally:
+        file.seek(0)
+
+
+def _check_page_size(index, width, height):
+    if width * height > settings.RECEIPT_MAX_PAGE_PIXELS:
+        raise ValueError(f'Page {index + 1} is too large to scan ({width:.0f} x {height:.0f})')
+
+
+def check_page_sizes(file):
+    """ValueError when a page of an image or PDF upload is over RECEIPT_MAX_PAGE_PIXELS"""
+    if is_pdf(file):
+        pdf = _open_pdf(file)
+        try:
+            for index in range(len(pdf)):
+                # PDF sizes are in points, 72 to the inch
+                _check_page_size(index, *pdf.get_page_size(index))
+        finally:
+            pdf.close()
+        return
+    try:
+        for index, frame in enumerate(ImageSequence.Iterator(Image.open(file))):
+            _check_page_size(index, *frame.size)
+    finally:
+        file.seek(0)
+
+
+def _render_scale(page, scale):
+    """`scale`, lowered so the rendered page stays within RECEIPT_MAX_PAGE_PIXELS"""
+    width, height = page.get_size()
+    area, edges = max(width * height, 1), width + height
+    # Rendered sides are rounded up: solve (width*s + 1) * (height*s + 1) = limit
+    limit = (math.sqrt(edges ** 2 + 4 * area * (settings.RECEIPT_MAX_PAGE_PIXELS - 1)) - edges) / (2 * area)
+    return min(scale, limit)
+
+
+def pdf_first_page(file, size):
+    """The first page of a PDF rendered with its longest edge at `size` pixels (for thumbnails)"""
+    pdf = _open_pdf(file)
+    try:
+        page = pdf[0]
+        try:
+            width, height = page.get_size()
+            return page.render(scale=size / max(width, height, 1)).to_pil().convert('RGB')
+        finally:
+            page.close()
+    finally:
+        pdf.close()
+
+
+def load_pages(file, max_pages=None):
+    """
+    The pages of an image or PDF (file-like object or path) as loaded PIL
+    images; ValueError when there are more than `max_pages` or an image
+    page is over RECEIPT_MAX_PAGE_PIXELS.
+    """
+    max_pages = max_pages or settings.RECEIPT_MAX_PAGES
+    if not hasattr(file, 'read'):
+        with open(file, 'rb') as handle:
+            return load_pages(handle, max_pages)
+
+    if is_pdf(file):
+        pdf = _open_pdf(file)
+        try:
+            _check_pages(len(pdf), max_pages)
+            # pdfium is not thread-safe: render every page here, before the
+            # pages are extracted in parallel
+            scale = settings.RECEIPT_PDF_DPI / 72
+            pages = []
+            for index in range(len(pdf)):
+                page = pdf[index]
+                try:
+                    pages.append(page.render(scale=_render_scale(page, scale)).to_pil().convert('RGB'))
+                finally:
+                    page.close()
+            return pages
+        finally:
+            pdf.close()
+
+    file.seek(0)
+    try:
+        image = Image.open(file)
+        _check_pages(getattr(image, 'n_frames', 1), max_pages)
+        for index, frame in enumerate(ImageSequence.Iterator(image)):
+            _check_page_size(index, *frame.size)
+        image.seek(0)
+        if getattr(image, 'n_frames', 1) == 1:
+            image.load()
+            return [image]
+        # Frames share the file's decoder; copy each one out
+        return [frame.copy() for frame in ImageSequence.Iterator(image)]
+    finally:
+        file.seek(0)
+
+
+def _check_pages(count, max_pages):
+    if count > max_pages:
+        raise ValueError(f'Receipt has {count} pages; at most {max_pages} can be scanned')
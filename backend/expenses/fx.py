@@ -0,0 +1,175 @@
+"""
+Currency conversion into settings.BASE_CURRENCY.
+
+Expense.amount_base is filled at write time (Expense.save) and recomputed in
+bulk with a single UPDATE per currency whenever rates are loaded or
+corrected, so aggregates can sum one indexed column instead of converting
+rows at read time. The rate used for an expense is the latest FxRate on or
+before the expense date, or the earliest one after it for expenses older
+than the first loaded rate. Currency codes are compared case-insensitively.
+
+Expenses in a currency without any rate have no amount_base: they are left
+out of the base-currency totals rather than summed as if they were in the
+base currency, and unconverted() reports them so the views can say so.
+
+load_rates() keeps everything derived from amount_base in step with the
+UPDATE: budget counters move by the difference in each (user, category,
+day), archived rows and their ArchiveAggregate totals are recomputed too,
+and the affected users' versions, cached insights, classifiers and live
+streams are refreshed, as for a bulk update (see bulk.py).
+"""
+
+import logging
+from datetime import datetime
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, Count, DecimalField, F, Min, OuterRef, Subquery, When
+from django.db.models.functions import Coalesce, Round, Upper
+
+from . import archive, budgets, classifier, items, live, versions
+from .models import ArchivedExpense, Expense, FxRate, UserInsight
+
+logger = logging.getLogger(__name__)
+
+CENT = Decimal('0.01')
+
+
+def base_currency():
+    return settings.BASE_CURRENCY
+
+
+def _day(when):
+    return when.date() if isinstance(when, datetime) else when
+
+
+def is_base(currency):
+    return not currency or currency.upper() == base_currency().upper()
+
+
+def rate_for(currency, when):
+    """Latest rate for `currency` on or before `when`, else the earliest after it; None without any"""
+    if is_base(currency):
+        return Decimal('1')
+    rates = FxRate.objects.filter(currency=currency.upper())
+    day = _day(when)
+    if day is None:
+        return rates.order_by('-date').values_list('rate', flat=True).first()
+    rate = rates.filter(date__lte=day).order_by('-date').values_list('rate', flat=True).first()
+    if rate is None:
+        rate = rates.filter(date__gt=day).order_by('date').values_list('rate', flat=True).first()
+    return rate
+
+
+def to_base(amount, currency, when):
+    """Convert `amount` in `currency` to the base currency; None when no rate is known"""
+    if amount is None:
+        return None
+    amount = Decimal(str(amount))
+    rate = rate_for(currency, when)
+    if rate is None:
+        logger.warning("[fx] no %s rate loaded, leaving the base amount empty", currency)
+        return None
+    return (amount * rate).quantize(CENT)
+
+
+def amount_base_expression():
+    """SQL expression computing amount_base for each row of an UPDATE"""
+    rates = FxRate.objects.filter(currency=Upper(OuterRef('currency')))
+    before = Subquery(rates.filter(date__lte=OuterRef('date__date')).order_by('-date').values('rate')[:1])
+    after = Subquery(rates.filter(date__gt=OuterRef('date__date')).order_by('date').values('rate')[:1])
+    money = DecimalField(max_digits=14, decimal_places=2)
+    return Case(
+        When(currency__iexact=base_currency(), then=F('amount')),
+        # NULL when the currency has no rate at all
+        default=Round(F('amount') * Coalesce(before, after), 2, output_field=money),
+        output_field=money,
+    )
+
+
+def unconverted(queryset):
+    """{'count', 'currencies'} of the expenses in `queryset` left out of base-currency totals"""
+    rows = queryset.filter(amount_base__isnull=True, amount__isnull=False).values_list(
+        Upper('currency')).annotate(count=Count('id')).order_by()
+    counts = dict(rows)
+    return {'count': sum(counts.values()), 'currencies': sorted(counts)}
+
+
+def recompute_amount_base(queryset=None, currency=None, start=None):
+    """
+    Set-based recomputation of amount_base; returns the number of rows updated.
+
+    `currency` and `start` (a date) narrow the update to the rows a rate
+    change can affect.
+    """
+    queryset = Expense.objects.all() if queryset is None else queryset
+    if currency:
+        queryset = queryset.filter(currency__iexact=currency)
+    if start:
+        queryset = queryset.filter(date__date__gte=start)
+    if queryset.model is Expense:
+        # Items first: `queryset` may select on amount_base
+        items.update_base_amounts(queryset, amount_base_expression())
+    return queryset.update(amount_base=amount_base_expression())
+
+
+def _recompute_currency(currency, start):
+    """Recompute live and archived rows in `currency` from `start`; returns (rows updated, usernames)"""
+    expenses = Expense.objects.filter(currency__iexact=currency)
+    archived = ArchivedExpense.objects.filter(currency__iexact=currency)
+    if start:
+        expenses = expenses.filter(date__date__gte=start)
+        archived = archived.filter(date__date__gte=start)
+    usernames = set(expenses.values_list('username', flat=True).distinct().order_by())
+    usernames |= set(archived.values_list('username', flat=True).distinct().order_by())
+
+    before = budgets.contributions(expenses)
+    updated = recompute_amount_base(expenses)
+    budgets.apply_deltas(budgets.difference(before, budgets.contributions(expenses)))
+    updated += archive.update_amounts(archived, recompute_amount_base)
+    return updated, usernames
+
+
+def _invalidate_caches(usernames):
+    UserInsight.objects.filter(username__in=[u or '' for u in usernames]).delete()
+    versions.bump(usernames)
+    transaction.on_commit(lambda: classifier.registry.expire(usernames))
+    # Shared budgets moved as well: every stream takes a new snapshot
+    live.publish(None, 'refresh')
+
+
+def load_rates(rows, recompute=True):
+    """
+    Upsert (date, currency, rate) rows and recompute affected expenses.
+
+    Returns (rates_loaded, expenses_updated).
+    """
+    rates = {}
+    for day, currency, rate in rows:
+        currency = currency.strip().upper()
+        rates[(currency, day)] = FxRate(currency=currency, date=day, rate=Decimal(str(rate)))
+
+    updated, usernames = 0, set()
+    with transaction.atomic():
+        # Expenses older than a currency's first rate use the earliest one
+        first_rates = dict(FxRate.objects.filter(currency__in={currency for currency, _ in rates}).values_list(
+            'currency').annotate(first=Min('date')).order_by())
+        FxRate.objects.bulk_create(
+            rates.values(), batch_size=1000,
+            update_conflicts=True, unique_fields=['currency', 'date'], update_fields=['rate'],
+        )
+        if recompute:
+            earliest = {}
+            for currency, day in rates:
+                earliest[currency] = min(day, earliest.get(currency, day))
+            for currency, day in earliest.items():
+                if not is_base(currency):
+                    first = first_rates.get(currency)
+                    start = None if first is None or day < first else day
+                    count, affected = _recompute_currency(currency, start)
+                    updated += count
+                    usernames |= affected
+        if usernames:
+            _invalidate_caches(usernames)
+    return len(rates), updated
@@ -1,30 +1,25 @@
 import google.generativeai as genai
+from concurrent.futures import ThreadPoolExecutor
+
 from django.conf import settings
+from django.db import connections
+from django.utils.module_loading import import_string
+
+from . import documents, tiering
+from .jsonstream import IncrementalObjectParser
+from .metrics import external_call
 import json
 import base64
-from PIL import Image
-import io
+import time
+import uuid
 
 
-class GeminiReceiptExtractor:
-    def __init__(self):
-        genai.configure(api_key=settings.GEMINI_API_KEY)
-        # Use newer, faster multimodal model
-        self.model = genai.GenerativeModel('gemini-2.5-flash')
-    
-    def extract_receipt_data(self, image_file):
-        try:
-            # Load image
-            if hasattr(image_file, 'read'):
-                # File-like object
-                image_data = image_file.read()
-                image = Image.open(io.BytesIO(image_data))
-            else:
-                # String path
-                image = Image.open(image_file)
-            
-            # Create the prompt for receipt extraction
-            prompt = """
+VALID_CATEGORIES = ['food', 'transport', 'shopping', 'entertainment',
+                    'utilities', 'healthcare', 'education', 'other']
+
+VALID_PAYMENT_METHODS = ['cash', 'credit_card', 'debit_card', 'upi', 'other']
+
+FULL_PROMPT = """
             Analyze this receipt image and extract the following information in JSON format:
             
             {
@@ -51,51 +46,336 @@ class GeminiReceiptExtractor:
             If any field is not visible or uncertain, use null for that field.
             Return ONLY valid JSON, no markdown formatting or additional text.
             """
-            response = self.model.generate_content([prompt, image])
-            
-            response_text = response.text.strip()
-            
-            if response_text.startswith('```json'):
-                response_text = response_text[7:]
-            if response_text.startswith('```'):
-                response_text = response_text[3:]
-            if response_text.endswith('```'):
-                response_text = response_text[:-3]
-            
-            response_text = response_text.strip()
-            
-            extracted_data = json.loads(response_text)
-            
-            cleaned_data = self._clean_extracted_data(extracted_data)
-            
-            # Also extract raw text for debugging/visibility
-            raw_text_prompt = "Extract all visible text from this receipt image. Return only plain text without any markdown."
-            try:
-                raw_text_resp = self.model.generate_content([raw_text_prompt, image])
-                raw_text = (raw_text_resp.text or '').strip()
-            except Exception as _:
-                raw_text = None
-            
-            return {
-                'success': True,
-                'data': cleaned_data,
-                'raw_text': raw_text
-            }
-            
+
+# Smaller prompt for users whose category can be predicted locally
+LITE_PROMPT = """
+            Extract this receipt as JSON:
+            {"merchant_name": str, "amount": number, "currency": "ISO code", "date": "YYYY-MM-DD",
+             "payment_method": "cash|credit_card|debit_card|upi|other", "tax": number, "tip": number,
+             "items": [{"name": str, "quantity": number, "price": number, "total": number}]}
+            Use null for anything not visible. Return ONLY valid JSON.
+            """
+
+# Appended to the prompt for each page of a multi-page receipt
+PAGE_PROMPT = """
+            This image is page {page} of {pages} of one receipt. Extract only what is printed on
+            this page: its items, and amount, tax and tip only if the totals are on this page
+            (null otherwise).
+            """
+
+
+def _strip_fences(response_text):
+    """Model output without a surrounding ```json fence"""
+    response_text = response_text.strip()
+    
+    if response_text.startswith('```json'):
+        response_text = response_text[7:]
+    if response_text.startswith('```'):
+        response_text = response_text[3:]
+    if response_text.endswith('```'):
+        response_text = response_text[:-3]
+    
+    return response_text.strip()
+
+
+def merge_pages(pages):
+    """
+    One receipt from the cleaned extractions of its pages, in page order
+    (None for pages that failed). Items are concatenated; amount, tax and
+    tip come from the last page that has them, since totals are printed at
+    the end, with the amount falling back to the sum of the items; currency
+    comes from the page of the amount; the other fields come from the first
+    page that has them.
+    """
+    pages = [page for page in pages if page]
+    merged = dict.fromkeys(pages[0])
+    merged['items'] = [item for page in pages for item in (page.get('items') or [])]
+
+    totals_page = next((page for page in reversed(pages) if page.get('amount')), None)
+    if totals_page is not None:
+        merged['amount'] = totals_page['amount']
+    else:
+        item_totals = [tiering.item_total(item) for item in merged['items']]
+        merged['amount'] = round(sum(total for total in item_totals if total is not None), 2)
+    for field in ('tax', 'tip'):
+        merged[field] = next((page[field] for page in reversed(pages) if page.get(field)), 0.0)
+    merged['currency'] = (totals_page or pages[0]).get('currency')
+
+    for field in ('merchant_name', 'date', 'category', 'payment_method'):
+        if field in merged:
+            values = [page.get(field) for page in pages if page.get(field) and page.get(field) != 'other']
+            merged[field] = values[0] if values else pages[0].get(field)
+    if 'description' in merged:
+        descriptions = [page['description'] for page in pages if page.get('description')]
+        merged['description'] = '\n'.join(dict.fromkeys(descriptions)) or None
+    return merged
+
+
+class GeminiReceiptExtractor:
+    def __init__(self):
+        genai.configure(api_key=settings.GEMINI_API_KEY)
+        # Cheapest model first; an extraction failing the consistency checks
+        # is retried on the next tier (see tiering.py)
+        self.tiers = [(name, genai.GenerativeModel(name)) for name in settings.GEMINI_MODEL_TIERS]
+        self.scan_id = uuid.uuid4().hex
+    
+    def extract_receipt_data(self, image_file, lite=False):
+        """
+        Extract receipt fields from an image or a multi-page TIFF/PDF.
+
+        With lite=True a shorter prompt is used that leaves out category,
+        description and time (the caller fills category from the local
+        classifier) and the raw-text pass is skipped.
+
+        The pages of a multi-page receipt are extracted in parallel
+        (RECEIPT_PAGE_CONCURRENCY at a time) and merged into one result
+        (see merge_pages), so a scan takes about as long as its slowest page.
+        """
+        self.scan_id = uuid.uuid4().hex
+        try:
+            pages = self._load_pages(image_file)
         except Exception as e:
+            return {'success': False, 'error': str(e), 'data': None, 'raw_text': None}
+        
+        prompt = LITE_PROMPT if lite else FULL_PROMPT
+        operation = 'lite_extract' if lite else 'extract'
+        cleaned_data, error = None, None
+        for tier in range(len(self.tiers)):
+            data, failed_checks, error = self._extract_pages_on_tier(tier, operation, prompt, pages)
+            cleaned_data = data if data is not None else cleaned_data
+            if not failed_checks:
+                break
+        
+        if cleaned_data is None:
             return {
                 'success': False,
-                'error': str(e),
+                'error': error,
                 'data': None,
                 'raw_text': None
             }
+        
+        # Also extract raw text for debugging/visibility
+        raw_text = None if lite else self._pages_raw_text(pages)
+        
+        return {
+            'success': True,
+            'data': cleaned_data,
+            'raw_text': raw_text
+        }
+    
+    def stream_receipt_data(self, image_file, lite=False):
+        """
+        Streamed variant of extract_receipt_data.
+
+        Yields ('field', name, value) and ('item', index, item) while the
+        first tier's JSON arrives, then ('result', result) with the dict
+        extract_receipt_data would return, without raw text. Full
+        extractions end with ('raw_text', text) from a second call.
+
+        When the streamed result fails the consistency checks, the next
+        tiers run unstreamed: ('escalated', model) tells the client to drop
+        the fields received so far, and the final ones are sent again.
+
+        Multi-page receipts are not streamed: their fields and items are
+        sent together once the pages are extracted and merged.
+        """
+        self.scan_id = uuid.uuid4().hex
+        try:
+            pages = self._load_pages(image_file)
+        except Exception as e:
+            yield ('result', {'success': False, 'error': str(e), 'data': None, 'raw_text': None})
+            return
+        
+        if len(pages) > 1:
+            # extract_receipt_data sets its own scan id
+            result = self.extract_receipt_data(pages, lite=lite)
+            if result['success']:
+                for field, value in result['data'].items():
+                    if field != 'items':
+                        yield ('field', field, value)
+                for index, item in enumerate(result['data'].get('items') or []):
+                    yield ('item', index, item)
+            yield ('result', {**result, 'raw_text': None})
+            if result['success'] and result['raw_text'] is not None:
+                yield ('raw_text', result['raw_text'])
+            return
+        
+        image = pages[0]
+        prompt = LITE_PROMPT if lite else FULL_PROMPT
+        operation = 'lite_extract_stream' if lite else 'extract_stream'
+        name, model = self.tiers[0]
+        response, cleaned_data = None, None
+        start = time.perf_counter()
+        try:
+            parser = IncrementalObjectParser(stream_arrays=('items',))
+            extracted_data, streamed_items = {}, 0
+            with external_call('gemini', operation):
+                response = model.generate_content([prompt, image], stream=True)
+                for chunk in response:
+                    for event in parser.feed(chunk.text or ''):
+                        if event[0] == 'item':
+                            # Cleaned and numbered as in the saved items
+                            item = self._clean_item(event[3])
+                            if item is not None:
+                                yield ('item', streamed_items, item)
+                                streamed_items += 1
+                            continue
+                        _, field, value = event
+                        extracted_data[field] = value
+                        if field != 'items':
+                            yield ('field', field, self._clean_field(field, value))
+            if not parser.done:
+                raise ValueError('Model response ended before the JSON object was complete')
+            cleaned_data = self._clean_extracted_data(extracted_data)
+            failed_checks, error = tiering.check_extraction(cleaned_data), None
+        except Exception as e:
+            failed_checks, error = ['error'], str(e)
+        escalate = bool(failed_checks) and len(self.tiers) > 1
+        tiering.record_call(self.scan_id, operation, name, 0, time.perf_counter() - start, response,
+                            success=cleaned_data is not None, failed_checks=failed_checks, escalated=escalate)
+        
+        if escalate:
+            for tier in range(1, len(self.tiers)):
+                yield ('escalated', self.tiers[tier][0])
+                data, failed_checks, error = self._extract_on_tier(
+                    tier, 'lite_extract' if lite else 'extract', prompt, image)
+                cleaned_data = data if data is not None else cleaned_data
+                if not failed_checks:
+                    break
+            if cleaned_data is not None:
+                for field, value in cleaned_data.items():
+                    if field != 'items':
+                        yield ('field', field, value)
+                for index, item in enumerate(cleaned_data.get('items') or []):
+                    yield ('item', index, item)
+        
+        if cleaned_data is None:
+            yield ('result', {'success': False, 'error': error, 'data': None, 'raw_text': None})
+            return
+        
+        yield ('result', {'success': True, 'data': cleaned_data, 'raw_text': None})
+        if not lite:
+            yield ('raw_text', self._raw_text(image))
+    
+    def _extract_on_tier(self, tier, operation, prompt, image, check=True):
+        """
+        (cleaned data or None, failed check names, error) of one recorded
+        extraction call; with check=False only errors count as failures.
+        """
+        name, model = self.tiers[tier]
+        response, cleaned_data, error = None, None, None
+        start = time.perf_counter()
+        try:
+            with external_call('gemini', operation):
+                response = model.generate_content([prompt, image])
+            cleaned_data = self._clean_extracted_data(json.loads(_strip_fences(response.text)))
+            failed_checks = tiering.check_extraction(cleaned_data) if check else []
+        except Exception as e:
+            failed_checks, error = ['error'], str(e)
+        tiering.record_call(self.scan_id, operation, name, tier, time.perf_counter() - start, response,
+                            success=cleaned_data is not None, failed_checks=failed_checks,
+                            escalated=bool(failed_checks) and tier < len(self.tiers) - 1)
+        return cleaned_data, failed_checks, error
+    
+    def _extract_pages_on_tier(self, tier, operation, prompt, pages):
+        """
+        _extract_on_tier for every page in parallel, merged; the checks run
+        on the merged receipt. A page that fails fails the tier with no data:
+        a receipt missing pages is never a result, even on the last tier.
+        """
+        if len(pages) == 1:
+            return self._extract_on_tier(tier, operation, prompt, pages[0])
+        
+        def extract_page(index):
+            page_prompt = prompt + PAGE_PROMPT.format(page=index + 1, pages=len(pages))
+            return self._extract_on_tier(tier, operation, page_prompt, pages[index], check=False)
+        
+        results = self._map_pages(extract_page, pages)
+        errors = [f'page {index + 1}: {error}' for index, (_, _, error) in enumerate(results) if error]
+        if len(errors) == len(pages):
+            return None, ['error'], errors[0]
+        cleaned_data = merge_pages([data for data, _, _ in results])
+        failed_checks = tiering.check_extraction(cleaned_data)
+        tiering.record_checks(self.scan_id, tier, failed_checks,
+                              escalated=bool(failed_checks or errors) and tier < len(self.tiers) - 1)
+        if errors:
+            return None, ['error'] + failed_checks, '; '.join(errors)
+        return cleaned_data, failed_checks, None
+    
+    def _map_pages(self, function, pages):
+        """[function(index) for each page], up to RECEIPT_PAGE_CONCURRENCY pages at a time"""
+        def run(index):
+            try:
+                return function(index)
+            finally:
+                # record_call() opened a connection in this worker thread
+                connections.close_all()
+        
+        workers = max(1, min(settings.RECEIPT_PAGE_CONCURRENCY, len(pages)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='receipt-page') as pool:
+            return list(pool.map(run, range(len(pages))))
+    
+    def _generate(self, operation, contents):
+        """generate_content on the cheapest tier, timed and recorded"""
+        name, model = self.tiers[0]
+        response = None
+        start = time.perf_counter()
+        try:
+            with external_call('gemini', operation):
+                response = model.generate_content(contents)
+            return response
+        finally:
+            tiering.record_call(self.scan_id, operation, name, 0, time.perf_counter() - start, response,
+                                success=response is not None)
+    
+    def _load_pages(self, image_file):
+        """PIL images of the upload's pages (a list of images is passed through)"""
+        if isinstance(image_file, list):
+            return image_file
+        return documents.load_pages(image_file)
+    
+    def _raw_text(self, image):
+        """All visible text of the receipt, for debugging/visibility; None on failure"""
+        raw_text_prompt = "Extract all visible text from this receipt image. Return only plain text without any markdown."
+        try:
+            raw_text_resp = self._generate('raw_text', [raw_text_prompt, image])
+            return (raw_text_resp.text or '').strip()
+        except Exception:
+            return None
+    
+    def _pages_raw_text(self, pages):
+        """_raw_text of every page in parallel, with a marker line before each page"""
+        if len(pages) == 1:
+            return self._raw_text(pages[0])
+        texts = self._map_pages(lambda index: self._raw_text(pages[index]), pages)
+        if all(text is None for text in texts):
+            return None
+        return '\n\n'.join(f'--- Page {index + 1} ---\n{text or ""}' for index, text in enumerate(texts))
+    
+    def suggest_category(self, merchant_name, items=None):
+        """
+        Text-only category guess from merchant and item names, used when the
+        local classifier is not confident after a lite extraction.
+        """
+        item_names = ', '.join(str(item.get('name')) for item in (items or []) if isinstance(item, dict) and item.get('name'))
+        prompt = (
+            f"Merchant: {merchant_name or 'unknown'}\n"
+            f"Items: {item_names or 'unknown'}\n"
+            f"Reply with exactly one category from: {', '.join(VALID_CATEGORIES)}"
+        )
+        try:
+            response = self._generate('suggest_category', prompt)
+            category = (response.text or '').strip().lower()
+        except Exception:
+            return 'other'
+        return category if category in VALID_CATEGORIES else 'other'
     
     def _clean_extracted_data(self, data):
         """Clean and validate extracted data"""
         cleaned = {}
         
         # Clean merchant name
-        cleaned['merchant_name'] = data.get('merchant_name', '').strip() or None
+        cleaned['merchant_name'] = (data.get('merchant_name') or '').strip() or None
         
         # Clean amount
         try:
@@ -108,21 +388,18 @@ class GeminiReceiptExtractor:
             cleaned['amount'] = 0.0
         
         
-        cleaned['currency'] = data.get('currency', 'USD').upper()
+        cleaned['currency'] = (data.get('currency') or 'USD').upper()
         
         
         cleaned['date'] = data.get('date')
         
         
-        valid_categories = ['food', 'transport', 'shopping', 'entertainment', 
-                           'utilities', 'healthcare', 'education', 'other']
-        category = data.get('category', 'other').lower()
-        cleaned['category'] = category if category in valid_categories else 'other'
+        category = (data.get('category') or 'other').lower()
+        cleaned['category'] = category if category in VALID_CATEGORIES else 'other'
         
         
-        valid_methods = ['cash', 'credit_card', 'debit_card', 'upi', 'other']
-        payment = data.get('payment_method', 'other').lower()
-        cleaned['payment_method'] = payment if payment in valid_methods else 'other'
+        payment = (data.get('payment_method') or 'other').lower()
+        cleaned['payment_method'] = payment if payment in VALID_PAYMENT_METHODS else 'other'
         
         
         try:
@@ -139,9 +416,34 @@ class GeminiReceiptExtractor:
             cleaned['tip'] = 0.0
         
         
-        cleaned['items'] = data.get('items', [])
+        items = data.get('items')
+        cleaned['items'] = [item for item in map(self._clean_item, items if isinstance(items, list) else [])
+                            if item is not None]
         
         
-        cleaned['description'] = data.get('description', '').strip() or None
+        cleaned['description'] = (data.get('description') or '').strip() or None
         
         return cleaned
+    
+    def _clean_item(self, item):
+        """One line item with a stripped name and numeric amounts; None when it is not an object"""
+        if not isinstance(item, dict):
+            return None
+        cleaned = dict(item)
+        cleaned['name'] = str(item.get('name') or '').strip() or None
+        for key in ('quantity', 'price', 'total'):
+            value = item.get(key)
+            try:
+                cleaned[key] = float(str(value).replace(',', '').replace('$', '')) if value not in (None, '') else None
+            except (ValueError, TypeError):
+                cleaned[key] = None
+        return cleaned
+    
+    def _clean_field(self, name, value):
+        """One field cleaned as _clean_extracted_data would; unknown fields pass through"""
+        return self._clean_extracted_data({name: value}).get(name, value)
+
+
+def get_receipt_extractor():
+    """Instantiate the extractor class named by settings.RECEIPT_EXTRACTOR"""
+    return import_string(settings.RECEIPT_EXTRACTOR)()
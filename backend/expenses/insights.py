@@ -0,0 +1,201 @@
+"""
+Spending insights computed with NumPy.
+
+Per-user daily totals are pulled with one grouped values_list query and
+scattered into a (users x days) matrix; every statistic is then computed
+along the day axis for all users at once. The same code serves a single
+user live (GET /api/expenses/insights/) and the nightly batch over all
+users (manage.py compute_insights). Stored insights carry the user's
+ExpenseVersion (see versions.py) and are served only while it is current.
+"""
+
+import calendar
+from datetime import datetime, time, timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from . import versions
+from .models import Expense, ExpenseVersion, UserInsight
+
+
+def daily_matrix(end, days, usernames=None):
+    """
+    Return (usernames, start_date, matrix) where matrix[u, d] is the base
+    amount user u spent on start_date + d. Expenses without a username are
+    grouped under ''.
+    """
+    start = end - timedelta(days=days - 1)
+    # Plain datetime bounds so the date index can be used
+    rows = Expense.objects.filter(
+        date__gte=timezone.make_aware(datetime.combine(start, time.min)),
+        date__lt=timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min)),
+    )
+    if usernames is not None:
+        user_filter = Q(username__in=[u for u in usernames if u])
+        if '' in usernames or None in usernames:
+            user_filter |= Q(username__isnull=True) | Q(username='')
+        rows = rows.filter(user_filter)
+    rows = rows.annotate(day=TruncDate('date')).values_list('username', 'day').annotate(
+        total=Sum('amount_base')
+    ).order_by()
+
+    names, day_values, totals = [], [], []
+    for username, day, total in rows.iterator():
+        names.append(username or '')
+        day_values.append(day.toordinal())
+        totals.append(float(total or 0))
+
+    if usernames is not None:
+        user_keys = np.array(sorted({u or '' for u in usernames} | set(names)), dtype=object)
+    else:
+        user_keys = np.array(sorted(set(names)), dtype=object)
+    matrix = np.zeros((len(user_keys), days))
+    if names:
+        user_index = np.searchsorted(user_keys, np.array(names, dtype=object))
+        day_index = np.array(day_values) - start.toordinal()
+        np.add.at(matrix, (user_index, day_index), np.array(totals))
+    return list(user_keys), start, matrix
+
+
+def rolling_mean(matrix, window):
+    """Trailing moving average along the day axis (shorter at the start)"""
+    cumulative = np.cumsum(matrix, axis=1)
+    shifted = np.zeros_like(cumulative)
+    shifted[:, window:] = cumulative[:, :-window]
+    counts = np.minimum(np.arange(1, matrix.shape[1] + 1), window)
+    return (cumulative - shifted) / counts
+
+
+def spend_day_quantile(sorted_spend, counts, q):
+    """
+    Per-row linear-interpolated quantile over the days with spending.
+
+    `sorted_spend` has each row's spend days sorted ascending and padded
+    with +inf, `counts` is the number of spend days per row. This avoids
+    np.nanpercentile, which falls back to a per-row loop.
+    """
+    position = q * np.maximum(counts - 1, 0)
+    low = np.floor(position).astype(int)
+    high = np.minimum(low + 1, np.maximum(counts - 1, 0))
+    rows = np.arange(sorted_spend.shape[0])
+    low_values = sorted_spend[rows, low]
+    high_values = sorted_spend[rows, high]
+    values = low_values + (high_values - low_values) * (position - low)
+    return np.where(counts > 0, values, 0.0)
+
+
+def matrix_days(days, today):
+    """Days of history to load for a `days` window: at least back to the start of the month"""
+    return max(days, today.day)
+
+
+def compute_statistics(matrix, start, today, days=None):
+    """
+    Vectorized statistics for every row of a (users x days) daily matrix.
+
+    With `days`, the statistics cover the last `days` columns; the matrix
+    may reach further back so month-to-date covers the whole month.
+    """
+    # Month-end forecast: month-to-date plus the recent daily run rate for
+    # the days that are left in the month.
+    month_start_index = max(today.replace(day=1).toordinal() - start.toordinal(), 0)
+    month_to_date = matrix[:, month_start_index:].sum(axis=1)
+    if days is not None and days < matrix.shape[1]:
+        matrix = matrix[:, -days:]
+
+    users, days = matrix.shape
+    counts = np.count_nonzero(matrix > 0, axis=1)
+    sorted_spend = np.sort(np.where(matrix > 0, matrix, np.inf), axis=1)
+
+    rolling_7 = rolling_mean(matrix, 7)
+    rolling_30 = rolling_mean(matrix, 30)
+
+    with np.errstate(invalid='ignore'):
+        median = spend_day_quantile(sorted_spend, counts, 0.5)
+        p90 = spend_day_quantile(sorted_spend, counts, 0.9)
+    volatility = matrix.std(axis=1, ddof=1) if days > 1 else np.zeros(users)
+
+    days_in_month = calendar.monthrange(today.year, today.month)[1]
+    forecast = month_to_date + rolling_30[:, -1] * (days_in_month - today.day)
+
+    return {
+        'total': matrix.sum(axis=1),
+        'daily_mean': matrix.mean(axis=1),
+        'median_daily_spend': median,
+        'p90_daily_spend': p90,
+        'volatility': volatility,
+        'rolling_7_avg': rolling_7[:, -1],
+        'rolling_30_avg': rolling_30[:, -1],
+        'month_to_date': month_to_date,
+        'month_end_forecast': forecast,
+        'series': {'daily': matrix, 'rolling_7': rolling_7, 'rolling_30': rolling_30},
+    }
+
+
+def _row(stats, index, include_series):
+    data = {key: round(float(value[index]), 2) for key, value in stats.items() if key != 'series'}
+    if include_series:
+        data['series'] = {key: np.round(value[index], 2) for key, value in stats['series'].items()}
+    return data
+
+
+def user_insights(username, days=None, include_series=False):
+    """Insights for one user computed live"""
+    days = days or settings.INSIGHTS_WINDOW_DAYS
+    today = timezone.localdate()
+    usernames, start, matrix = daily_matrix(
+        today, matrix_days(days, today), usernames=[username or ''] if username else None)
+    if username is None:
+        # No user given: one series over all expenses, like the other analytics views
+        matrix = matrix.sum(axis=0, keepdims=True)
+        index = 0
+    else:
+        index = usernames.index(username)
+    stats = compute_statistics(matrix, start, today, days)
+    data = _row(stats, index, include_series)
+    data.update({'start_date': _window_start(today, days), 'end_date': today.isoformat(), 'days': days})
+    return data
+
+
+def _window_start(today, days):
+    return (today - timedelta(days=days - 1)).isoformat()
+
+
+def compute_all(days=None, chunk_size=10000):
+    """Precompute insights for every user; returns the number stored"""
+    days = days or settings.INSIGHTS_WINDOW_DAYS
+    today = timezone.localdate()
+    all_users = sorted({u or '' for u in Expense.objects.values_list('username', flat=True).distinct().order_by()})
+
+    stored = 0
+    for offset in range(0, len(all_users), chunk_size):
+        chunk = all_users[offset:offset + chunk_size]
+        # Read before the expenses: a write in between only makes the row stale early
+        chunk_versions = dict(ExpenseVersion.objects.filter(username__in=chunk).values_list('username', 'version'))
+        usernames, start, matrix = daily_matrix(today, matrix_days(days, today), usernames=chunk)
+        stats = compute_statistics(matrix, start, today, days)
+        now = timezone.now()
+        records = []
+        for index, username in enumerate(usernames):
+            data = _row(stats, index, include_series=False)
+            data.update({'start_date': _window_start(today, days), 'end_date': today.isoformat(), 'days': days})
+            records.append(UserInsight(username=username, computed_for=today, computed_at=now,
+                                       version=chunk_versions.get(username, 0), data=data))
+        UserInsight.objects.bulk_create(
+            records, batch_size=1000, update_conflicts=True,
+            unique_fields=['username'], update_fields=['computed_for', 'computed_at', 'version', 'data'],
+        )
+        stored += len(records)
+    return stored
+
+
+def cached_insights(username):
+    """Today's precomputed insights for `username` if none of the user's expenses was written since"""
+    insight = UserInsight.objects.filter(username=username or '', computed_for=timezone.localdate()).first()
+    if insight is None or insight.version != versions.current(username):
+        return None
+    return insight.data
@@ -0,0 +1,172 @@
+"""
+Normalized line items.
+
+Expense.items keeps the line items as the receipt extraction returned them
+(a JSON list of {"name", "quantity", "price", "total"}). ExpenseItem holds
+the same items as rows with a normalized name, so item questions ("how much
+did I spend on milk", "what does coffee cost lately") are grouped SQL over
+an indexed table instead of a JSON parse of every expense.
+
+Rows are rebuilt in bulk whenever an expense is created with items or its
+items or amount_base change (the post_save signal), and for existing data
+by `manage.py backfill_expense_items`. Archived expenses keep only their
+JSON; item analytics cover the live table.
+
+Each row stores its amounts in the base currency too, converted at its
+expense's amount_base / amount rate when the row is built, so analytics sum
+the item table without a join to the expenses. Set-based recomputations of
+amount_base (fx.recompute_amount_base) update them with
+update_base_amounts().
+"""
+
+import re
+import unicodedata
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.db.models import Count, DateField, DecimalField, ExpressionWrapper, F, Max, Min, OuterRef, Subquery, Sum
+from django.db.models.functions import NullIf, Round, TruncMonth
+
+from .models import Expense, ExpenseItem
+
+_non_word_re = re.compile(r'[^a-z0-9 ]+')
+
+# Amounts beyond what the DecimalFields hold are extraction noise
+_MAX_VALUE = Decimal('10000000')
+
+CENT = Decimal('0.01')
+
+_MONEY = DecimalField(max_digits=14, decimal_places=2)
+
+
+def normalize_item_name(name):
+    """Lowercase, strip accents and punctuation: "Org. Whole MILK 1L" -> "org whole milk 1l" """
+    if not name:
+        return ''
+    name = unicodedata.normalize('NFKD', str(name)).encode('ascii', 'ignore').decode('ascii').lower()
+    name = _non_word_re.sub(' ', name.replace("'", ''))
+    return ' '.join(name.split())[:255]
+
+
+def _decimal(value, places):
+    if value is None or value == '':
+        return None
+    try:
+        number = Decimal(str(value).replace(',', '').replace('$', '').strip())
+    except InvalidOperation:
+        return None
+    if not number.is_finite() or abs(number) >= _MAX_VALUE:
+        return None
+    return number.quantize(Decimal(1).scaleb(-places))
+
+
+def _base_rate(expense):
+    """amount_base / amount of `expense`; None when it has no base amount"""
+    if expense.amount_base is None or not expense.amount:
+        return None
+    return Decimal(expense.amount_base) / Decimal(expense.amount)
+
+
+def _to_base(value, rate):
+    if value is None or rate is None:
+        return None
+    return (value * rate).quantize(CENT)
+
+
+def item_rows(expense):
+    """Unsaved ExpenseItem rows for the items of `expense`"""
+    rate = _base_rate(expense)
+    rows = []
+    for position, item in enumerate(expense.items if isinstance(expense.items, list) else []):
+        if not isinstance(item, dict):
+            continue
+        name = str(item.get('name') or '').strip()
+        normalized = normalize_item_name(name)
+        if not normalized:
+            continue
+        quantity = _decimal(item.get('quantity'), 3)
+        if not quantity or quantity <= 0:
+            quantity = Decimal('1.000')
+        unit_price = _decimal(item.get('price'), 2)
+        total = _decimal(item.get('total'), 2)
+        if total is None and unit_price is not None:
+            total = _decimal(unit_price * quantity, 2)
+        if unit_price is None and total is not None:
+            unit_price = _decimal(total / quantity, 2)
+        rows.append(ExpenseItem(
+            expense_id=expense.id, position=min(position, 32767), name=name[:255],
+            normalized_name=normalized, quantity=quantity, unit_price=unit_price, total=total,
+            unit_price_base=_to_base(unit_price, rate), total_base=_to_base(total, rate),
+        ))
+    return rows
+
+
+def replace_items(expenses, batch_size=1000):
+    """Rebuild the ExpenseItem rows of `expenses`: one DELETE and one bulk INSERT; returns the row count"""
+    rows = [row for expense in expenses for row in item_rows(expense)]
+    with transaction.atomic():
+        ExpenseItem.objects.filter(expense_id__in=[expense.id for expense in expenses]).delete()
+        ExpenseItem.objects.bulk_create(rows, batch_size=batch_size)
+    return len(rows)
+
+
+def update_base_amounts(expenses, amount_base=None):
+    """
+    Recompute the base-currency amounts of the items of `expenses` (a
+    queryset); `amount_base` is an expression over the expense giving its
+    base amount, by default the stored one.
+    """
+    amount_base = F('amount_base') if amount_base is None else amount_base
+    rate = Subquery(
+        Expense.objects.filter(id=OuterRef('expense_id')).values(
+            rate=ExpressionWrapper(amount_base / NullIf(F('amount'), 0), output_field=DecimalField())
+        )[:1]
+    )
+    return ExpenseItem.objects.filter(expense__in=expenses.values('id')).update(
+        unit_price_base=Round(F('unit_price') * rate, 2, output_field=_MONEY),
+        total_base=Round(F('total') * rate, 2, output_field=_MONEY),
+    )
+
+
+def item_queryset(username=None, start=None, name=None):
+    """Line items, optionally of one user, from `start` and of one item (exact normalized name)"""
+    items = ExpenseItem.objects.all()
+    if username:
+        items = items.filter(expense__username=username)
+    if start is not None:
+        items = items.filter(expense__date__gte=start)
+    if name:
+        # An exact match uses the index, and "milk" does not take in "milkshake"
+        items = items.filter(normalized_name=normalize_item_name(name))
+    return items
+
+
+def top_items(items, limit=10):
+    """Items with the highest spend (in the base currency), grouped by normalized name"""
+    rows = items.values('normalized_name').annotate(
+        name=Max('name'),
+        spent=Sum('total_base'),
+        units=Sum('quantity'),
+        purchases=Count('expense_id', distinct=True),
+        min_unit_price=Min('unit_price_base'),
+        max_unit_price=Max('unit_price_base'),
+    ).order_by('-spent', 'normalized_name')[:limit]
+    return list(rows)
+
+
+def price_history(items):
+    """Monthly unit price range and spend of `items` (in the base currency), oldest month first"""
+    rows = items.filter(unit_price__isnull=False).annotate(
+        month=TruncMonth('expense__date', output_field=DateField())
+    ).values('month').annotate(
+        spent=Sum('total_base'),
+        units=Sum('quantity'),
+        purchases=Count('expense_id', distinct=True),
+        min_unit_price=Min('unit_price_base'),
+        max_unit_price=Max('unit_price_base'),
+        # Quantity-weighted average unit price
+        avg_unit_price=ExpressionWrapper(
+            Sum(F('unit_price_base') * F('quantity')) / NullIf(Sum('quantity'), 0), output_field=_MONEY,
+        ),
+    ).order_by('month')
+    return list(rows)
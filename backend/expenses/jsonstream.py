@@ -0,0 +1,94 @@
+"""
+Incremental parsing of one JSON object arriving in text chunks.
+
+Used to forward fields of a streamed model response as soon as each one is
+complete. Text before the opening brace (such as a ```json fence) and after
+the closing brace is ignored.
+"""
+
+import json
+
+
+class IncrementalObjectParser:
+    """
+    feed() text chunks; each call returns the events completed by the new text:
+
+    - ('field', key, value) for every member of the top-level object
+    - ('item', key, index, value) for every element of the array members
+      named in `stream_arrays`, before the member's own 'field' event
+    """
+
+    def __init__(self, stream_arrays=('items',)):
+        self.stream_arrays = set(stream_arrays)
+        self.buffer = ''
+        self.pos = 0
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.started = False
+        self.done = False
+        self.member_start = None
+        self.key = None
+        self.value_start = None
+        self.element_start = None  # set while inside a streamed array
+        self.element_index = 0
+
+    def feed(self, text):
+        self.buffer += text
+        events = []
+        buffer = self.buffer
+        for i in range(self.pos, len(buffer)):
+            if self.done:
+                break
+            c = buffer[i]
+            if not self.started:
+                if c == '{':
+                    self.started, self.depth, self.member_start = True, 1, i + 1
+                continue
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif c == '\\':
+                    self.escape = True
+                elif c == '"':
+                    self.in_string = False
+                continue
+
+            if c == '"':
+                self.in_string = True
+            elif c == ':' and self.depth == 1 and self.key is None:
+                self.key = json.loads(buffer[self.member_start:i])
+                self.value_start = i + 1
+            elif c in '{[':
+                self.depth += 1
+                if c == '[' and self.depth == 2 and self.key in self.stream_arrays:
+                    self.element_start, self.element_index = i + 1, 0
+            elif c in '}]':
+                if self.depth == 2 and self.element_start is not None:
+                    self._end_element(i, events)
+                    self.element_start = None
+                self.depth -= 1
+                if self.depth == 0:
+                    self._end_member(i, events)
+                    self.done = True
+            elif c == ',':
+                if self.depth == 1:
+                    self._end_member(i, events)
+                elif self.depth == 2 and self.element_start is not None:
+                    self._end_element(i, events)
+                    self.element_start = i + 1
+        self.pos = len(buffer)
+        return events
+
+    def _end_element(self, end, events):
+        text = self.buffer[self.element_start:end].strip()
+        if text:
+            events.append(('item', self.key, self.element_index, json.loads(text)))
+            self.element_index += 1
+
+    def _end_member(self, end, events):
+        if self.key is not None:
+            events.append(('field', self.key, json.loads(self.buffer[self.value_start:end])))
+        elif self.buffer[self.member_start:end].strip():
+            raise ValueError(f'Malformed JSON member: {self.buffer[self.member_start:end].strip()[:50]!r}')
+        self.key, self.value_start, self.member_start = None, None, end + 1
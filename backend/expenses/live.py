@@ -0,0 +1,301 @@
+"""
+Live summary and budget updates pushed to clients.
+
+GET /api/live/ (with X-Username or ?username=) is a server-sent event
+stream that replaces polling /expenses/summary/ and /budgets/status/:
+
+- `snapshot`: the user's summary totals and budget status, sent first and
+  again whenever the stream is told to refresh or the local date changes
+  (the previous figures plus deltas are then discarded);
+- `delta`: sent after each write to one of the user's expenses, with the
+  changed summary windows as differences ({"today": {"total": "-4.50",
+  "count": -1}, ...}) and the new status of the budgets it touches. Shared
+  budgets (no username) follow every user's expenses: their new status goes
+  to every stream in a delta of its own, with an empty summary.
+
+Deltas are computed from the changed row alone (the expense's old and new
+values in the post_save/post_delete signals), never by re-running the
+aggregates. Writes that bypass the signals (bulk updates/deletes) and
+budget changes publish `refresh`, which the stream turns into a snapshot.
+
+Events go through the LiveEvent outbox, written in the same transaction
+as the expense, so they are sent only for committed writes and reach
+streams served by any worker process. The outbox is written only with
+LIVE_UPDATES_ENABLED (off by default; turn it on with the ASGI server), and
+rows older than LIVE_EVENT_TTL_SECONDS are purged after a write at most
+once per PURGE_INTERVAL in each process, whether or not a stream is open. Each worker runs one Relay task that
+polls the outbox every LIVE_POLL_INTERVAL while it has subscribers and
+fans new rows out to per-connection queues; an idle stream costs a
+coroutine and a queue, not a thread or a query. The stream needs the ASGI
+application (e.g. `uvicorn expense_tracker_api.asgi:application`); under
+WSGI it answers 501.
+"""
+
+import asyncio
+import json
+import logging
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Q, Sum
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+
+from . import archive, budgets
+from .models import Budget, Expense, LiveEvent
+
+logger = logging.getLogger(__name__)
+
+QUEUE_SIZE = 100
+
+# Outbox rows are re-read for this long, for transactions that commit out of id order
+RELAY_LOOKBACK = timedelta(seconds=5)
+
+PURGE_INTERVAL = timedelta(minutes=1)
+
+_purged_at = None
+
+
+def summary_windows(now):
+    """Start of the summary's week and month windows (today is the local date)"""
+    return {'week': now - timedelta(days=now.weekday()), 'month': now.replace(day=1)}
+
+
+def summary_totals(username=None):
+    """The /expenses/summary/ figures, for one user's expenses when `username` is given"""
+    now = timezone.now()
+    windows = summary_windows(now)
+    expenses = Expense.objects.all()
+    if username is not None:
+        expenses = expenses.filter(username=username)
+
+    def totals(queryset):
+        return {
+            'total': queryset.aggregate(total=Sum('amount_base'))['total'] or Decimal('0.00'),
+            'count': queryset.count(),
+        }
+
+    # All time includes the archive
+    all_time = totals(expenses)
+    archived_total, archived_count = archive.archived_totals(username=username)
+    return {
+        'today': totals(expenses.filter(date__date=timezone.localdate(now))),
+        'week': totals(expenses.filter(date__gte=windows['week'])),
+        'month': totals(expenses.filter(date__gte=windows['month'])),
+        'all_time': {'total': all_time['total'] + archived_total, 'count': all_time['count'] + archived_count},
+    }
+
+
+def _user_budgets(username):
+    return Budget.objects.filter(Q(username__isnull=True) | Q(username=username))
+
+
+def snapshot(username):
+    """(id of the latest outbox event it includes, the user's summary and budget status)"""
+    # One transaction, so on SQLite the figures and the event id are read from the same state
+    with transaction.atomic():
+        mark = _latest_event_id()
+        return mark, {
+            'summary': summary_totals(username),
+            'budgets': budgets.status(_user_budgets(username)),
+            'currency': settings.BASE_CURRENCY,
+        }
+
+
+def summary_delta(contributions, now=None):
+    """
+    Summary window differences from signed (sign, (username, category, date,
+    amount_base)) contributions; windows that do not change are left out.
+    """
+    now = now or timezone.now()
+    windows = summary_windows(now)
+    today = timezone.localdate(now)
+    delta = defaultdict(lambda: {'total': Decimal('0.00'), 'count': 0})
+    for sign, (_, _, when, amount) in contributions:
+        if when is None:
+            continue
+        if timezone.is_naive(when):
+            # Fresh instances keep a parsed date as assigned (the scan views assign naive ones)
+            when = timezone.make_aware(when)
+        amount = amount or Decimal('0.00')
+        names = ['all_time']
+        if timezone.localdate(when) == today:
+            names.append('today')
+        names += [name for name, start in windows.items() if when >= start]
+        for name in names:
+            delta[name]['total'] += sign * amount
+            delta[name]['count'] += sign
+    return {name: change for name, change in delta.items() if change['total'] or change['count']}
+
+
+def publish(username, kind, payload=None):
+    """Queue an event for `username`'s streams (None: every stream), inside the current transaction"""
+    global _purged_at
+    if not settings.LIVE_UPDATES_ENABLED:
+        return
+    LiveEvent.objects.create(username=username, kind=kind, payload=payload)
+    now = timezone.now()
+    if _purged_at is None or now - _purged_at > PURGE_INTERVAL:
+        _purged_at = now
+        # After the write commits, outside its transaction
+        transaction.on_commit(purge_events)
+
+
+def expense_changed(before, after):
+    """Publish the deltas of one expense write; `before`/`after` are budgets.expense_contribution() tuples"""
+    if not settings.LIVE_UPDATES_ENABLED or before == after:
+        return
+    by_user = defaultdict(list)
+    if before:
+        by_user[before[0]].append((-1, before))
+    if after:
+        by_user[after[0]].append((1, after))
+
+    for username, contributions in by_user.items():
+        if not username:
+            continue  # No stream follows expenses without a user
+        categories = {contribution[1] for _, contribution in contributions}
+        payload = {
+            'summary': summary_delta(contributions),
+            'budgets': budgets.status(Budget.objects.filter(username=username, category__in=categories)),
+        }
+        if payload['summary'] or payload['budgets']:
+            publish(username, 'delta', payload)
+
+    # Shared budgets count every user's expenses, so every stream shows them
+    categories = {contribution[1] for contribution in (before, after) if contribution}
+    shared = budgets.status(Budget.objects.filter(username__isnull=True, category__in=categories))
+    if shared:
+        publish(None, 'delta', {'summary': {}, 'budgets': shared})
+
+
+def refresh(usernames):
+    """Tell the users' streams to send a new snapshot"""
+    for username in usernames:
+        publish(username, 'refresh')
+
+
+class Relay:
+    """Per-process fan-out of outbox rows to the open streams"""
+
+    def __init__(self):
+        self.subscribers = defaultdict(set)
+        self.task = None
+
+    def subscribe(self, username):
+        queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self.subscribers[username].add(queue)
+        loop = asyncio.get_running_loop()
+        if self.task is None or self.task.done() or self.task.get_loop() is not loop:
+            self.task = loop.create_task(self._run())
+        return queue
+
+    def unsubscribe(self, username, queue):
+        queues = self.subscribers.get(username)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self.subscribers[username]
+
+    def _deliver(self, event):
+        if event.username is None:
+            targets = [queue for queues in self.subscribers.values() for queue in queues]
+        else:
+            targets = self.subscribers.get(event.username, ())
+        for queue in list(targets):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # A client this far behind gets a fresh snapshot instead
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(LiveEvent(kind='refresh'))
+
+    async def _run(self):
+        last_id = await sync_to_async(_latest_event_id)()
+        delivered = {}
+        last_purge = timezone.now()
+        while self.subscribers:
+            await asyncio.sleep(settings.LIVE_POLL_INTERVAL)
+            try:
+                now = timezone.now()
+                events = await sync_to_async(_new_events)(last_id, now - RELAY_LOOKBACK)
+                for event in events:
+                    if event.id not in delivered:
+                        delivered[event.id] = event.created_at
+                        last_id = max(last_id, event.id)
+                        self._deliver(event)
+                delivered = {id: at for id, at in delivered.items() if at >= now - RELAY_LOOKBACK}
+                if now - last_purge > PURGE_INTERVAL:
+                    await sync_to_async(purge_events)()
+                    last_purge = now
+            except Exception:
+                logger.exception("Live update relay failed to read the outbox")
+
+
+def _latest_event_id():
+    return LiveEvent.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+
+def _new_events(last_id, since):
+    return list(LiveEvent.objects.filter(Q(id__gt=last_id) | Q(created_at__gte=since)).order_by('id'))
+
+
+def purge_events():
+    cutoff = timezone.now() - timedelta(seconds=settings.LIVE_EVENT_TTL_SECONDS)
+    return LiveEvent.objects.filter(created_at__lt=cutoff).delete()[0]
+
+
+relay = Relay()
+
+
+def _sse(event, data, event_id=None):
+    lines = f"id: {event_id}\n" if event_id is not None else ''
+    return f"{lines}event: {event}\ndata: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n"
+
+
+async def _events(username):
+    queue = relay.subscribe(username)
+    try:
+        mark, data = await sync_to_async(snapshot)(username)
+        yield _sse('snapshot', data, mark)
+        day = timezone.localdate()
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), settings.LIVE_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                # The summary's today/week/month windows move at midnight
+                if timezone.localdate() == day:
+                    yield ': keepalive\n\n'
+                    continue
+                event = LiveEvent(kind='refresh')
+            if event.kind == 'refresh':
+                mark, data = await sync_to_async(snapshot)(username)
+                day = timezone.localdate()
+                yield _sse('snapshot', data, mark)
+            elif event.id > mark:
+                # Older events are already part of the last snapshot
+                yield _sse(event.kind, event.payload, event.id)
+    finally:
+        relay.unsubscribe(username, queue)
+
+
+async def stream(request):
+    """Server-sent summary and budget updates for one user"""
+    if request.method != 'GET':
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({'error': 'Live updates need the ASGI application'}, status=501)
+    username = request.headers.get('X-Username') or request.GET.get('username')
+    if not username:
+        return JsonResponse({'error': 'Pass X-Username or ?username='}, status=400)
+    response = StreamingHttpResponse(_events(username), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from expenses import archive
+from expenses.models import Expense
+
+
+class Command(BaseCommand):
+    help = "Move expenses older than ARCHIVE_AFTER_DAYS (or --before) to the archive tables"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--before', help="Archive expenses dated before this day (YYYY-MM-DD, "
+                                             "rounded down to the first of its month)")
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--dry-run', action='store_true', help="Only count the expenses to archive")
+
+    def handle(self, *args, **options):
+        if options['before']:
+            before = parse_date(options['before'])
+            if before is None:
+                raise CommandError(f"Invalid date: {options['before']}")
+            cutoff = archive.month_start(before)
+        else:
+            cutoff = archive.default_cutoff()
+
+        if options['dry_run']:
+            count = Expense.objects.filter(date__lt=archive.start_of_day(cutoff)).count()
+            self.stdout.write(f"{count} expense(s) dated before {cutoff} would be archived")
+            return
+
+        try:
+            moved = archive.archive_before(cutoff, batch_size=options['batch_size'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(f"Archived {moved} expense(s) dated before {cutoff}"))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Max, Min
+
+from expenses import fx
+from expenses.models import Expense
+
+
+class Command(BaseCommand):
+    help = "Fill Expense.amount_base in batches of set-based UPDATEs"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument('--all', action='store_true',
+                            help="Recompute every expense, not only rows without a base amount")
+
+    def handle(self, *args, **options):
+        queryset = Expense.objects.all()
+        if not options['all']:
+            queryset = queryset.filter(amount_base__isnull=True)
+
+        bounds = queryset.aggregate(low=Min('id'), high=Max('id'))
+        if bounds['low'] is None:
+            self.stdout.write("Nothing to backfill")
+            return
+
+        updated = 0
+        batch_size = options['batch_size']
+        for start in range(bounds['low'], bounds['high'] + 1, batch_size):
+            updated += fx.recompute_amount_base(queryset.filter(id__gte=start, id__lt=start + batch_size))
+        self.stdout.write(self.style.SUCCESS(f"Updated {updated} expense(s)"))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Max, Min
+
+from expenses import items
+from expenses.models import Expense
+
+
+class Command(BaseCommand):
+    help = "Build ExpenseItem rows from Expense.items in batches of bulk INSERTs"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--all', action='store_true',
+                            help="Rebuild every expense's items, not only expenses without item rows")
+
+    def handle(self, *args, **options):
+        queryset = Expense.objects.exclude(items__isnull=True)
+        if not options['all']:
+            queryset = queryset.filter(line_items__isnull=True)
+
+        bounds = queryset.aggregate(low=Min('id'), high=Max('id'))
+        if bounds['low'] is None:
+            self.stdout.write("Nothing to backfill")
+            return
+
+        expenses = created = 0
+        batch_size = options['batch_size']
+        for start in range(bounds['low'], bounds['high'] + 1, batch_size):
+            batch = list(queryset.filter(id__gte=start, id__lt=start + batch_size).only('id', 'items'))
+            created += items.replace_items(batch)
+            expenses += len(batch)
+        self.stdout.write(self.style.SUCCESS(f"Created {created} item row(s) for {expenses} expense(s)"))
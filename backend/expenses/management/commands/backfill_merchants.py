@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from expenses.merchants import resolve_merchant
+from expenses.models import Expense
+
+
+class Command(BaseCommand):
+    help = "Assign a normalized Merchant to expenses that do not have one yet"
+
+    def handle(self, *args, **options):
+        pending = Expense.objects.filter(merchant__isnull=True).exclude(merchant_name__isnull=True).exclude(merchant_name='')
+        names = pending.values_list('merchant_name', flat=True).distinct().order_by()
+
+        resolved = updated = 0
+        for name in list(names):
+            merchant_id = resolve_merchant(name)
+            if merchant_id is None:
+                continue
+            # One set-based UPDATE per distinct raw name
+            updated += pending.filter(merchant_name=name).update(merchant_id=merchant_id)
+            resolved += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Resolved {resolved} distinct merchant name(s), updated {updated} expense(s)"
+        ))
@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from expenses import insights
+
+
+class Command(BaseCommand):
+    help = "Precompute spending insights for all users (run nightly)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None, help="Window size, defaults to INSIGHTS_WINDOW_DAYS")
+        parser.add_argument('--chunk-size', type=int, default=10000, help="Users per vectorized batch")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        stored = insights.compute_all(days=options['days'], chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Computed insights for {stored} user(s) in {time.perf_counter() - start:.1f}s"
+        ))
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+
+from expenses.models import Expense
+from expenses.storage import has_thumbnails, is_content_addressed, receipt_storage
+
+
+class Command(BaseCommand):
+    help = "Move legacy receipt images into content-addressed storage and generate thumbnails"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep-originals', action='store_true',
+                            help="Do not delete the legacy files after migrating them")
+
+    def handle(self, *args, **options):
+        migrated = missing = 0
+        legacy_names = set()
+
+        expenses = Expense.objects.exclude(receipt_image='').exclude(receipt_image__isnull=True)
+        for expense in expenses.only('id', 'receipt_image').iterator():
+            old_name = expense.receipt_image.name
+            if is_content_addressed(old_name):
+                continue
+            if not receipt_storage.exists(old_name):
+                missing += 1
+                continue
+
+            with receipt_storage.open(old_name) as fh:
+                new_name = receipt_storage.save(old_name, fh)
+            Expense.objects.filter(pk=expense.pk).update(receipt_image=new_name, has_thumbnails=has_thumbnails(new_name))
+            legacy_names.add(old_name)
+            migrated += 1
+
+        if not options['keep_originals']:
+            for name in legacy_names:
+                receipt_storage.delete(name)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Migrated {migrated} receipt(s), removed {0 if options['keep_originals'] else len(legacy_names)} "
+            f"legacy file(s), {missing} missing"
+        ))
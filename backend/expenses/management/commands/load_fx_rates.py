@@ -0,0 +1,31 @@
+import csv
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from expenses import fx
+
+
+class Command(BaseCommand):
+    help = "Load daily FX rates from a CSV file (date,currency,rate) and recompute base amounts"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV with columns date (YYYY-MM-DD), currency, rate "
+                                         "(units of BASE_CURRENCY per unit of currency)")
+        parser.add_argument('--no-recompute', action='store_true',
+                            help="Only load rates, do not update Expense.amount_base")
+
+    def handle(self, *args, **options):
+        rows = []
+        try:
+            with open(options['path'], newline='') as fh:
+                for line_no, row in enumerate(csv.DictReader(fh), start=2):
+                    try:
+                        rows.append((date.fromisoformat(row['date'].strip()), row['currency'], row['rate']))
+                    except (KeyError, ValueError, AttributeError) as e:
+                        raise CommandError(f"Invalid row on line {line_no}: {e}")
+        except OSError as e:
+            raise CommandError(str(e))
+
+        loaded, updated = fx.load_rates(rows, recompute=not options['no_recompute'])
+        self.stdout.write(self.style.SUCCESS(f"Loaded {loaded} rate(s), recomputed {updated} expense(s)"))
@@ -0,0 +1,14 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from expenses.profiling import HEADER, make_token
+
+
+class Command(BaseCommand):
+    help = "Print a signed X-Profile header value that turns on profiling for a request"
+
+    def handle(self, *args, **options):
+        if not settings.PROFILING_ENABLED:
+            self.stderr.write(self.style.WARNING("PROFILING_ENABLED is off; the header will be ignored"))
+        self.stdout.write(f"{HEADER}: {make_token()}")
+        self.stdout.write(f"Valid for {settings.PROFILING_TOKEN_MAX_AGE}s")
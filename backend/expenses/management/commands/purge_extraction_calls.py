@@ -0,0 +1,21 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from expenses.models import ExtractionCall
+
+
+class Command(BaseCommand):
+    help = "Delete extraction call records older than EXTRACTION_CALL_TTL_DAYS"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None,
+                            help='Override EXTRACTION_CALL_TTL_DAYS')
+
+    def handle(self, *args, **options):
+        days = options['days'] if options['days'] is not None else settings.EXTRACTION_CALL_TTL_DAYS
+        cutoff = timezone.now() - timedelta(days=days)
+        deleted, _ = ExtractionCall.objects.filter(created_at__lt=cutoff).delete()
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} extraction call(s) older than {days} days"))
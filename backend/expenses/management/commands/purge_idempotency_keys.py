@@ -0,0 +1,21 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from expenses.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    help = "Delete sync idempotency keys older than IDEMPOTENCY_KEY_TTL_HOURS"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=None,
+                            help='Override IDEMPOTENCY_KEY_TTL_HOURS')
+
+    def handle(self, *args, **options):
+        hours = options['hours'] if options['hours'] is not None else settings.IDEMPOTENCY_KEY_TTL_HOURS
+        cutoff = timezone.now() - timedelta(hours=hours)
+        deleted, _ = IdempotencyKey.objects.filter(created_at__lt=cutoff).delete()
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} idempotency key(s) older than {hours}h"))
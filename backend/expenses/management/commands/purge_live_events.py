@@ -0,0 +1,14 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from expenses.live import purge_events
+
+
+class Command(BaseCommand):
+    help = "Delete live update outbox rows older than LIVE_EVENT_TTL_SECONDS (for deployments without open streams)"
+
+    def handle(self, *args, **options):
+        deleted = purge_events()
+        self.stdout.write(self.style.SUCCESS(
+            f"Deleted {deleted} live event(s) older than {settings.LIVE_EVENT_TTL_SECONDS}s"
+        ))
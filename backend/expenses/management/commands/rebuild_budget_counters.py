@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from expenses import budgets
+from expenses.models import Budget
+
+
+class Command(BaseCommand):
+    help = "Recompute current- and future-period budget spend counters from raw expenses"
+
+    def handle(self, *args, **options):
+        count = 0
+        for budget in Budget.objects.all():
+            budgets.rebuild_counter(budget)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt counters for {count} budget(s)"))
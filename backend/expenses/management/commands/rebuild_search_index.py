@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from expenses import search
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search index for expenses"
+
+    def handle(self, *args, **options):
+        if not search.is_available():
+            self.stdout.write(self.style.WARNING(
+                "Full-text search index requires SQLite FTS5; nothing to rebuild"
+            ))
+            return
+        indexed = search.rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f"Indexed {indexed} expense(s)"))
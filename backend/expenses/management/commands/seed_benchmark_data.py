@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from expenses.benchdata import seed_budgets, seed_expenses
+
+
+class Command(BaseCommand):
+    help = "Generate synthetic expenses and budgets for load testing (see benchmarks/load_api.py)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--expenses', type=int, default=100000, help="Number of expenses to insert")
+        parser.add_argument('--users', type=int, default=1000, help="Number of distinct usernames")
+        parser.add_argument('--prefix', default='bench', help="Username prefix, users are <prefix>0..N-1")
+        parser.add_argument('--days', type=int, default=730, help="Spread expense dates over this many past days")
+        parser.add_argument('--budgets-per-user', type=int, default=3)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        usernames = [f"{options['prefix']}{i}" for i in range(options['users'])]
+        total = options['expenses']
+        start = time.perf_counter()
+
+        def progress(inserted):
+            elapsed = time.perf_counter() - start
+            self.stdout.write(f"  {inserted}/{total} expenses ({inserted / elapsed:.0f} rows/s)")
+
+        seed_expenses(
+            total, usernames=usernames, seed=options['seed'], batch_size=options['batch_size'],
+            days=options['days'], resolve_merchants=True, progress=progress,
+        )
+        budgets = 0
+        if options['budgets_per_user']:
+            budgets = seed_budgets(usernames, per_user=options['budgets_per_user'], seed=options['seed'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {total} expense(s) and {budgets} budget(s) for {len(usernames)} user(s) "
+            f"in {time.perf_counter() - start:.1f}s"
+        ))
@@ -0,0 +1,30 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from expenses.routers import copy_sqlite_replica
+
+
+class Command(BaseCommand):
+    help = "Copy the primary SQLite database to the replica file (local replica testing)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=0,
+                            help="Keep copying every N seconds until interrupted")
+
+    def handle(self, *args, **options):
+        if not settings.REPLICA_DATABASE:
+            raise CommandError("No replica configured; set REPLICA_DB_NAME")
+        while True:
+            start = time.perf_counter()
+            try:
+                copy_sqlite_replica()
+            except ValueError as e:
+                raise CommandError(str(e))
+            self.stdout.write(self.style.SUCCESS(
+                f"Replica refreshed in {(time.perf_counter() - start) * 1000:.0f} ms"
+            ))
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,195 @@
+"""
+Merchant normalization and fuzzy matching.
+
+Receipts spell the same merchant many ways ("STARBUCKS #1234",
+"Starbucks Coffee", "starbucks"). resolve_merchant() maps a raw name to a
+Merchant row: first by exact alias, then by trigram similarity against the
+known canonical names, creating a new Merchant when nothing is close enough.
+Results are memoized per normalized name in an LRU cache.
+"""
+
+import re
+import threading
+import unicodedata
+from collections import Counter, OrderedDict, defaultdict
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+
+from .models import Merchant, MerchantAlias
+
+# Explicit store markers only: bare numbers are often part of the name (7-Eleven, 99 Ranch)
+_store_number_re = re.compile(r'(#\s*\d+|\bno\.?\s*\d+\b|\bstore\s*#?\s*\d+\b)')
+_non_word_re = re.compile(r'[^a-z0-9 ]+')
+_space_re = re.compile(r'\s+')
+
+# Legal/corporate suffixes that never distinguish two merchants
+_STOP_WORDS = {'inc', 'llc', 'ltd', 'co', 'corp', 'corporation', 'company', 'the', 'pvt', 'plc', 'gmbh'}
+
+
+def normalize_merchant_name(name):
+    """
+    Lowercase, strip accents, store numbers, punctuation and corporate
+    suffixes: "STARBUCKS #1234" -> "starbucks", "McDonald's Inc." -> "mcdonalds".
+    """
+    if not name:
+        return ''
+    name = unicodedata.normalize('NFKD', name).encode('ascii', 'ignore').decode('ascii').lower()
+    name = name.replace("'", '').replace('&', ' and ')
+    name = _store_number_re.sub(' ', name)
+    name = _non_word_re.sub(' ', name)
+    tokens = [t for t in name.split() if t not in _STOP_WORDS]
+    return ' '.join(tokens)
+
+
+def display_name(name):
+    """Human friendly canonical name for a new merchant"""
+    name = _space_re.sub(' ', _store_number_re.sub(' ', name or '')).strip(' -#')
+    if name.isupper() or name.islower():
+        name = name.title()
+    return name[:255]
+
+
+def trigrams(normalized):
+    padded = f'  {normalized} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def similarity(a, b):
+    """Dice coefficient over character trigrams"""
+    ta, tb = trigrams(a), trigrams(b)
+    if not ta or not tb:
+        return 0.0
+    return 2 * len(ta & tb) / (len(ta) + len(tb))
+
+
+class MerchantMatcher:
+    """
+    In-process trigram index over canonical merchant names.
+
+    The index is loaded from the database on first use and extended as new
+    merchants are created, so matching never scans the Merchant table.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._sizes = {}
+        self._trigram_index = defaultdict(set)
+
+    def _load(self):
+        for merchant_id, normalized in Merchant.objects.values_list('id', 'normalized_name'):
+            self._add(merchant_id, normalized)
+        self._loaded = True
+
+    def _add(self, merchant_id, normalized):
+        grams = trigrams(normalized)
+        self._sizes[merchant_id] = len(grams)
+        for gram in grams:
+            self._trigram_index[gram].add(merchant_id)
+
+    def best_match(self, normalized):
+        """Return (merchant_id, score) of the most similar known merchant"""
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            grams = trigrams(normalized)
+            shared = Counter()
+            for gram in grams:
+                shared.update(self._trigram_index.get(gram, ()))
+            best_id, best_score = None, 0.0
+            for merchant_id, common in shared.items():
+                score = 2 * common / (len(grams) + self._sizes[merchant_id])
+                if score > best_score:
+                    best_id, best_score = merchant_id, score
+        return best_id, best_score
+
+    def add(self, merchant_id, normalized):
+        with self._lock:
+            if self._loaded:
+                self._add(merchant_id, normalized)
+
+    def reset(self):
+        with self._lock:
+            self._loaded = False
+            self._sizes.clear()
+            self._trigram_index.clear()
+
+
+matcher = MerchantMatcher()
+
+
+class _LRUCache:
+    """Thread-safe LRU map of normalized name -> merchant id"""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._data:
+                return None
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+_cache = _LRUCache(maxsize=4096)
+
+
+def _resolve_normalized(normalized, raw_name):
+    merchant_id = MerchantAlias.objects.filter(alias=normalized).values_list('merchant_id', flat=True).first()
+    if merchant_id:
+        return merchant_id
+
+    merchant_id, score = matcher.best_match(normalized)
+    if merchant_id is None or score < settings.MERCHANT_MATCH_THRESHOLD:
+        try:
+            with transaction.atomic():
+                merchant, created = Merchant.objects.get_or_create(
+                    normalized_name=normalized,
+                    defaults={'canonical_name': display_name(raw_name)},
+                )
+        except IntegrityError:
+            merchant = Merchant.objects.get(normalized_name=normalized)
+            created = False
+        merchant_id = merchant.id
+        if created:
+            matcher.add(merchant_id, normalized)
+
+    try:
+        with transaction.atomic():
+            MerchantAlias.objects.get_or_create(alias=normalized, defaults={'merchant_id': merchant_id})
+    except IntegrityError:
+        # Another worker recorded the alias first; trust its mapping
+        return MerchantAlias.objects.get(alias=normalized).merchant_id
+    return merchant_id
+
+
+def resolve_merchant(raw_name):
+    """Return the Merchant id for a raw receipt merchant name, or None"""
+    normalized = normalize_merchant_name(raw_name)
+    if not normalized:
+        return None
+    merchant_id = _cache.get(normalized)
+    if merchant_id is None:
+        merchant_id = _resolve_normalized(normalized, raw_name)
+        _cache.set(normalized, merchant_id)
+    return merchant_id
+
+
+def clear_cache():
+    _cache.clear()
+    matcher.reset()
@@ -0,0 +1,407 @@
+"""
+In-process request metrics with a Prometheus text endpoint.
+
+MetricsMiddleware records, per view: wall time, SQL query count and SQL
+time (through connection.execute_wrapper), and the time spent in
+serializers and the renderer. Calls to Gemini and Google Sheets are timed
+with `external_call()`. Everything goes into fixed-bucket histograms held
+in memory, so recording is a few dict updates under one lock.
+
+Each gunicorn worker has its own registry. When METRICS_DIR is set, every
+worker writes its registry to METRICS_DIR/<pid>.json at most every
+METRICS_FLUSH_INTERVAL seconds, and GET /metrics sums the files of all
+workers. Files of workers that exited are folded into
+METRICS_DIR/retired.json when /metrics is read (and a file left by an
+earlier process with the same pid when a worker first writes), so
+counters stay monotonic without a file per worker ever started.
+
+SQL is timed by one execute wrapper installed on every database connection
+as it opens, which records into the request bound to the current context:
+it follows a request into the threads its sync code runs in under ASGI.
+The middleware itself is sync and async capable, so async requests are not
+adapted to a thread because of it.
+
+Requests slower than SLOW_REQUEST_MS and queries slower than SLOW_QUERY_MS
+are logged with their breakdown.
+"""
+
+import contextvars
+import hmac
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.http import HttpResponse, HttpResponseForbidden
+
+try:
+    import fcntl
+except ImportError:  # Not on Windows: METRICS_DIR is then read without a lock
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+METRICS = {
+    'expense_tracker_request_duration_seconds': ('Wall time of a request', DURATION_BUCKETS),
+    'expense_tracker_request_sql_queries': ('SQL queries issued by a request', COUNT_BUCKETS),
+    'expense_tracker_request_sql_duration_seconds': ('Time a request spent in SQL', DURATION_BUCKETS),
+    'expense_tracker_request_serializer_duration_seconds': ('Time a request spent in serializers', DURATION_BUCKETS),
+    'expense_tracker_request_render_duration_seconds': ('Time a request spent rendering the response', DURATION_BUCKETS),
+    'expense_tracker_external_call_duration_seconds': ('Latency of calls to external services', DURATION_BUCKETS),
+}
+
+# Snapshot of the workers that exited, in METRICS_DIR
+RETIRED_FILE = 'retired.json'
+
+# Label names per metric; the others are labelled by view and method
+LABEL_NAMES = {
+    'expense_tracker_request_duration_seconds': ('view', 'method', 'status'),
+    'expense_tracker_external_call_duration_seconds': ('service', 'operation', 'outcome'),
+}
+
+
+class Registry:
+    """Histograms keyed by (metric name, label values)"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.series = {}
+        self.last_flush = 0.0
+        self.pid = None
+
+    def observe(self, name, labels, value):
+        buckets = METRICS[name][1]
+        key = (name, labels)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = {'buckets': [0] * (len(buckets) + 1), 'sum': 0.0, 'count': 0}
+            # Per-bucket counts; made cumulative when exported
+            series['buckets'][bisect_left(buckets, value)] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def dump(self):
+        with self.lock:
+            return [
+                {'name': name, 'labels': list(labels), 'buckets': list(s['buckets']), 'sum': s['sum'], 'count': s['count']}
+                for (name, labels), s in self.series.items()
+            ]
+
+    def flush(self, force=False):
+        """Write this process's snapshot to METRICS_DIR (throttled)"""
+        directory = settings.METRICS_DIR
+        now = time.monotonic()
+        if not directory or (not force and now - self.last_flush < settings.METRICS_FLUSH_INTERVAL):
+            return
+        self.last_flush = now
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'{os.getpid()}.json')
+        if self.pid != os.getpid():
+            # A file with this pid is left by an earlier worker
+            self.pid = os.getpid()
+            with _locked(directory):
+                if os.path.exists(path):
+                    _retire(directory, [path])
+        _write(path, self.dump())
+
+
+registry = Registry()
+
+
+class RequestMetrics:
+    """Accumulators for the request being handled in this context"""
+
+    def __init__(self):
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.stages = {}
+        self.active = set()
+
+    def __call__(self, execute, sql, params, many, context):
+        # Called by _execute for the queries of this request
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.sql_count += 1
+            self.sql_time += elapsed
+            if elapsed * 1000 >= settings.SLOW_QUERY_MS:
+                logger.warning("Slow query (%.0f ms, %s): %s", elapsed * 1000,
+                               context['connection'].alias, sql[:1000])
+
+
+_current = contextvars.ContextVar('expense_request_metrics', default=None)
+
+
+def _execute(execute, sql, params, many, context):
+    current = _current.get()
+    if current is None:
+        return execute(sql, params, many, context)
+    return current(execute, sql, params, many, context)
+
+
+@receiver(connection_created)
+def _install_execute_wrapper(sender, connection, **kwargs):
+    if _execute not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _execute)
+
+
+def current_request():
+    """RequestMetrics of the request being handled, or None outside MetricsMiddleware"""
+    return _current.get()
+
+
+@contextmanager
+def timed(stage):
+    """Add the time spent in the block to the current request's `stage`"""
+    current = _current.get()
+    # Nested serializers are already inside the outer timing
+    if current is None or stage in current.active:
+        yield
+        return
+    current.active.add(stage)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        current.active.discard(stage)
+        current.stages[stage] = current.stages.get(stage, 0.0) + time.perf_counter() - start
+
+
+@contextmanager
+def external_call(service, operation):
+    """Time a call to an external service, labelled with its outcome"""
+    start = time.perf_counter()
+    outcome = 'error'
+    try:
+        yield
+        outcome = 'ok'
+    finally:
+        elapsed = time.perf_counter() - start
+        registry.observe('expense_tracker_external_call_duration_seconds', (service, operation, outcome), elapsed)
+        current = _current.get()
+        if current is not None:
+            current.stages['external'] = current.stages.get('external', 0.0) + elapsed
+
+
+class TimedSerializerMixin:
+    """Count to_representation() time towards the request's serializer stage"""
+
+    def to_representation(self, instance):
+        with timed('serializer'):
+            return super().to_representation(instance)
+
+
+def _view_label(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return '<unresolved>'
+    return match.view_name or match.route or '<unnamed>'
+
+
+class MetricsMiddleware:
+    """Record per-view latency, SQL and serialization time for every request"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        # Connections opened before this module was imported
+        for connection in connections.all(initialized_only=True):
+            _install_execute_wrapper(None, connection)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not settings.METRICS_ENABLED:
+            return self.get_response(request)
+
+        current = RequestMetrics()
+        token = _current.set(current)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.record(request, response, current, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        if not settings.METRICS_ENABLED:
+            return await self.get_response(request)
+
+        current = RequestMetrics()
+        token = _current.set(current)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.record(request, response, current, time.perf_counter() - start)
+        return response
+
+    def record(self, request, response, current, elapsed):
+        view, method = _view_label(request), request.method
+        labels = (view, method)
+        registry.observe('expense_tracker_request_duration_seconds', (view, method, str(response.status_code)), elapsed)
+        registry.observe('expense_tracker_request_sql_queries', labels, current.sql_count)
+        registry.observe('expense_tracker_request_sql_duration_seconds', labels, current.sql_time)
+        registry.observe('expense_tracker_request_serializer_duration_seconds', labels,
+                         current.stages.get('serializer', 0.0))
+        registry.observe('expense_tracker_request_render_duration_seconds', labels,
+                         current.stages.get('render', 0.0))
+
+        if elapsed * 1000 >= settings.SLOW_REQUEST_MS:
+            logger.warning(
+                "Slow request %s %s (%s): %.0f ms, %d queries / %.0f ms SQL, %s",
+                method, request.path, view, elapsed * 1000, current.sql_count, current.sql_time * 1000,
+                ', '.join(f"{stage} {value * 1000:.0f} ms" for stage, value in sorted(current.stages.items())) or '-',
+            )
+
+        try:
+            registry.flush()
+        except OSError:
+            logger.exception("Could not write metrics snapshot to %s", settings.METRICS_DIR)
+
+
+@contextmanager
+def _locked(directory):
+    """Exclusive lock on METRICS_DIR between the worker processes"""
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.join(directory, '.lock'), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return []
+
+
+def _write(path, series_list):
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(series_list, f)
+    os.replace(tmp_path, path)
+
+
+def _merge(merged, series_list):
+    for series in series_list:
+        key = (series['name'], tuple(series['labels']))
+        target = merged.get(key)
+        if target is None:
+            merged[key] = series
+        else:
+            target['buckets'] = [a + b for a, b in zip(target['buckets'], series['buckets'])]
+            target['sum'] += series['sum']
+            target['count'] += series['count']
+
+
+def _retire(directory, paths):
+    """Fold the worker snapshots at `paths` into RETIRED_FILE and remove them (under _locked)"""
+    retired = os.path.join(directory, RETIRED_FILE)
+    merged = {}
+    for path in [retired, *paths]:
+        _merge(merged, _read(path))
+    _write(retired, list(merged.values()))
+    for path in paths:
+        os.remove(path)
+
+
+def _worker_exited(filename):
+    pid, extension = os.path.splitext(filename)
+    if extension != '.json' or not pid.isdigit():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass  # Alive, under another user
+    return False
+
+
+def collect():
+    """Merged series of every worker (or just this process without METRICS_DIR)"""
+    directory = settings.METRICS_DIR
+    if not directory:
+        return registry.dump()
+    registry.flush(force=True)
+
+    with _locked(directory):
+        filenames = os.listdir(directory)
+        exited = [os.path.join(directory, filename) for filename in filenames if _worker_exited(filename)]
+        if exited:
+            _retire(directory, exited)
+            filenames = os.listdir(directory)
+        merged = {}
+        for filename in filenames:
+            if filename.endswith('.json'):
+                _merge(merged, _read(os.path.join(directory, filename)))
+    return list(merged.values())
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render_prometheus(series_list):
+    """Prometheus text exposition format (version 0.0.4)"""
+    by_name = {}
+    for series in series_list:
+        if series['name'] in METRICS:
+            by_name.setdefault(series['name'], []).append(series)
+
+    lines = []
+    for name, (help_text, buckets) in METRICS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} histogram')
+        label_names = LABEL_NAMES.get(name, ('view', 'method'))
+        for series in sorted(by_name.get(name, []), key=lambda s: s['labels']):
+            labels = ','.join(f'{k}="{_escape(v)}"' for k, v in zip(label_names, series['labels']))
+            cumulative = 0
+            for bound, count in zip(buckets + (float('inf'),), series['buckets']):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(float(bound))
+                lines.append(f'{name}_bucket{{{labels},le="{le}"}} {cumulative}')
+            lines.append(f'{name}_sum{{{labels}}} {series["sum"]!r}')
+            lines.append(f'{name}_count{{{labels}}} {series["count"]}')
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    """
+    GET /metrics for staff users (admin session) or, when METRICS_TOKEN is
+    set, for `Authorization: Bearer <METRICS_TOKEN>`; forbidden otherwise.
+    """
+    token = settings.METRICS_TOKEN
+    authorized = bool(token) and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}')
+    user = getattr(request, 'user', None)
+    if not authorized and not (user is not None and user.is_active and user.is_staff):
+        return HttpResponseForbidden()
+    return HttpResponse(render_prometheus(collect()), content_type='text/plain; version=0.0.4; charset=utf-8')
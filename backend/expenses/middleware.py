@@ -0,0 +1,86 @@
+import gzip
+import re
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+
+_accept_encoding_re = re.compile(r'\s*([a-z*]+)\s*(?:;\s*q\s*=\s*([0-9.]+))?', re.I)
+
+
+def _accepted_encodings(header):
+    """Return {encoding: quality} parsed from an Accept-Encoding header"""
+    accepted = {}
+    for part in header.split(','):
+        match = _accept_encoding_re.match(part)
+        if not match:
+            continue
+        try:
+            quality = float(match.group(2)) if match.group(2) else 1.0
+        except ValueError:
+            quality = 0.0
+        accepted[match.group(1).lower()] = quality
+    return accepted
+
+
+def _choose_encoding(header):
+    accepted = _accepted_encodings(header)
+    candidates = ['br', 'gzip'] if brotli is not None else ['gzip']
+    best, best_quality = None, 0.0
+    for encoding in candidates:
+        quality = accepted.get(encoding, accepted.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """
+    Compress responses with brotli or gzip, negotiated from Accept-Encoding.
+
+    Responses smaller than RESPONSE_COMPRESSION_MIN_BYTES are sent as-is,
+    since compressing them costs more CPU than it saves on the wire.
+    Streaming responses (server-sent events, file downloads) are left alone.
+    """
+
+    def process_response(self, request, response):
+        if response.streaming or response.has_header('Content-Encoding'):
+            return response
+
+        min_bytes = getattr(settings, 'RESPONSE_COMPRESSION_MIN_BYTES', 1024)
+        if len(response.content) < min_bytes:
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+
+        encoding = _choose_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None:
+            return response
+
+        if encoding == 'br':
+            quality = getattr(settings, 'RESPONSE_COMPRESSION_BROTLI_QUALITY', 5)
+            compressed = brotli.compress(response.content, quality=quality)
+        else:
+            level = getattr(settings, 'RESPONSE_COMPRESSION_GZIP_LEVEL', 6)
+            compressed = gzip.compress(response.content, compresslevel=level, mtime=0)
+
+        # Return the uncompressed body if compression did not help
+        if len(compressed) >= len(response.content):
+            return response
+
+        response.content = compressed
+        response.headers['Content-Length'] = str(len(response.content))
+
+        # Same ETag handling as django.middleware.gzip.GZipMiddleware
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = encoding
+
+        return response
@@ -0,0 +1,19 @@
+# Generated by Django 5.0 on 2026-10-19 08:04
+
+import expenses.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0002_budget_user_budget_username_expense_user_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='expense',
+            name='receipt_image',
+            field=models.ImageField(blank=True, null=True, storage=expenses.storage.get_receipt_storage, upload_to='receipts/'),
+        ),
+    ]
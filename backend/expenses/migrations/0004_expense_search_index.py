@@ -0,0 +1,70 @@
+from django.db import migrations
+
+# Frozen copy of search.ITEMS_TEXT as of this migration: the names of the
+# line items in a JSON array column, space-separated
+ITEMS_TEXT = (
+    "(SELECT group_concat(json_extract(value, '$.name'), ' ') FROM json_each("
+    "CASE WHEN json_valid({row}.items) AND json_type({row}.items) = 'array' THEN {row}.items ELSE '[]' END))"
+)
+
+INDEX_ROW = (
+    "INSERT INTO expenses_expense_fts(rowid, username, merchant_name, description, items) "
+    "VALUES ({row}.id, coalesce({row}.username, ''), coalesce({row}.merchant_name, ''), "
+    "coalesce({row}.description, ''), coalesce(" + ITEMS_TEXT + ", ''));"
+)
+
+CREATE_SQL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS expenses_expense_fts USING fts5("
+    "username, merchant_name, description, items, "
+    "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')",
+
+    "CREATE TRIGGER IF NOT EXISTS expenses_expense_fts_ai AFTER INSERT ON expenses_expense BEGIN "
+    + INDEX_ROW.format(row='new') + " END",
+
+    "CREATE TRIGGER IF NOT EXISTS expenses_expense_fts_ad AFTER DELETE ON expenses_expense BEGIN "
+    "DELETE FROM expenses_expense_fts WHERE rowid = old.id; END",
+
+    "CREATE TRIGGER IF NOT EXISTS expenses_expense_fts_au "
+    "AFTER UPDATE OF username, merchant_name, description, items ON expenses_expense BEGIN "
+    "DELETE FROM expenses_expense_fts WHERE rowid = old.id; "
+    + INDEX_ROW.format(row='new') + " END",
+
+    "INSERT INTO expenses_expense_fts(rowid, username, merchant_name, description, items) "
+    "SELECT e.id, coalesce(e.username, ''), coalesce(e.merchant_name, ''), coalesce(e.description, ''), "
+    "coalesce(" + ITEMS_TEXT.format(row='e') + ", '') FROM expenses_expense e",
+]
+
+DROP_SQL = [
+    "DROP TRIGGER IF EXISTS expenses_expense_fts_ai",
+    "DROP TRIGGER IF EXISTS expenses_expense_fts_ad",
+    "DROP TRIGGER IF EXISTS expenses_expense_fts_au",
+    "DROP TABLE IF EXISTS expenses_expense_fts",
+]
+
+
+def create_search_index(apps, schema_editor):
+    # FTS5 is SQLite only; other backends fall back to icontains search
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for sql in CREATE_SQL:
+            cursor.execute(sql)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for sql in DROP_SQL:
+            cursor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0003_receipt_storage'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
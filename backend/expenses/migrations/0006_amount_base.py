@@ -0,0 +1,38 @@
+# Generated by Django 5.0 on 2026-10-19 08:11
+
+from django.db import migrations, models
+
+
+def fill_amount_base(apps, schema_editor):
+    # No rates are loaded yet: every row starts out at its own amount, which is
+    # exact for base-currency expenses. load_fx_rates recomputes the rest.
+    Expense = apps.get_model('expenses', 'Expense')
+    Expense.objects.update(amount_base=models.F('amount'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0005_merchant'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='expense',
+            name='amount_base',
+            field=models.DecimalField(blank=True, db_index=True, decimal_places=2, max_digits=14, null=True),
+        ),
+        migrations.CreateModel(
+            name='FxRate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('currency', models.CharField(max_length=10)),
+                ('date', models.DateField()),
+                ('rate', models.DecimalField(decimal_places=8, max_digits=18)),
+            ],
+            options={
+                'unique_together': {('currency', 'date')},
+            },
+        ),
+        migrations.RunPython(fill_amount_base, migrations.RunPython.noop),
+    ]
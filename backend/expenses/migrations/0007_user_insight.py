@@ -0,0 +1,23 @@
+# Generated by Django 5.0 on 2026-10-19 08:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0006_amount_base'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserInsight',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('username', models.CharField(max_length=150, unique=True)),
+                ('computed_for', models.DateField()),
+                ('computed_at', models.DateTimeField()),
+                ('data', models.JSONField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,90 @@
+# Generated by Django 5.0 on 2026-10-19 08:14
+
+import django.db.models.deletion
+from datetime import datetime, time, timedelta
+
+from django.db import migrations, models
+from django.db.models import Sum
+from django.utils import timezone
+
+
+# Frozen copies of budgets.period_start/period_end as of this migration
+def period_start(period, day):
+    if period == 'daily':
+        return day
+    if period == 'weekly':
+        return day - timedelta(days=day.weekday())
+    if period == 'yearly':
+        return day.replace(month=1, day=1)
+    return day.replace(day=1)
+
+
+def period_end(period, start):
+    if period == 'daily':
+        return start + timedelta(days=1)
+    if period == 'weekly':
+        return start + timedelta(weeks=1)
+    if period == 'yearly':
+        return start.replace(year=start.year + 1)
+    return (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def populate_counters(apps, schema_editor):
+    Budget = apps.get_model('expenses', 'Budget')
+    BudgetSpend = apps.get_model('expenses', 'BudgetSpend')
+    Expense = apps.get_model('expenses', 'Expense')
+    today = timezone.localdate()
+    for budget in Budget.objects.all():
+        start = period_start(budget.period, today)
+        end = period_end(budget.period, start)
+        expenses = Expense.objects.filter(
+            category=budget.category,
+            date__gte=timezone.make_aware(datetime.combine(start, time.min)),
+            date__lt=timezone.make_aware(datetime.combine(end, time.min)),
+        )
+        if budget.username:
+            expenses = expenses.filter(username=budget.username)
+        spent = expenses.aggregate(total=Sum('amount_base'))['total'] or 0
+        BudgetSpend.objects.create(budget=budget, period_start=start, spent=spent)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0007_user_insight'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BudgetAlert',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('username', models.CharField(blank=True, db_index=True, max_length=150, null=True)),
+                ('category', models.CharField(max_length=50)),
+                ('period_start', models.DateField()),
+                ('kind', models.CharField(choices=[('threshold', '80% of budget reached'), ('exceeded', 'Budget exceeded')], max_length=20)),
+                ('spent', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('budget_amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('budget', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='alerts', to='expenses.budget')),
+            ],
+            options={
+                'ordering': ['id'],
+                'unique_together': {('budget', 'period_start', 'kind')},
+            },
+        ),
+        migrations.CreateModel(
+            name='BudgetSpend',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period_start', models.DateField()),
+                ('spent', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('budget', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='spend_counters', to='expenses.budget')),
+            ],
+            options={
+                'unique_together': {('budget', 'period_start')},
+            },
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
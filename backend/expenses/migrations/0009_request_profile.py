@@ -0,0 +1,33 @@
+# Generated by Django 5.0 on 2026-10-19 08:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0008_budget_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RequestProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('method', models.CharField(max_length=10)),
+                ('path', models.CharField(max_length=500)),
+                ('view', models.CharField(max_length=200)),
+                ('username', models.CharField(blank=True, max_length=150, null=True)),
+                ('status_code', models.PositiveSmallIntegerField()),
+                ('duration_ms', models.FloatField()),
+                ('sql_queries', models.PositiveIntegerField(default=0)),
+                ('samples', models.PositiveIntegerField(default=0)),
+                ('trigger', models.CharField(choices=[('header', 'Signed request header'), ('sample', 'Random sample')], max_length=10)),
+                ('folded_stacks', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.0 on 2026-10-19 08:38
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0010_idempotency_key'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedExpense',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('username', models.CharField(blank=True, db_index=True, max_length=150, null=True)),
+                ('receipt_image', models.CharField(blank=True, max_length=100, null=True)),
+                ('merchant_name', models.CharField(blank=True, max_length=255, null=True)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('currency', models.CharField(max_length=10)),
+                ('amount_base', models.DecimalField(blank=True, decimal_places=2, max_digits=14, null=True)),
+                ('category', models.CharField(choices=[('food', 'Food & Dining'), ('transport', 'Transportation'), ('shopping', 'Shopping'), ('entertainment', 'Entertainment'), ('utilities', 'Utilities'), ('healthcare', 'Healthcare'), ('education', 'Education'), ('other', 'Other')], max_length=50)),
+                ('payment_method', models.CharField(choices=[('cash', 'Cash'), ('credit_card', 'Credit Card'), ('debit_card', 'Debit Card'), ('upi', 'UPI'), ('other', 'Other')], max_length=50)),
+                ('date', models.DateTimeField(db_index=True)),
+                ('description', models.TextField(blank=True, null=True)),
+                ('items', models.JSONField(blank=True, null=True)),
+                ('tax', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('tip', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField()),
+                ('merchant', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='archived_expenses', to='expenses.merchant')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='archived_expenses', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-date'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchiveAggregate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('username', models.CharField(blank=True, default='', max_length=150)),
+                ('period_start', models.DateField()),
+                ('category', models.CharField(max_length=50)),
+                ('payment_method', models.CharField(max_length=50)),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('merchant', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='expenses.merchant')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['period_start'], name='expenses_ar_period__94f483_idx')],
+                'unique_together': {('username', 'period_start', 'category', 'payment_method', 'merchant')},
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.0 on 2026-10-19 08:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0011_expense_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExtractionCall',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scan_id', models.CharField(db_index=True, max_length=32)),
+                ('operation', models.CharField(max_length=30)),
+                ('model', models.CharField(max_length=100)),
+                ('tier', models.PositiveSmallIntegerField(default=0)),
+                ('prompt_tokens', models.PositiveIntegerField(blank=True, null=True)),
+                ('output_tokens', models.PositiveIntegerField(blank=True, null=True)),
+                ('total_tokens', models.PositiveIntegerField(blank=True, null=True)),
+                ('latency_ms', models.FloatField()),
+                ('success', models.BooleanField(default=True)),
+                ('failed_checks', models.CharField(blank=True, default='', max_length=200)),
+                ('escalated', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
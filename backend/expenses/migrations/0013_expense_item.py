@@ -0,0 +1,30 @@
+# Generated by Django 5.0 on 2026-10-19 08:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0012_extraction_call'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExpenseItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveSmallIntegerField(default=0)),
+                ('name', models.CharField(max_length=255)),
+                ('normalized_name', models.CharField(db_index=True, max_length=255)),
+                ('quantity', models.DecimalField(decimal_places=3, default=1, max_digits=10)),
+                ('unit_price', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('total', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('expense', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='line_items', to='expenses.expense')),
+            ],
+            options={
+                'ordering': ['expense', 'position'],
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.0 on 2026-10-19 08:50
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0013_expense_item'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['date', 'id'], name='expenses_ex_date_9369f8_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['category', 'date'], name='expenses_ex_categor_125683_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['payment_method', 'date'], name='expenses_ex_payment_899ccc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['currency', 'date'], name='expenses_ex_currenc_13c0c9_idx'),
+        ),
+    ]
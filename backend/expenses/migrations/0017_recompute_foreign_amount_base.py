@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models.functions import Coalesce, Round, Upper
+
+
+def recompute_foreign_amount_base(apps, schema_editor):
+    # 0006 copied the amount into amount_base for every row, so expenses in
+    # other currencies were summed as base-currency amounts. Convert them at
+    # the nearest rate (on or before the date, else the earliest after it),
+    # or leave amount_base empty when the currency has no rate.
+    Expense = apps.get_model('expenses', 'Expense')
+    FxRate = apps.get_model('expenses', 'FxRate')
+    rates = FxRate.objects.filter(currency=Upper(models.OuterRef('currency')))
+    before = models.Subquery(rates.filter(date__lte=models.OuterRef('date__date')).order_by('-date').values('rate')[:1])
+    after = models.Subquery(rates.filter(date__gt=models.OuterRef('date__date')).order_by('date').values('rate')[:1])
+    money = models.DecimalField(max_digits=14, decimal_places=2)
+    Expense.objects.exclude(currency__iexact=settings.BASE_CURRENCY).update(
+        amount_base=Round(models.F('amount') * Coalesce(before, after), 2, output_field=money)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0016_expense_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(recompute_foreign_amount_base, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0 on 2026-10-19 09:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0017_recompute_foreign_amount_base'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userinsight',
+            name='version',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
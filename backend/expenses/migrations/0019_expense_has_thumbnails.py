@@ -0,0 +1,54 @@
+import re
+from importlib import import_module
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.db import migrations, models
+
+# Frozen copy of the receipt naming in storage.py as of this migration
+_hashed_name_re = re.compile(r'^receipts/[0-9a-f]{2}/(?P<digest>[0-9a-f]{64})\.[A-Za-z0-9]+$')
+
+
+def record_thumbnails(apps, schema_editor):
+    # Flag the receipts whose thumbnails are all on disk, once, instead of
+    # checking the files every time an expense is serialized
+    Expense = apps.get_model('expenses', 'Expense')
+    storage = FileSystemStorage()
+    with_thumbnails = []
+    for expense_id, name in Expense.objects.exclude(receipt_image='').exclude(
+            receipt_image__isnull=True).values_list('id', 'receipt_image').iterator():
+        match = _hashed_name_re.match(name)
+        if match and all(storage.exists(f"receipts/thumbs/{match.group('digest')}_{size}.webp")
+                         for size in settings.RECEIPT_THUMBNAIL_SIZES):
+            with_thumbnails.append(expense_id)
+    for start in range(0, len(with_thumbnails), 500):
+        Expense.objects.filter(id__in=with_thumbnails[start:start + 500]).update(has_thumbnails=True)
+
+
+def restore_search_triggers(apps, schema_editor):
+    # SQLite adds a NOT NULL column by rebuilding the table, which drops the
+    # full-text index triggers of 0004 (the index table itself is kept)
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    search_index = import_module('expenses.migrations.0004_expense_search_index')
+    with schema_editor.connection.cursor() as cursor:
+        for sql in search_index.CREATE_SQL:
+            if sql.startswith('CREATE TRIGGER'):
+                cursor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0018_user_insight_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='expense',
+            name='has_thumbnails',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(restore_search_triggers, migrations.RunPython.noop),
+        migrations.RunPython(record_thumbnails, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+from django.db import migrations, models
+from django.db.models import DecimalField, ExpressionWrapper, F, OuterRef, Subquery
+from django.db.models.functions import NullIf, Round
+
+
+def fill_base_amounts(apps, schema_editor):
+    # Convert the existing rows at their expense's amount_base / amount rate
+    Expense = apps.get_model('expenses', 'Expense')
+    ExpenseItem = apps.get_model('expenses', 'ExpenseItem')
+    rate = Subquery(
+        Expense.objects.filter(id=OuterRef('expense_id')).values(
+            rate=ExpressionWrapper(F('amount_base') / NullIf(F('amount'), 0), output_field=DecimalField())
+        )[:1]
+    )
+    money = DecimalField(max_digits=14, decimal_places=2)
+    ExpenseItem.objects.update(
+        unit_price_base=Round(F('unit_price') * rate, 2, output_field=money),
+        total_base=Round(F('total') * rate, 2, output_field=money),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0019_expense_has_thumbnails'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='expenseitem',
+            name='unit_price_base',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=14, null=True),
+        ),
+        migrations.AddField(
+            model_name='expenseitem',
+            name='total_base',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=14, null=True),
+        ),
+        migrations.RunPython(fill_base_amounts, migrations.RunPython.noop),
+    ]
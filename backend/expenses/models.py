@@ -1,6 +1,26 @@
-from django.db import models
+from django.db import models, transaction
+from django.core.serializers.json import DjangoJSONEncoder
 from django.utils import timezone
 from django.contrib.auth.models import User
+from .storage import get_receipt_storage
+
+
+class Merchant(models.Model):
+    canonical_name = models.CharField(max_length=255)
+    normalized_name = models.CharField(max_length=255, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return self.canonical_name
+
+
+class MerchantAlias(models.Model):
+    merchant = models.ForeignKey(Merchant, on_delete=models.CASCADE, related_name='aliases')
+    alias = models.CharField(max_length=255, unique=True)  # Normalized merchant name as seen on receipts
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"{self.alias} -> {self.merchant.canonical_name}"
 
 
 class Expense(models.Model):
@@ -25,10 +45,13 @@ class Expense(models.Model):
     
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='expenses', null=True, blank=True)
     username = models.CharField(max_length=150, db_index=True, null=True, blank=True)  # For username-based filtering
-    receipt_image = models.ImageField(upload_to='receipts/', null=True, blank=True)
+    receipt_image = models.ImageField(upload_to='receipts/', storage=get_receipt_storage, null=True, blank=True)
+    has_thumbnails = models.BooleanField(default=False)  # set on save, so listings build thumbnail URLs without disk access
     merchant_name = models.CharField(max_length=255, blank=True, null=True)
+    merchant = models.ForeignKey(Merchant, on_delete=models.SET_NULL, related_name='expenses', null=True, blank=True)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     currency = models.CharField(max_length=10, default='USD')
+    amount_base = models.DecimalField(max_digits=14, decimal_places=2, db_index=True, null=True, blank=True)  # amount in settings.BASE_CURRENCY
     category = models.CharField(max_length=50, choices=CATEGORY_CHOICES, default='other')
     payment_method = models.CharField(max_length=50, choices=PAYMENT_METHOD_CHOICES, default='cash')
     date = models.DateTimeField(default=timezone.now)
@@ -41,12 +64,98 @@ class Expense(models.Model):
     
     class Meta:
         ordering = ['-date']
+        indexes = [
+            # Date ordering/ranges and the admin changelist filters
+            models.Index(fields=['date', 'id']),
+            models.Index(fields=['category', 'date']),
+            models.Index(fields=['payment_method', 'date']),
+            models.Index(fields=['currency', 'date']),
+        ]
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Keep the values as loaded so write hooks can undo/adjust for the old row
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+    
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or {'amount', 'currency', 'date'} & set(update_fields):
+            from .fx import to_base
+            self.amount_base = to_base(self.amount, self.currency, self.date)
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | {'amount_base'}
+        if update_fields is None or 'receipt_image' in update_fields:
+            self._record_thumbnails(kwargs)
+        # post_save receivers (budget counters, alerts) run in the same transaction
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+    
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            return super().delete(*args, **kwargs)
+    
+    def _record_thumbnails(self, kwargs):
+        from .storage import has_thumbnails
+        image = self.receipt_image
+        if image and not image._committed:
+            # Store the upload now (pre_save would) to see which thumbnails it got
+            image.save(image.name, image.file, save=False)
+        if image.name != getattr(self, '_loaded_values', {}).get('receipt_image'):
+            self.has_thumbnails = bool(image) and has_thumbnails(image.name)
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = set(kwargs['update_fields']) | {'has_thumbnails'}
     
     def __str__(self):
         date_str = self.date.strftime('%Y-%m-%d') if self.date else 'No date'
         return f"{self.merchant_name or 'Unknown'} - ${self.amount} on {date_str}"
 
 
+class ExpenseItem(models.Model):
+    """One line item of Expense.items, kept in sync by the post_save signal (see items.py)"""
+    expense = models.ForeignKey(Expense, on_delete=models.CASCADE, related_name='line_items')
+    position = models.PositiveSmallIntegerField(default=0)  # Index in Expense.items
+    name = models.CharField(max_length=255)
+    normalized_name = models.CharField(max_length=255, db_index=True)
+    quantity = models.DecimalField(max_digits=10, decimal_places=3, default=1)
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)  # In the expense's currency
+    total = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    # unit_price and total in BASE_CURRENCY, at the expense's amount_base / amount rate
+    unit_price_base = models.DecimalField(max_digits=14, decimal_places=2, null=True, blank=True)
+    total_base = models.DecimalField(max_digits=14, decimal_places=2, null=True, blank=True)
+    
+    class Meta:
+        ordering = ['expense', 'position']
+    
+    def __str__(self):
+        return f"{self.quantity} x {self.name}"
+
+
+class FxRate(models.Model):
+    currency = models.CharField(max_length=10)
+    date = models.DateField()
+    rate = models.DecimalField(max_digits=18, decimal_places=8)  # Units of BASE_CURRENCY per 1 unit of currency
+    
+    class Meta:
+        unique_together = ['currency', 'date']
+    
+    def __str__(self):
+        return f"{self.currency} {self.date}: {self.rate}"
+
+
+class UserInsight(models.Model):
+    """Nightly precomputed spending insights (see expenses/insights.py)"""
+    username = models.CharField(max_length=150, unique=True)
+    computed_for = models.DateField()
+    computed_at = models.DateTimeField()
+    version = models.PositiveBigIntegerField(default=0)  # ExpenseVersion the data was computed from
+    data = models.JSONField()
+    
+    def __str__(self):
+        return f"{self.username or '(no user)'} - {self.computed_for}"
+
+
 class Budget(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='budgets', null=True, blank=True)
     username = models.CharField(max_length=150, db_index=True, null=True, blank=True)  # For username-based filtering
@@ -66,3 +175,171 @@ class Budget(models.Model):
     
     def __str__(self):
         return f"{self.username} - {self.category} - ${self.amount} ({self.period})"
+
+
+class BudgetSpend(models.Model):
+    """Running spend of a budget for one calendar period, maintained on every expense write"""
+    budget = models.ForeignKey(Budget, on_delete=models.CASCADE, related_name='spend_counters')
+    period_start = models.DateField()
+    spent = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        unique_together = ['budget', 'period_start']
+    
+    def __str__(self):
+        return f"{self.budget} - {self.period_start}: ${self.spent}"
+
+
+class BudgetAlert(models.Model):
+    KIND_CHOICES = [
+        ('threshold', '80% of budget reached'),
+        ('exceeded', 'Budget exceeded'),
+    ]
+    
+    budget = models.ForeignKey(Budget, on_delete=models.CASCADE, related_name='alerts')
+    username = models.CharField(max_length=150, db_index=True, null=True, blank=True)
+    category = models.CharField(max_length=50)
+    period_start = models.DateField()
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    spent = models.DecimalField(max_digits=14, decimal_places=2)
+    budget_amount = models.DecimalField(max_digits=10, decimal_places=2)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['id']
+        unique_together = ['budget', 'period_start', 'kind']
+    
+    def __str__(self):
+        return f"{self.budget} - {self.kind} ({self.period_start})"
+
+
+class RequestProfile(models.Model):
+    """Sampled call stacks of one API request (see profiling.py)"""
+    TRIGGER_CHOICES = [
+        ('header', 'Signed request header'),
+        ('sample', 'Random sample'),
+    ]
+    
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=500)
+    view = models.CharField(max_length=200)
+    username = models.CharField(max_length=150, null=True, blank=True)
+    status_code = models.PositiveSmallIntegerField()
+    duration_ms = models.FloatField()
+    sql_queries = models.PositiveIntegerField(default=0)
+    samples = models.PositiveIntegerField(default=0)
+    trigger = models.CharField(max_length=10, choices=TRIGGER_CHOICES)
+    folded_stacks = models.TextField()  # "frame;frame;frame count" lines, as read by flamegraph.pl/speedscope
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"{self.method} {self.path} ({self.duration_ms:.0f} ms)"
+
+
+class IdempotencyKey(models.Model):
+    """Stored outcome of one mutation of a sync batch, replayed on retries (see sync.py)"""
+    username = models.CharField(max_length=150, default='', blank=True)
+    key = models.CharField(max_length=100)
+    op = models.CharField(max_length=10)
+    status_code = models.PositiveSmallIntegerField()
+    response = models.JSONField(encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    
+    class Meta:
+        unique_together = ['username', 'key']
+    
+    def __str__(self):
+        return f"{self.username or '(no user)'} - {self.key} ({self.op} {self.status_code})"
+
+
+class ArchivedExpense(models.Model):
+    """An expense moved out of the live table by archive_expenses (see archive.py); keeps its id"""
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_expenses', null=True, blank=True)
+    username = models.CharField(max_length=150, db_index=True, null=True, blank=True)
+    receipt_image = models.CharField(max_length=100, null=True, blank=True)  # storage name, as on Expense
+    merchant_name = models.CharField(max_length=255, blank=True, null=True)
+    merchant = models.ForeignKey(Merchant, on_delete=models.SET_NULL, related_name='archived_expenses', null=True, blank=True)
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    currency = models.CharField(max_length=10)
+    amount_base = models.DecimalField(max_digits=14, decimal_places=2, null=True, blank=True)
+    category = models.CharField(max_length=50, choices=Expense.CATEGORY_CHOICES)
+    payment_method = models.CharField(max_length=50, choices=Expense.PAYMENT_METHOD_CHOICES)
+    date = models.DateTimeField(db_index=True)
+    description = models.TextField(blank=True, null=True)
+    items = models.JSONField(blank=True, null=True)
+    tax = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    tip = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField()
+    
+    class Meta:
+        ordering = ['-date']
+    
+    def __str__(self):
+        return f"{self.merchant_name or 'Unknown'} - ${self.amount} on {self.date:%Y-%m-%d} (archived)"
+
+
+class ArchiveAggregate(models.Model):
+    """Spend of archived expenses per user, month, category, payment method and merchant"""
+    username = models.CharField(max_length=150, default='', blank=True)
+    period_start = models.DateField()  # first day of the month
+    category = models.CharField(max_length=50)
+    payment_method = models.CharField(max_length=50)
+    merchant = models.ForeignKey(Merchant, on_delete=models.SET_NULL, related_name='+', null=True, blank=True)
+    total = models.DecimalField(max_digits=16, decimal_places=2, default=0)  # in settings.BASE_CURRENCY
+    count = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        unique_together = ['username', 'period_start', 'category', 'payment_method', 'merchant']
+        indexes = [models.Index(fields=['period_start'])]
+    
+    def __str__(self):
+        return f"{self.username or '(no user)'} - {self.period_start} {self.category}: ${self.total} ({self.count})"
+
+
+class ExtractionCall(models.Model):
+    """One model call made for a receipt scan, for tuning the tier policy (see tiering.py)"""
+    scan_id = models.CharField(max_length=32, db_index=True)
+    operation = models.CharField(max_length=30)
+    model = models.CharField(max_length=100)
+    tier = models.PositiveSmallIntegerField(default=0)
+    prompt_tokens = models.PositiveIntegerField(null=True, blank=True)
+    output_tokens = models.PositiveIntegerField(null=True, blank=True)
+    total_tokens = models.PositiveIntegerField(null=True, blank=True)
+    latency_ms = models.FloatField()
+    success = models.BooleanField(default=True)  # the call returned a usable result
+    failed_checks = models.CharField(max_length=200, blank=True, default='')  # comma-separated check names
+    escalated = models.BooleanField(default=False)  # the scan moved on to the next tier after this call
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"{self.operation} on {self.model} ({self.latency_ms:.0f} ms)"
+
+
+class LiveEvent(models.Model):
+    """Outbox of live summary/budget updates, relayed to the /api/live/ streams (see live.py)"""
+    username = models.CharField(max_length=150, null=True, blank=True)  # None: every subscriber
+    kind = models.CharField(max_length=20)  # 'delta' or 'refresh'
+    payload = models.JSONField(encoder=DjangoJSONEncoder, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    
+    def __str__(self):
+        return f"{self.kind} for {self.username or 'everyone'} ({self.created_at:%Y-%m-%d %H:%M:%S})"
+
+
+class ExpenseVersion(models.Model):
+    """Per-user counter bumped by every write to the user's expenses (see versions.py)"""
+    username = models.CharField(max_length=150, unique=True, blank=True)  # '' for expenses without a user
+    version = models.PositiveBigIntegerField(default=0)
+    
+    def __str__(self):
+        return f"{self.username or '(no user)'} v{self.version}"
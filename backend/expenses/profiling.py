@@ -0,0 +1,157 @@
+"""
+Opt-in sampling profiler for API requests.
+
+With PROFILING_ENABLED on, a request to a view using ProfilingMixin is
+profiled when it carries a valid `X-Profile` header (mint one with
+`manage.py profile_token`), or at random with PROFILING_SAMPLE_RATE.
+
+While the view's dispatch() runs, a background thread samples the request
+thread's call stack every PROFILING_INTERVAL_MS. The stacks are stored as
+folded lines ("outer;inner;leaf count") on a RequestProfile with the
+request metadata. That format is what flamegraph.pl, inferno and
+speedscope read; download it from /api/profiles/<id>/folded/ (admin only).
+
+Sampling keeps the overhead to one stack walk per interval, unlike
+cProfile's per-call hooks, so timings stay close to unprofiled requests.
+The sampler needs the GIL, so while the request runs pure Python the
+effective interval is the interpreter's switch interval (5 ms by default).
+"""
+
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core import signing
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+HEADER = 'X-Profile'
+_SALT = 'expenses.profiling'
+
+
+def make_token():
+    """Signed value for the X-Profile header, valid for PROFILING_TOKEN_MAX_AGE"""
+    return signing.TimestampSigner(salt=_SALT).sign('profile')
+
+
+def _valid_token(value):
+    try:
+        signing.TimestampSigner(salt=_SALT).unsign(value, max_age=settings.PROFILING_TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        return False
+    return True
+
+
+def profile_trigger(request):
+    """'header', 'sample' or None"""
+    if not settings.PROFILING_ENABLED:
+        return None
+    token = request.headers.get(HEADER)
+    if token:
+        if _valid_token(token):
+            return 'header'
+        logger.warning("Ignoring invalid %s header on %s", HEADER, request.path)
+    if settings.PROFILING_SAMPLE_RATE and random.random() < settings.PROFILING_SAMPLE_RATE:
+        return 'sample'
+    return None
+
+
+_labels = {}
+
+
+def _frame_label(code):
+    label = _labels.get(code)
+    if label is None:
+        path = code.co_filename.split(os.sep)
+        label = _labels[code] = '%s (%s:%d)' % (
+            getattr(code, 'co_qualname', code.co_name), '/'.join(path[-2:]), code.co_firstlineno
+        )
+    return label
+
+
+class StackSampler:
+    """Collect folded call stacks of one thread from a background thread"""
+
+    def __init__(self, thread_id, root_frame, interval):
+        self.thread_id = thread_id
+        self.root_frame = root_frame
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            # Walk up to the profiled dispatch(); server frames above it are noise
+            while frame is not None and frame is not self.root_frame:
+                stack.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+    def folded(self):
+        return '\n'.join(f'{stack} {count}' for stack, count in self.stacks.most_common())
+
+
+def store_profile(request, view, response, trigger, sampler, duration):
+    from .models import RequestProfile
+
+    current = metrics.current_request()
+    profile = RequestProfile.objects.create(
+        method=request.method,
+        path=request.get_full_path()[:500],
+        view=view,
+        username=request.headers.get('X-Username') or request.GET.get('username'),
+        status_code=response.status_code,
+        duration_ms=duration * 1000,
+        sql_queries=current.sql_count if current else 0,
+        samples=sum(sampler.stacks.values()),
+        trigger=trigger,
+        folded_stacks=sampler.folded(),
+    )
+    # Keep only the newest PROFILING_MAX_PROFILES
+    limit = settings.PROFILING_MAX_PROFILES
+    cutoff = list(RequestProfile.objects.order_by('-id').values_list('id', flat=True)[limit:limit + 1])
+    if cutoff:
+        RequestProfile.objects.filter(id__lte=cutoff[0]).delete()
+    return profile
+
+
+class ProfilingMixin:
+    """Profile the DRF dispatch of a viewset when the request asks for it"""
+
+    def dispatch(self, request, *args, **kwargs):
+        trigger = profile_trigger(request)
+        if trigger is None:
+            return super().dispatch(request, *args, **kwargs)
+
+        start = time.perf_counter()
+        with StackSampler(threading.get_ident(), sys._getframe(), settings.PROFILING_INTERVAL_MS / 1000) as sampler:
+            response = super().dispatch(request, *args, **kwargs)
+        duration = time.perf_counter() - start
+
+        # self.action is only known once dispatch() has run initial()
+        view = f'{type(self).__name__}.{getattr(self, "action", None) or request.method.lower()}'
+        try:
+            profile = store_profile(request, view, response, trigger, sampler, duration)
+            response['X-Profile-Id'] = str(profile.id)
+        except Exception:
+            logger.exception("Could not store request profile for %s", request.path)
+        return response
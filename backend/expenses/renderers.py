@@ -0,0 +1,60 @@
+import datetime
+import decimal
+
+import orjson
+from django.db.models.query import QuerySet
+from django.utils.encoding import force_str
+from django.utils.functional import Promise
+from rest_framework.renderers import BaseRenderer
+
+from .metrics import timed
+
+
+def _default(obj):
+    """Fallback for types orjson does not serialize natively"""
+    if isinstance(obj, decimal.Decimal):
+        # Serializers already coerce model decimals to strings; this covers
+        # the raw aggregates returned by the analytics/summary views.
+        return float(obj)
+    if isinstance(obj, Promise):
+        return force_str(obj)
+    if isinstance(obj, datetime.timedelta):
+        return str(obj.total_seconds())
+    if isinstance(obj, QuerySet):
+        return list(obj)
+    if isinstance(obj, bytes):
+        return obj.decode()
+    if hasattr(obj, 'tolist'):
+        # Numpy arrays and array scalars
+        return obj.tolist()
+    # Anything else is a serializer bug: fail loudly rather than guess a shape
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+class ORJSONRenderer(BaseRenderer):
+    """
+    Drop-in replacement for DRF's JSONRenderer backed by orjson.
+
+    Datetimes, dates, times and UUIDs are serialized natively (UTC datetimes
+    use the same trailing "Z" as DRF), decimals become JSON numbers.
+    """
+    media_type = 'application/json'
+    format = 'json'
+    charset = None
+
+    options = orjson.OPT_UTC_Z | orjson.OPT_SERIALIZE_NUMPY
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        options = self.options
+        # Honour `Accept: application/json; indent=N` like JSONRenderer does
+        # (orjson only supports a two-space indent).
+        if accepted_media_type and 'indent=' in accepted_media_type:
+            options |= orjson.OPT_INDENT_2
+        elif renderer_context and renderer_context.get('indent'):
+            options |= orjson.OPT_INDENT_2
+
+        with timed('render'):
+            return orjson.dumps(data, default=_default, option=options)
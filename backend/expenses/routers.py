@@ -0,0 +1,140 @@
+"""
+Read replica routing for the reporting endpoints.
+
+With REPLICA_DATABASE set, views decorated with @replica_reads (analytics,
+summary, insights, budget status and alerts) run their queries on that
+database alias, so these long aggregate reads do not compete with
+scan_receipt and CRUD writes on the primary. Everything else, and every
+write, stays on the primary.
+
+Replicas lag. After a client's own successful write (any unsafe method),
+ReadYourWritesMiddleware marks it in the cache for READ_YOUR_WRITES_SECONDS
+and its reporting reads stay on the primary during that window. Clients
+are identified by X-Username, or by address without one. With several
+workers the marker needs a shared cache backend (CACHES); the default
+local-memory cache only covers one process.
+
+For local testing, point REPLICA_DB_NAME at a second SQLite file and
+refresh it with `manage.py sync_replica`.
+"""
+
+import contextvars
+import functools
+import os
+import sqlite3
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+_replica_reads = contextvars.ContextVar('expense_replica_reads', default=False)
+
+
+def _client_key(request):
+    username = request.headers.get('X-Username') or request.GET.get('username')
+    client = username or f"addr:{request.META.get('REMOTE_ADDR', '')}"
+    return f'replica-sticky:{client}'
+
+
+def mark_write(request):
+    """Keep this client's reads on the primary for READ_YOUR_WRITES_SECONDS"""
+    if settings.REPLICA_DATABASE and settings.READ_YOUR_WRITES_SECONDS > 0:
+        cache.set(_client_key(request), True, settings.READ_YOUR_WRITES_SECONDS)
+
+
+@contextmanager
+def reporting_reads(request):
+    """Route the block's reads to the replica unless the client wrote recently; yields whether it does"""
+    if not settings.REPLICA_DATABASE or cache.get(_client_key(request)):
+        yield False
+        return
+    token = _replica_reads.set(True)
+    try:
+        yield True
+    finally:
+        _replica_reads.reset(token)
+
+
+def replica_reads(view_method):
+    """Decorator for read-only viewset actions that may be served from the replica"""
+    @functools.wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        with reporting_reads(request) as on_replica:
+            response = view_method(self, request, *args, **kwargs)
+        response['X-Read-Source'] = 'replica' if on_replica else 'primary'
+        return response
+    return wrapper
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if _replica_reads.get():
+            return settings.REPLICA_DATABASE
+        return None
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Rows read from the replica are the primary's rows
+        databases = {DEFAULT_DB_ALIAS, settings.REPLICA_DATABASE}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replica gets its schema from the primary
+        if db == settings.REPLICA_DATABASE:
+            return False
+        return None
+
+
+def _successful_write(request, response):
+    return request.method not in ('GET', 'HEAD', 'OPTIONS') and response.status_code < 400
+
+
+class ReadYourWritesMiddleware:
+    """Mark clients whose write succeeded so their next reads see it"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        response = self.get_response(request)
+        if _successful_write(request, response):
+            mark_write(request)
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        if _successful_write(request, response):
+            await sync_to_async(mark_write)(request)
+        return response
+
+
+def copy_sqlite_replica():
+    """Replace the replica SQLite file with a consistent copy of the primary"""
+    primary, replica = connections[DEFAULT_DB_ALIAS], connections[settings.REPLICA_DATABASE]
+    if primary.vendor != 'sqlite' or replica.vendor != 'sqlite':
+        raise ValueError("Only SQLite databases are copied; use the database's own replication")
+
+    target = str(replica.settings_dict['NAME'])
+    tmp_path = f'{target}.tmp'
+    primary.ensure_connection()
+    destination = sqlite3.connect(tmp_path)
+    try:
+        primary.connection.backup(destination)
+    finally:
+        destination.close()
+    # Open replica connections keep reading the old file until they reconnect
+    os.replace(tmp_path, target)
@@ -0,0 +1,122 @@
+"""
+Full-text search over expenses.
+
+On SQLite the search index is an FTS5 table (expenses_expense_fts) kept in
+sync with expenses_expense by triggers, so every write path (API, admin,
+bulk updates, raw SQL) updates it in the same transaction. On SQLite a
+migration that rebuilds expenses_expense (e.g. adding a NOT NULL column)
+drops the triggers and must recreate them, as 0019 does. Other database
+backends fall back to a case-insensitive LIKE search over the same fields
+(the items as their JSON text, so tokens also match inside prices and
+keys) without ranking.
+"""
+
+import re
+
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from .models import Expense
+
+FTS_TABLE = 'expenses_expense_fts'
+
+# bm25 column weights: username, merchant_name, description, items
+BM25_WEIGHTS = (0.0, 10.0, 2.0, 4.0)
+
+_token_re = re.compile(r'\w+', re.UNICODE)
+
+# Line item names flattened from the `items` JSON array into one text
+# column, for the row aliased {row}. Migration 0004's triggers use a frozen
+# copy; changing this needs a new migration that recreates them.
+ITEMS_TEXT = (
+    "(SELECT group_concat(json_extract(value, '$.name'), ' ') FROM json_each("
+    "CASE WHEN json_valid({row}.items) AND json_type({row}.items) = 'array' THEN {row}.items ELSE '[]' END))"
+)
+
+
+def is_available():
+    return connection.vendor == 'sqlite'
+
+
+def tokenize(query):
+    return _token_re.findall((query or '').lower())
+
+
+def build_match_query(query):
+    """
+    Turn free text into an FTS5 query where every token is a quoted prefix
+    match, e.g. 'star cof' -> '"star"* "cof"*' (implicit AND).
+    """
+    return ' '.join(f'"{token}"*' for token in tokenize(query))
+
+
+def search_expenses(query, username=None, limit=50):
+    """Return Expense instances matching `query`, best match first"""
+    if not tokenize(query):
+        return []
+    if not is_available():
+        return _fallback_search(query, username, limit)
+
+    match = build_match_query(query)
+    params = [*BM25_WEIGHTS]
+    if username and tokenize(username):
+        # Constrain by username inside MATCH so FTS5 intersects the posting
+        # lists instead of ranking every match across all users.
+        match = 'username:"%s" AND (%s)' % (' '.join(tokenize(username)), match)
+    params.append(match)
+
+    sql = (
+        f"SELECT e.*, bm25({FTS_TABLE}, %s, %s, %s, %s) AS rank "
+        f"FROM {FTS_TABLE} JOIN expenses_expense e ON e.id = {FTS_TABLE}.rowid "
+        f"WHERE {FTS_TABLE} MATCH %s"
+    )
+    if username:
+        sql += " AND e.username = %s"
+        params.append(username)
+    sql += " ORDER BY rank LIMIT %s"
+    params.append(limit)
+
+    return list(Expense.objects.raw(sql, params))
+
+
+def filter_queryset(queryset, query):
+    """Restrict an Expense queryset to the rows matching `query` (unranked)"""
+    if not tokenize(query):
+        return queryset
+    if not is_available():
+        for token in tokenize(query):
+            queryset = queryset.filter(_token_filter(token))
+        return queryset
+    return queryset.filter(id__in=RawSQL(
+        f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [build_match_query(query)]
+    ))
+
+
+def _fallback_search(query, username, limit):
+    expenses = Expense.objects.all()
+    if username:
+        expenses = expenses.filter(username=username)
+    for token in tokenize(query):
+        expenses = expenses.filter(_token_filter(token))
+    return list(expenses[:limit])
+
+
+def _token_filter(token):
+    return Q(merchant_name__icontains=token) | Q(description__icontains=token) | Q(items__icontains=token)
+
+
+def rebuild_index():
+    """Repopulate the FTS table from expenses_expense and optimize it"""
+    if not is_available():
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE}")
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE}(rowid, username, merchant_name, description, items) "
+            "SELECT e.id, coalesce(e.username, ''), coalesce(e.merchant_name, ''), "
+            "coalesce(e.description, ''), coalesce(" + ITEMS_TEXT.format(row='e') + ", '') FROM expenses_expense e"
+        )
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')")
+        cursor.execute(f"SELECT count(*) FROM {FTS_TABLE}")
+        return cursor.fetchone()[0]
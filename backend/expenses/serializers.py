@@ -1,23 +1,74 @@
+from django.conf import settings
 from rest_framework import serializers
-from .models import Expense, Budget
+from .metrics import TimedSerializerMixin
+from .models import ArchivedExpense, Expense, Budget, BudgetAlert, ExtractionCall, RequestProfile
+from .storage import receipt_storage, thumbnail_name
+from .uploads import ReceiptFileField
 
 
-class ExpenseSerializer(serializers.ModelSerializer):
+class ExpenseSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    thumbnails = serializers.SerializerMethodField()
+
     class Meta:
         model = Expense
         fields = '__all__'
-        read_only_fields = ['created_at', 'updated_at']
+        read_only_fields = ['merchant', 'has_thumbnails', 'created_at', 'updated_at']
+
+    def get_thumbnails(self, obj):
+        """Map of thumbnail size to URL, or None for legacy images and ones without thumbnails"""
+        # Recorded when the image was saved: no file system access per row
+        if not obj.has_thumbnails or not obj.receipt_image:
+            return None
+        request = self.context.get('request')
+        thumbnails = {}
+        for size in settings.RECEIPT_THUMBNAIL_SIZES:
+            url = receipt_storage.url(thumbnail_name(obj.receipt_image.name, size))
+            thumbnails[str(size)] = request.build_absolute_uri(url) if request else url
+        return thumbnails
+
+
+class ArchivedExpenseSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    receipt_image = serializers.SerializerMethodField()
 
+    class Meta:
+        model = ArchivedExpense
+        fields = '__all__'
+
+    def get_receipt_image(self, obj):
+        if not obj.receipt_image:
+            return None
+        request = self.context.get('request')
+        url = receipt_storage.url(obj.receipt_image)
+        return request.build_absolute_uri(url) if request else url
 
-class BudgetSerializer(serializers.ModelSerializer):
+
+class BudgetSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Budget
         fields = '__all__'
         read_only_fields = ['created_at', 'updated_at']
 
 
+class BudgetAlertSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    class Meta:
+        model = BudgetAlert
+        fields = '__all__'
+
+
+class RequestProfileSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = RequestProfile
+        exclude = ['folded_stacks']
+
+
+class ExtractionCallSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ExtractionCall
+        fields = '__all__'
+
+
 class ReceiptUploadSerializer(serializers.Serializer):
-    receipt_image = serializers.ImageField()
+    receipt_image = serializers.ImageField(_DjangoImageField=ReceiptFileField)
     
     
 class ExpenseAnalyticsSerializer(serializers.Serializer):
@@ -4,6 +4,8 @@ from django.conf import settings
 from datetime import datetime
 import os
 
+from .metrics import external_call
+
 
 class GoogleSheetsLogger:
     def __init__(self):
@@ -75,7 +77,8 @@ class GoogleSheetsLogger:
                 expense.created_at.strftime('%Y-%m-%d %H:%M:%S') if expense.created_at else ''
             ]
             
-            self.worksheet.append_row(row)
+            with external_call('sheets', 'append'):
+                self.worksheet.append_row(row)
             return True
             
         except Exception as e:
@@ -94,7 +97,8 @@ class GoogleSheetsLogger:
         
         try:
             # Find the row with matching ID
-            cell = self.worksheet.find(str(expense.id))
+            with external_call('sheets', 'find'):
+                cell = self.worksheet.find(str(expense.id))
             if cell:
                 row_number = cell.row
                 row = [
@@ -112,8 +116,9 @@ class GoogleSheetsLogger:
                 ]
                 
                 # Update the row
-                for col, value in enumerate(row, start=1):
-                    self.worksheet.update_cell(row_number, col, value)
+                with external_call('sheets', 'update'):
+                    for col, value in enumerate(row, start=1):
+                        self.worksheet.update_cell(row_number, col, value)
                 
                 return True
             
@@ -132,9 +137,11 @@ class GoogleSheetsLogger:
             return False
         
         try:
-            cell = self.worksheet.find(str(expense_id))
+            with external_call('sheets', 'find'):
+                cell = self.worksheet.find(str(expense_id))
             if cell:
-                self.worksheet.delete_rows(cell.row)
+                with external_call('sheets', 'delete'):
+                    self.worksheet.delete_rows(cell.row)
                 return True
             
         except Exception as e:
@@ -0,0 +1,90 @@
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import budgets, items, live, merchants, versions
+from .classifier import registry as classifier_registry
+from .models import Budget, Expense, Merchant, MerchantAlias
+
+
+def _begin_immediate(execute, sql, params, many, context):
+    if sql == 'BEGIN':
+        sql = 'BEGIN IMMEDIATE'
+    return execute(sql, params, many, context)
+
+
+@receiver(connection_created)
+def sqlite_write_transactions(sender, connection, **kwargs):
+    # A deferred SQLite transaction whose snapshot is older than another
+    # connection's commit fails its first write at once ("database is
+    # locked") instead of waiting; BEGIN IMMEDIATE takes the write lock up
+    # front, within the busy timeout
+    if connection.vendor == 'sqlite' and _begin_immediate not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_begin_immediate)
+
+
+def _row_values(instance):
+    return {f.attname: getattr(instance, f.attname) for f in instance._meta.concrete_fields}
+
+
+@receiver(post_save, sender=Expense)
+def expense_saved(sender, instance, created, **kwargs):
+    previous = None if created else getattr(instance, '_loaded_values', None)
+    current = _row_values(instance)
+
+    # Budget counters move inside the write's transaction (Expense.save is atomic)
+    before, after = budgets.expense_contribution(previous), budgets.expense_contribution(current)
+    budgets.apply_expense_change(before, after)
+    live.expense_changed(before, after)
+
+    usernames = {instance.username} | ({previous.get('username')} if previous else set())
+    new_versions = versions.bump(usernames)
+
+    def update_classifier():
+        if previous and previous.get('username') != instance.username:
+            classifier_registry.forget(previous.get('username'), previous,
+                                       version=new_versions[previous.get('username') or ''])
+            classifier_registry.observe(instance, version=new_versions[instance.username or ''])
+        else:
+            classifier_registry.observe(instance, previous=previous, version=new_versions[instance.username or ''])
+
+    transaction.on_commit(update_classifier)
+
+    # Line item rows follow Expense.items, and their base amounts amount_base
+    if (instance.items if created else previous is None or previous.get('items') != instance.items
+            or previous.get('amount_base') != instance.amount_base):
+        items.replace_items([instance])
+
+    # The saved values become the baseline for the next save of this instance
+    instance._loaded_values = current
+
+
+@receiver(post_delete, sender=Expense)
+def expense_deleted(sender, instance, **kwargs):
+    values = getattr(instance, '_loaded_values', None) or _row_values(instance)
+
+    budgets.apply_expense_change(budgets.expense_contribution(values), None)
+    live.expense_changed(budgets.expense_contribution(values), None)
+
+    version = versions.bump([values.get('username')])[values.get('username') or '']
+    transaction.on_commit(lambda: classifier_registry.forget(values.get('username'), values, version=version))
+
+
+@receiver(post_save, sender=Budget)
+def budget_saved(sender, instance, **kwargs):
+    # Amount, category, period or owner may have changed: recount this period
+    budgets.rebuild_counter(instance)
+    live.refresh([instance.username])
+
+
+@receiver(post_delete, sender=Budget)
+def budget_deleted(sender, instance, **kwargs):
+    live.refresh([instance.username])
+
+
+@receiver(post_delete, sender=Merchant)
+@receiver(post_delete, sender=MerchantAlias)
+def merchant_deleted(sender, instance, **kwargs):
+    # Cached names and the trigram index may still point at the deleted row
+    transaction.on_commit(merchants.clear_cache)
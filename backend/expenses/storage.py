@@ -0,0 +1,160 @@
+import hashlib
+import io
+import logging
+import os
+import re
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from PIL import Image, ImageOps
+
+from . import documents
+
+logger = logging.getLogger(__name__)
+
+RECEIPT_DIR = 'receipts'
+THUMBNAIL_DIR = 'receipts/thumbs'
+
+_hashed_name_re = re.compile(r'^receipts/[0-9a-f]{2}/(?P<digest>[0-9a-f]{64})\.[A-Za-z0-9]+$')
+_thumbnail_name_re = re.compile(r'^receipts/thumbs/[0-9a-f]{64}_\d+\.webp$')
+
+# Extensions for the formats Pillow detects; others use the format name
+_FORMAT_EXTENSIONS = {'JPEG': '.jpg', 'TIFF': '.tiff', 'MPO': '.jpg'}
+
+
+class _AlreadyStored(Exception):
+    pass
+
+
+def hash_file(content):
+    """Return the SHA-256 hex digest of a Django File, leaving it rewound"""
+    digest = hashlib.sha256()
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    for chunk in content.chunks():
+        digest.update(chunk)
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    return digest.hexdigest()
+
+
+class ReceiptStorage(FileSystemStorage):
+    """
+    Content-addressed storage for receipt images.
+
+    Files are stored as receipts/<aa>/<sha256>.<ext>, so identical uploads
+    resolve to the same name and are written only once. WebP thumbnails
+    are generated next to them when a new image is first stored.
+    """
+
+    def hashed_name(self, digest, ext):
+        return f"{RECEIPT_DIR}/{digest[:2]}/{digest}{ext}"
+
+    def detected_extension(self, name, content):
+        """Extension of the content's detected format, so the name depends on the bytes alone"""
+        try:
+            if documents.is_pdf(content):
+                return '.pdf'
+            image_format = Image.open(content).format
+            return _FORMAT_EXTENSIONS.get(image_format, f'.{image_format.lower()}')
+        except Exception:
+            return os.path.splitext(name)[1].lower() or '.jpg'
+        finally:
+            content.seek(0)
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+
+        # Callers that already hashed the upload while reading it can pass the
+        # digest along instead of paying for a second pass.
+        digest = getattr(content, 'sha256', None) or hash_file(content)
+        name = self.hashed_name(digest, self.detected_extension(name, content))
+
+        if self.exists(name):
+            logger.info("[receipt_storage] duplicate upload, reusing %s", name)
+            return name
+
+        # Thumbnails first: _save may move a temporary upload into place
+        self.generate_thumbnails(name, content)
+        return self._save(name, content)
+
+    def get_available_name(self, name, max_length=None):
+        # Called by _save when the file appeared since exists(): a concurrent
+        # upload of the same bytes stored it, so there is nothing to rename
+        if is_content_addressed(name) or _thumbnail_name_re.match(name):
+            raise _AlreadyStored(name)
+        return super().get_available_name(name, max_length)
+
+    def _save(self, name, content):
+        try:
+            return super()._save(name, content)
+        except _AlreadyStored:
+            logger.info("[receipt_storage] %s was stored concurrently, reusing it", name)
+            return name
+
+    def generate_thumbnails(self, name, content):
+        """Write one WebP thumbnail per configured size, largest first"""
+        match = _hashed_name_re.match(name)
+        if not match:
+            return []
+
+        try:
+            content.seek(0)
+            if documents.is_pdf(content):
+                # PDF receipts get thumbnails of their first page
+                image = documents.pdf_first_page(content, max(settings.RECEIPT_THUMBNAIL_SIZES))
+            else:
+                image = Image.open(content)
+                image.draft('RGB', (max(settings.RECEIPT_THUMBNAIL_SIZES),) * 2)
+                image = ImageOps.exif_transpose(image)
+            if image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGB')
+        except Exception as e:
+            logger.warning("[receipt_storage] cannot create thumbnails for %s: %s", name, e)
+            return []
+        finally:
+            content.seek(0)
+
+        written = []
+        # Downscale from the previous (larger) thumbnail rather than the
+        # full-size upload each time.
+        for size in sorted(settings.RECEIPT_THUMBNAIL_SIZES, reverse=True):
+            image.thumbnail((size, size), Image.LANCZOS)
+            buffer = io.BytesIO()
+            image.save(buffer, format='WEBP', quality=settings.RECEIPT_THUMBNAIL_QUALITY, method=4)
+            thumb_name = thumbnail_name(name, size)
+            if not self.exists(thumb_name):
+                self._save(thumb_name, ContentFile(buffer.getvalue()))
+            written.append(thumb_name)
+        return written
+
+
+def is_content_addressed(name):
+    return bool(_hashed_name_re.match(name or ''))
+
+
+def thumbnail_name(name, size):
+    """Storage name of the `size` thumbnail for a content-addressed receipt"""
+    match = _hashed_name_re.match(name or '')
+    if not match:
+        return None
+    return f"{THUMBNAIL_DIR}/{match.group('digest')}_{size}.webp"
+
+
+def has_thumbnails(name):
+    """Whether every configured thumbnail of a stored receipt exists"""
+    if not is_content_addressed(name):
+        return False
+    return all(receipt_storage.exists(thumbnail_name(name, size)) for size in settings.RECEIPT_THUMBNAIL_SIZES)
+
+
+def get_receipt_storage():
+    return receipt_storage
+
+
+receipt_storage = ReceiptStorage()
@@ -0,0 +1,155 @@
+"""
+Batched offline mutations with idempotency keys.
+
+The app queues creates, updates and deletes while offline and flushes them
+with one POST /api/sync/batch/:
+
+    {"mutations": [
+        {"key": "c1f0...", "op": "create", "data": {...}},
+        {"key": "9b2e...", "op": "update", "id": 42, "data": {"category": "food"}},
+        {"key": "77aa...", "op": "update", "id": "c1f0...", "data": {...}},
+        {"key": "e310...", "op": "delete", "id": 17}
+    ]}
+
+Mutations are applied in order inside one transaction. Each one's outcome
+(status code and body) is stored under its client-generated key, scoped to
+the username, so a batch retried after a lost response replays the stored
+results instead of creating duplicates. An update or delete may name the
+key of an earlier create as its `id`, for rows created offline; numeric ids
+(42 or "42") are expense ids.
+
+With X-Username, every mutation is scoped to that user: creates are saved
+under it and a body `username` naming someone else is rejected.
+
+A mutation rejected by validation or pointing at a missing expense gets its
+4xx result without affecting the others. Only successful results are
+stored, so a corrected retry under the same key is applied rather than
+replaying the error. Keys are kept at least IDEMPOTENCY_KEY_TTL_HOURS;
+`manage.py purge_idempotency_keys` deletes older ones.
+"""
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+
+from .merchants import resolve_merchant
+from .models import Expense, IdempotencyKey
+from .serializers import ExpenseSerializer
+
+OPS = ('create', 'update', 'delete')
+
+
+class SyncError(Exception):
+    """Malformed batch; nothing is applied and the message is returned to the client"""
+
+
+class SyncConflict(Exception):
+    """Another request stored one of the batch's keys first; the client should retry"""
+
+
+def validate_batch(mutations):
+    if not isinstance(mutations, list) or not mutations:
+        raise SyncError('"mutations" must be a non-empty list')
+    if len(mutations) > settings.SYNC_BATCH_MAX_MUTATIONS:
+        raise SyncError(f'At most {settings.SYNC_BATCH_MAX_MUTATIONS} mutations per batch')
+
+    seen = set()
+    for index, mutation in enumerate(mutations):
+        if not isinstance(mutation, dict):
+            raise SyncError(f'Mutation {index} must be an object')
+        key = mutation.get('key')
+        if not isinstance(key, str) or not 0 < len(key) <= 100:
+            raise SyncError(f'Mutation {index}: "key" must be a string of 1-100 characters')
+        if key in seen:
+            raise SyncError(f'Mutation {index}: duplicate key {key!r}')
+        seen.add(key)
+        if mutation.get('op') not in OPS:
+            raise SyncError(f'Mutation {index}: "op" must be one of {", ".join(OPS)}')
+        if mutation['op'] != 'create' and not isinstance(mutation.get('id'), (int, str)):
+            raise SyncError(f'Mutation {index}: "id" is required for {mutation["op"]}')
+        if mutation['op'] != 'delete' and not isinstance(mutation.get('data'), dict):
+            raise SyncError(f'Mutation {index}: "data" must be an object')
+
+
+def _resolve_id(value, username, created):
+    """Expense id of an `id` field: an integer, or the key of an earlier create"""
+    if isinstance(value, int):
+        return value
+    if value.isdigit():
+        return int(value)
+    if value in created:
+        return created[value]
+    record = IdempotencyKey.objects.filter(username=username, key=value, op='create', status_code=201).first()
+    return record.response.get('id') if record else None
+
+
+def _apply(mutation, username, created, context):
+    """Apply one mutation; returns (status code, body)"""
+    op = mutation['op']
+    data = mutation.get('data') or {}
+    if username and data.get('username') not in (None, '', username):
+        return 400, {'username': ['Does not match the X-Username header.']}
+
+    if op == 'create':
+        serializer = ExpenseSerializer(data=data, context=context)
+        if not serializer.is_valid():
+            return 400, serializer.errors
+        owner = {'username': username} if username else {}
+        serializer.save(merchant_id=resolve_merchant(serializer.validated_data.get('merchant_name')), **owner)
+        created[mutation['key']] = serializer.instance.id
+        return 201, serializer.data
+
+    queryset = Expense.objects.all()
+    if username:
+        queryset = queryset.filter(username=username)
+    expense_id = _resolve_id(mutation['id'], username, created)
+    expense = queryset.filter(id=expense_id).first() if expense_id else None
+    if expense is None:
+        return 404, {'detail': 'Not found.'}
+
+    if op == 'delete':
+        expense.delete()
+        return 204, {'id': expense_id}
+
+    serializer = ExpenseSerializer(expense, data=data, partial=True, context=context)
+    if not serializer.is_valid():
+        return 400, serializer.errors
+    if 'merchant_name' in serializer.validated_data:
+        serializer.save(merchant_id=resolve_merchant(serializer.validated_data['merchant_name']))
+    else:
+        serializer.save()
+    return 200, serializer.data
+
+
+def _result(key, op, status_code, body, replayed):
+    result = {'key': key, 'op': op, 'status': status_code, 'replayed': replayed}
+    result['errors' if status_code >= 400 else 'data'] = body
+    return result
+
+
+def apply_batch(mutations, username=None, context=None):
+    """Apply a validated batch in one transaction; returns one result per mutation"""
+    username = username or ''
+    keys = [mutation['key'] for mutation in mutations]
+    results, records, created = [], [], {}
+
+    with transaction.atomic():
+        stored = {record.key: record for record in IdempotencyKey.objects.filter(username=username, key__in=keys)}
+        for mutation in mutations:
+            record = stored.get(mutation['key'])
+            if record is not None:
+                results.append(_result(record.key, record.op, record.status_code, record.response, True))
+                continue
+            status_code, body = _apply(mutation, username, created, context or {})
+            if status_code < 400:
+                records.append(IdempotencyKey(
+                    username=username, key=mutation['key'], op=mutation['op'], status_code=status_code, response=body,
+                ))
+            results.append(_result(mutation['key'], mutation['op'], status_code, body, False))
+
+        # A concurrent request with an overlapping batch loses here and is
+        # rolled back whole; its retry replays the winner's results.
+        try:
+            IdempotencyKey.objects.bulk_create(records)
+        except IntegrityError as e:
+            raise SyncConflict() from e
+    return results
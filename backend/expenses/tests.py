@@ -1,3 +1,1212 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import hashlib
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest import mock, skipIf
 
-# Create your tests here.
+import numpy as np
+import orjson
+from asgiref.sync import iscoroutinefunction
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.db.models import Count, Sum
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+
+from . import (
+    admin, archive, budgets, bulk, classifier, documents, fx, gemini_service, insights, items, live, merchants,
+    metrics, middleware, profiling, routers, search, signals, storage, sync, tiering, versions, views,
+)
+from .gemini_service import merge_pages
+from .jsonstream import IncrementalObjectParser
+from .models import (
+    ArchiveAggregate, Budget, BudgetAlert, BudgetSpend, Expense, ExpenseItem, ExtractionCall, IdempotencyKey,
+    LiveEvent, Merchant, MerchantAlias, RequestProfile, UserInsight,
+)
+from .renderers import ORJSONRenderer
+from .serializers import ExpenseSerializer
+from .storage import receipt_storage
+
+
+def make_expense(amount='10.00', category='food', when=None, **fields):
+    return Expense.objects.create(
+        amount=Decimal(amount), category=category, date=when or timezone.now(), **fields
+    )
+
+
+def image_upload(name='receipt.png', color='white', size=(600, 800), image_format='PNG'):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, image_format)
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type=f'image/{image_format.lower()}')
+
+
+class MediaTestCase(TestCase):
+    """Stores receipts in a temporary MEDIA_ROOT"""
+
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
+
+@override_settings(CLASSIFIER_SNAPSHOT_PATH='')
+class RenderingTests(TestCase):
+    def test_decimals_and_datetimes(self):
+        when = timezone.make_aware(datetime(2026, 1, 2, 3, 4, 5))
+        body = ORJSONRenderer().render({'total': Decimal('12.50'), 'at': when})
+        self.assertEqual(orjson.loads(body), {'total': 12.5, 'at': '2026-01-02T03:04:05Z'})
+
+    def test_unknown_types_are_rejected(self):
+        with self.assertRaises(TypeError):
+            ORJSONRenderer().render({'value': object()})
+        with self.assertRaises(TypeError):
+            ORJSONRenderer().render({'value': {1, 2}})
+
+    def test_response_encoding_is_negotiated(self):
+        for index in range(30):
+            make_expense(description=f'expense number {index}')
+
+        plain = self.client.get('/api/expenses/')
+        self.assertFalse(plain.has_header('Content-Encoding'))
+
+        zipped = self.client.get('/api/expenses/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(zipped['Content-Encoding'], 'gzip')
+        self.assertEqual(orjson.loads(gzip.decompress(zipped.content)), orjson.loads(plain.content))
+
+        preferred = self.client.get('/api/expenses/', HTTP_ACCEPT_ENCODING='gzip;q=0.5, br')
+        expected = 'br' if middleware.brotli is not None else 'gzip'
+        self.assertEqual(preferred['Content-Encoding'], expected)
+        self.assertIn('Accept-Encoding', preferred['Vary'])
+
+    def test_small_responses_are_not_compressed(self):
+        response = self.client.get('/api/expenses/summary/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_json_bodies_are_parsed(self):
+        response = self.client.post('/api/expenses/', data=orjson.dumps({
+            'amount': '4.20', 'category': 'food', 'date': '2026-01-01T00:00:00Z',
+        }), content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Expense.objects.get().amount, Decimal('4.20'))
+
+        broken = self.client.post('/api/expenses/', data=b'{"amount":', content_type='application/json')
+        self.assertEqual(broken.status_code, 400)
+
+
+@override_settings(CLASSIFIER_SNAPSHOT_PATH='', RECEIPT_THUMBNAIL_SIZES=[128, 256])
+class ReceiptStorageTests(MediaTestCase):
+    def test_identical_uploads_share_one_file(self):
+        first = make_expense(receipt_image=image_upload('a.png'))
+        second = make_expense(receipt_image=image_upload('b.png'))
+        self.assertEqual(first.receipt_image.name, second.receipt_image.name)
+        self.assertRegex(first.receipt_image.name, r'^receipts/[0-9a-f]{2}/[0-9a-f]{64}\.png$')
+
+        other = make_expense(receipt_image=image_upload('a.png', color='black'))
+        self.assertNotEqual(other.receipt_image.name, first.receipt_image.name)
+
+    def test_name_follows_the_detected_format(self):
+        expense = make_expense(receipt_image=image_upload('scan.png', image_format='JPEG'))
+        self.assertTrue(expense.receipt_image.name.endswith('.jpg'))
+
+    def test_thumbnails_are_recorded_and_listed_without_disk_access(self):
+        expense = make_expense(receipt_image=image_upload())
+        self.assertTrue(expense.has_thumbnails)
+        self.assertTrue(Expense.objects.get(id=expense.id).has_thumbnails)
+
+        with mock.patch.object(type(receipt_storage), 'exists', side_effect=AssertionError('disk access')):
+            thumbnails = ExpenseSerializer(Expense.objects.get(id=expense.id)).data['thumbnails']
+        self.assertEqual(sorted(thumbnails), ['128', '256'])
+        for size, url in thumbnails.items():
+            with Image.open(receipt_storage.path(url[len(receipt_storage.base_url):])) as thumbnail:
+                self.assertEqual(thumbnail.format, 'WEBP')
+                self.assertLessEqual(max(thumbnail.size), int(size))
+
+    def test_undecodable_receipts_have_no_thumbnails(self):
+        expense = make_expense(receipt_image=SimpleUploadedFile('r.png', b'not an image'))
+        self.assertFalse(expense.has_thumbnails)
+        self.assertIsNone(ExpenseSerializer(expense).data['thumbnails'])
+
+
+@override_settings(CLASSIFIER_SNAPSHOT_PATH='')
+class SearchTests(TestCase):
+    def ids(self, query, **kwargs):
+        return [expense.id for expense in search.search_expenses(query, **kwargs)]
+
+    def test_index_follows_inserts_updates_and_deletes(self):
+        coffee = make_expense(merchant_name='Starbucks Coffee', username='alice')
+        groceries = make_expense(merchant_name='Corner Shop', description='weekly groceries', username='alice',
+                                 items=[{'name': 'Oat Milk', 'total': 2.5}])
+        self.assertEqual(self.ids('star cof'), [coffee.id])
+        self.assertEqual(self.ids('oat'), [groceries.id])
+        self.assertEqual(self.ids('grocer'), [groceries.id])
+
+        coffee.merchant_name = 'Blue Bottle'
+        coffee.save()
+        self.assertEqual(self.ids('starbucks'), [])
+        self.assertEqual(self.ids('bottle'), [coffee.id])
+
+        groceries.delete()
+        self.assertEqual(self.ids('oat'), [])
+
+    def test_merchant_matches_rank_first_and_users_are_separate(self):
+        described = make_expense(merchant_name='Shell', description='pizza night', username='alice')
+        merchant = make_expense(merchant_name='Pizza Hut', username='alice')
+        make_expense(merchant_name='Pizza Express', username='bob')
+        self.assertEqual(self.ids('pizza', username='alice'), [merchant.id, described.id])
+
+    def test_filter_queryset_and_rebuild(self):
+        match = make_expense(merchant_name='Tesco', items=[{'name': 'bread'}])
+        make_expense(merchant_name='Aldi')
+        self.assertEqual(search.rebuild_index(), 2)
+        self.assertEqual(list(search.filter_queryset(Expense.objects.all(), 'bread').values_list('id', flat=True)),
+                         [match.id])
+
+
+class MerchantTests(TestCase):
+    def setUp(self):
+        merchants.clear_cache()
+        self.addCleanup(merchants.clear_cache)
+
+    def test_normalization(self):
+        self.assertEqual(merchants.normalize_merchant_name('STARBUCKS #1234'), 'starbucks')
+        self.assertEqual(merchants.normalize_merchant_name("McDonald's Inc."), 'mcdonalds')
+        self.assertEqual(merchants.normalize_merchant_name('Café Rouge No. 12'), 'cafe rouge')
+        # Bare numbers are part of the name
+        self.assertEqual(merchants.normalize_merchant_name('7-Eleven'), '7 eleven')
+        self.assertEqual(merchants.normalize_merchant_name('99 Ranch Market'), '99 ranch market')
+
+    def test_spellings_resolve_to_one_merchant(self):
+        walmart = merchants.resolve_merchant('WALMART SUPERCENTER #5521')
+        self.assertEqual(merchants.resolve_merchant('Walmart Supercenter'), walmart)
+        # Close enough by trigram similarity
+        self.assertEqual(merchants.resolve_merchant('Walmart Supercentre'), walmart)
+        self.assertEqual(Merchant.objects.get(id=walmart).canonical_name, 'Walmart Supercenter')
+        self.assertTrue(MerchantAlias.objects.filter(alias='walmart supercentre', merchant_id=walmart).exists())
+
+        self.assertNotEqual(merchants.resolve_merchant('7-Eleven'), merchants.resolve_merchant('99 Ranch Market'))
+        self.assertIsNone(merchants.resolve_merchant('  #12 '))
+
+    def test_deleted_merchants_leave_the_cache(self):
+        first = merchants.resolve_merchant('Corner Bakery')
+        with self.captureOnCommitCallbacks(execute=True):
+            Merchant.objects.filter(id=first).delete()
+        second = merchants.resolve_merchant('Corner Bakery')
+        self.assertNotEqual(second, first)
+        self.assertTrue(Merchant.objects.filter(id=second).exists())
+
+
+@override_settings(CLASSIFIER_SNAPSHOT_PATH='', CLASSIFIER_VERSION_TTL=60)
+class ClassifierTests(TestCase):
+    def setUp(self):
+        for index in range(6):
+            make_expense(merchant_name='Starbucks', category='food', payment_method='credit_card', username='alice',
+                         items=[{'name': 'latte'}])
+            make_expense(merchant_name='Shell', category='transport', payment_method='cash', username='alice',
+                         items=[{'name': 'diesel'}])
+
+    def test_predicts_from_the_users_history(self):
+        prediction = classifier.ClassifierRegistry().get('alice').predict('STARBUCKS #12', [{'name': 'latte'}])
+        self.assertEqual(prediction['category']['value'], 'food')
+        self.assertEqual(prediction['payment_method']['value'], 'credit_card')
+        self.assertGreater(prediction['category']['confidence'], 0.9)
+        self.assertEqual(prediction['samples'], 12)
+
+    def test_version_is_read_once_per_ttl(self):
+        registry = classifier.ClassifierRegistry()
+        registry.get('alice')
+        registry.get('alice')
+        with self.assertNumQueries(0):
+            registry.get('alice')
+
+        registry.expire(['alice'])
+        with self.assertNumQueries(1):
+            registry.get('alice')
+
+    def test_stale_models_are_retrained(self):
+        registry = classifier.ClassifierRegistry()
+        model = registry.get('alice')
+        # A write this process did not apply incrementally (another worker, bulk SQL)
+        versions.bump(['alice'])
+        registry.expire(['alice'])
+        with mock.patch.object(registry, '_train_in_background') as retrain:
+            self.assertIs(registry.get('alice'), model)
+        retrain.assert_called_once_with('alice')
+
+        retrained = classifier.train('alice')
+        self.assertEqual(retrained.version, versions.current('alice'))
+
+    def test_committed_writes_are_applied_incrementally(self):
+        registry = classifier.ClassifierRegistry()
+        model = registry.get('alice')
+        with mock.patch.object(signals, 'classifier_registry', registry), self.captureOnCommitCallbacks(execute=True):
+            make_expense(merchant_name='Lidl', category='shopping', username='alice')
+        self.assertEqual(model.samples, 13)
+        self.assertEqual(model.version, versions.current('alice'))
+
+    def test_snapshot_round_trip(self):
+        path = os.path.join(tempfile.mkdtemp(), 'classifier.pickle')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path), ignore_errors=True)
+        with override_settings(CLASSIFIER_SNAPSHOT_PATH=path):
+            registry = classifier.ClassifierRegistry()
+            registry.get('alice')
+            registry.snapshot()
+
+            restored = classifier.ClassifierRegistry()
+            with mock.patch.object(classifier, 'train', side_effect=AssertionError('retrained')):
+                model = restored.get('alice')
+        self.assertEqual(model.samples, 12)
+        self.assertEqual(model.predict('Shell')['category']['value'], 'transport')
+
+
+@override_settings(CLASSIFIER_SNAPSHOT_PATH='', BASE_CURRENCY='USD')
+class FxConversionTests(TestCase):
+    def setUp(self):
+        fx.load_rates([(date(2026, 1, 1), 'eur', '1.10'), (date(2026, 3, 1), 'EUR', '1.20')])
+
+    def test_amount_base_uses_the_rate_of_the_date(self):
+        march = make_expense('10.00', currency='EUR', when=timezone.make_aware(datetime(2026, 3, 15)))
+        february = make_expense('10.00', currency='eur', when=timezone.make_aware(datetime(2026, 2, 15)))
+        self.assertEqual(march.amount_base, Decimal('12.00'))
+        self.assertEqual(february.amount_base, Decimal('11.00'))
+
+    def test_expenses_before_the_first_rate_use_the_earliest(self):
+        expense = make_expense('10.00', currency='EUR', when=timezone.make_aware(datetime(2025, 6, 1)))
+        self.assertEqual(expense.amount_base, Decimal('11.00'))
+
+    def test_currencies_without_rates_are_left_unconverted(self):
+        make_expense('10.00', currency='USD')
+        make_expense('10.00', currency='gbp')
+        self.assertIsNone(fx.to_base(Decimal('10.00'), 'GBP', date(2026, 1, 1)))
+        self.assertEqual(Expense.objects.aggregate(total=Sum('amount_base'))['total'], Decimal('10.00'))
+        self.assertEqual(fx.unconverted(Expense.objects.all()), {'count': 1, 'currencies': ['GBP']})
+
+    def test_new_rates_recompute_stored_amounts(self):
+        expense = make_expense('10.00', currency='EUR', when=timezone.make_aware(datetime(2026, 3, 15)))
+        fx.load_rates([(date(2026, 3, 10), 'EUR', '1.50')])
+        expense.refresh_from_db()
+        self.assertEqual(expense.amount_base, Decimal('15.00'))
+
+    def test_rate_corrections_move_budgets_and_caches(self):
+        budget = Budget.objects.create(username='alice', category='food', amount=Decimal('100.00'), period='monthly')
+        shared = Budget.objects.create(category='food', amount=Decimal('500.00'), period='yearly')
+        make_expense('100.00', currency='EUR', username='alice')
+        self.assertEqual(budgets.status([budget])[0]['spent'], Decimal('120.00'))
+        self.assertTrue(budgets.status([budget])[0]['is_exceeded'])
+        UserInsight.objects.create(username='alice', computed_for=timezone.localdate(), computed_at=timezone.now(),
+                                   data={})
+        version = versions.current('alice')
+
+        fx.load_rates([(timezone.localdate(), 'EUR', '0.90')])
+        alice, everyone = budgets.status([budget, shared])
+        self.assertEqual(alice['spent'], Decimal('90.00'))
+        self.assertFalse(alice['is_exceeded'])
+        self.assertEqual(everyone['spent'], Decimal('90.00'))
+        self.assertEqual(alice['spent'], budgets.period_spend(budget, alice['period_start']))
+        self.assertNotEqual(versions.current('alice'), version)
+        self.assertFalse(UserInsight.objects.filter(username='alice').exists())
+
+    def test_rate_corrections_reach_archived_totals(self):
+        make_expense('10.00', currency='EUR', username='alice', when=timezone.make_aware(datetime(2025, 6, 1)))
+        archive.archive_before(date(2025, 7, 1))
+        self.assertEqual(ArchiveAggregate.objects.get().total, Decimal('11.00'))
+
+        # A new first rate applies to everything before it
+        fx.load_rates([(date(2025, 1, 1), 'EUR', '2.00')])
+        self.assertEqual(ArchiveAggregate.objects.get().total, Decimal('20.00'))
+        self.assertEqual(archive.archived_totals(), (Decimal('20.00'), 1))
+
+
+@override_settings(CLASSIFIER_SNAPSHOT_PATH='', INSIGHTS_WINDOW_DAYS=30)
+class InsightsTests(TestCase):
+    def test_statistics_match_the_reference_implementations(self):
+        rng = np.random.default_rng(7)
+        matrix = rng.gamma(2, 10, size=(5, 40)) * (rng.random((5, 40)) > 0.4)
+        matrix[4] = 0
+        today = date(2026, 10, 19)
+        stats = insights.compute_statistics(matrix, today - timedelta(days=39), today)
+
+        for row in range(4):
+            spend_days = matrix[row][matrix[row] > 0]
+            self.assertAlmostEqual(stats['median_daily_spend'][row], np.median(spend_days))
+            self.assertAlmostEqual(stats['p90_daily_spend'][row], np.percentile(spend_days, 90))
+            self.assertAlmostEqual(stats['rolling_7_avg'][row], matrix[row, -7:].mean())
+            self.assertAlmostEqual(stats['month_to_date'][row], matrix[row, -19:].sum())
+            self.assertAlmostEqual(stats['month_end_forecast'][row],
+                                   matrix[row, -19:].sum() + matrix[row, -30:].mean() * 12)
+        self.assertEqual(stats['median_daily_spend'][4], 0)
+        self.assertEqual(stats['volatility'][4], 0)
+
+    def test_daily_matrix_groups_by_user_and_day(self):
+        today = timezone.localdate()
+        noon = timezone.make_aware(datetime.combine(today, datetime.min.time())) + timedelta(hours=12)
+        make_expense('5.00', username='alice', when=noon)
+        make_expense('7.50', username='alice', when=noon)
+        make_expense('3.00', username='bob', when=noon - timedelta(days=2))
+        make_expense('4.00', when=noon)
+        usernames, start, matrix = insights.daily_matrix(today, 3)
+        self.assertEqual(usernames, ['', 'alice', 'bob'])
+        self.assertEqual(start, today - timedelta(days=2))
+        self.assertEqual(matrix.tolist(), [[0, 0, 4], [0, 0, 12.5], [3, 0, 0]])
+
+    def test_stored_insights_are_served_until_the_next_write(self):
+        make_expense('12.00', username='alice')
+        self.assertEqual(insights.compute_all(), 1)
+        with mock.patch.object(insights, 'user_insights', side_effect=AssertionError('computed live')):
+            cached = self.client.get('/api/expenses/insights/', HTTP_X_USERNAME='alice').json()
+        self.assertEqual(cached['total'], 12.0)
+        self.assertEqual(cached['days'], 30)
+
+        make_expense('8.00', username='alice')
+        self.assertIsNone(insights.cached_insights('alice'))
+        live = self.client.get('/api/expenses/insights/', HTTP_X_USERNAME='alice').json()
+        self.assertEqual(live['total'], 20.0)
+
+
+@override_settings(CLASSIFIER_SNAPSHOT_PATH='')
+class BudgetCounterTests(TestCase):
+    def setUp(self):
+        self.budget = Budget.objects.create(username='alice', category='food', amount=Decimal('100.00'))
+        self.today = timezone.localdate()
+        self.next_month = budgets.period_end('monthly', self.today.replace(day=1))
+
+    def at_noon(self, day):
+        return timezone.make_aware(datetime.combine(day, datetime.min.time())) + timedelta(hours=12)
+
+    def test_crossing_thresholds_records_one_alert_each(self):
+        make_expense('50.00', username='alice')
+        self.assertFalse(BudgetAlert.objects.exists())
+        make_expense('35.00', username='alice')
+        make_expense('20.00', username='alice')
+        make_expense('5.00', username='alice')
+        alerts = {alert.kind: alert.spent for alert in BudgetAlert.objects.filter(budget=self.budget)}
+        self.assertEqual(alerts, {'threshold': Decimal('85.00'), 'exceeded': Decimal('105.00')})
+
+        row = budgets.status([self.budget])[0]
+        self.assertEqual(row['spent'], Decimal('110.00'))
+        self.assertTrue(row['is_exceeded'])
+        self.assertTrue(row['tracked'])
+
+    def test_future_expenses_are_counted_when_their_period_begins(self):
+        make_expense('30.00', username='alice', when=self.at_noon(self.next_month + timedelta(days=3)))
+        self.assertEqual(budgets.status([self.budget])[0]['spent'], Decimal('0.00'))
+
+        with mock.patch.object(timezone, 'localdate', return_value=self.next_month):
+            make_expense('5.00', username='alice', when=self.at_noon(self.next_month))
+            row = budgets.status([self.budget])[0]
+        self.assertEqual((row['period_start'], row['spent'], row['tracked']), (self.next_month, Decimal('35.00'), True))
+
+    def test_closed_periods_are_not_counted(self):
+        make_expense('30.00', username='alice', when=self.at_noon(self.today.replace(day=1) - timedelta(days=1)))
+        self.assertFalse(BudgetSpend.objects.exclude(spent=0).exists())
+
+    def test_one_update_for_every_matching_budget(self):
+        shared = Budget.objects.create(category='food', amount=Decimal('500.00'), period='weekly')
+        make_expense('10.00', username='alice')
+        with self.assertNumQueries(3):
+            budgets.apply_delta('alice', 'food', timezone.now(), Decimal('2.50'))
+        spent = dict(BudgetSpend.objects.values_list('budget_id', 'spent'))
+        self.assertEqual(spent, {self.budget.id: Decimal('12.50'), shared.id: Decimal('12.50')})
+
+    def test_rebuild_covers_future_periods(self):
+        make_expense('10.00', username='alice')
+        make_expense('30.00', username='alice', when=self.at_noon(self.next_month))
+        BudgetSpend.objects.all().delete()
+        self.assertEqual(budgets.rebuild_counter(self.budget), Decimal('10.00'))
+        self.assertEqual(dict(BudgetSpend.objects.values_list('period_start', 'spent')),
+                         {self.today.replace(day=1): Decimal('10.00'), self.next_month: Decimal('30.00')})
+
+
+@override_settings(CLASSIFIER_SNAPSHOT_PATH='')
+class AnalyticsTests(TestCase):
+    def setUp(self):
+        merchants.clear_cache()
+        self.addCleanup(merchants.clear_cache)
+
+    def test_breakdowns_come_from_grouped_queries(self):
+        now = timezone.now()
+        tesco = merchants.resolve_merchant('Tesco')
+        make_expense('10.00', category='food', payment_method='cash', merchant_id=tesco)
+        make_expense('15.00', category='food', payment_method='credit_card', merchant_id=tesco)
+        make_expense('7.50', category='transport', payment_method='cash', when=now - timedelta(days=40))
+        make_expense('99.00', category='shopping', when=now - timedelta(days=400))
+
+        with self.assertNumQueries(8):
+            data = self.client.get('/api/expenses/analytics/?period=year').json()
+        self.assertEqual(data['total_spent'], 32.5)
+        self.assertEqual(data['expense_count'], 3)
+        self.assertEqual(data['category_breakdown']['food'], {'label': 'Food & Dining', 'amount': 25.0, 'count': 2})
+        self.assertEqual(data['category_breakdown']['shopping']['count'], 0)
+        self.assertEqual(data['payment_breakdown']['cash']['amount'], 17.5)
+        self.assertEqual([month['count'] for month in data['monthly_trend']], [0] * 9 + [1, 2, 0])
+        self.assertEqual(data['top_merchants'], [{'id': tesco, 'name': 'Tesco', 'amount': 25.0, 'count': 2}])
+
+
+@override_settings(CLASSIFIER_SNAPSHOT_PATH='', METRICS_ENABLED=True, METRICS_DIR='', METRICS_TOKEN='secret')
+class MetricsTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(metrics, 'registry', metrics.Registry())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def scrape(self, **headers):
+        return self.client.get('/metrics', **headers)
+
+    def test_requests_are_recorded_and_exported(self):
+        make_expense()
+        self.client.get('/api/expenses/')
+        self.assertEqual(self.scrape().status_code, 403)
+        self.assertEqual(self.scrape(HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+
+        body = self.scrape(HTTP_AUTHORIZATION='Bearer secret').content.decode()
+        self.assertIn('expense_tracker_request_duration_seconds_count{view="expense-list",method="GET",status="200"} 1',
+                      body)
+        sql = [line for line in body.splitlines()
+               if line.startswith('expense_tracker_request_sql_queries_sum{view="expense-list"')]
+        self.assertEqual(len(sql), 1)
+        self.assertGreater(float(sql[0].split()[-1]), 0)
+
+    def test_async_requests_are_not_adapted(self):
+        async def view(request):
+            return HttpResponse('ok')
+
+        middleware = metrics.MetricsMiddleware(view)
+        self.assertTrue(iscoroutinefunction(middleware))
+        response = asyncio.run(middleware(RequestFactory().get('/anything')))
+        self.assertEqual(response.content, b'ok')
+        self.assertEqual(metrics.registry.dump()[0]['count'], 1)
+
+    def test_files_of_exited_workers_are_retired(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        exited = subprocess.Popen(['true'])
+        exited.wait()
+        series = {'name': 'expense_tracker_request_sql_queries', 'labels': ['v', 'GET'],
+                  'buckets': [1] + [0] * 10, 'sum': 1.0, 'count': 1}
+        with open(os.path.join(directory, f'{exited.pid}.json'), 'w') as f:
+            json.dump([series], f)
+
+        with override_settings(METRICS_DIR=directory):
+            self.assertEqual(metrics.collect(), [series])
+            self.assertEqual(sorted(name for name in os.listdir(directory) if name.endswith('.json')),
+                             sorted([f'{os.getpid()}.json', metrics.RETIRED_FILE]))
+            # Counted once, from the retired snapshot
+            self.assertEqual(metrics.collect(), [series])
+
+
+@override_settings(CLASSIFIER_SNAPSHOT_PATH='', PROFILING_ENABLED=True, PROFILING_SAMPLE_RATE=0,
+                   PROFILING_INTERVAL_MS=1, PROFILING_MAX_PROFILES=2)
+class ProfilingTests(TestCase):
+    def test_sampler_folds_the_stacks_below_the_root(self):
+        def busy():
+            end = time.perf_counter() + 0.05
+            while time.perf_counter() < end:
+                pass
+
+        with profiling.StackSampler(threading.get_ident(), sys._getframe(), 0.001) as sampler:
+            busy()
+        self.assertGreater(sum(sampler.stacks.values()), 0)
+        # Only the frames below the root: busy() itself
+        stack = sampler.folded().splitlines()[0].rsplit(' ', 1)[0]
+        self.assertRegex(stack, r'^[\w.<>]+\.busy \(expenses/tests\.py:\d+\)$')
+
+    def test_signed_requests_are_profiled_and_stored(self):
+        self.assertFalse(self.client.get('/api/expenses/', HTTP_X_PROFILE='forged').has_header('X-Profile-Id'))
+        with override_settings(PROFILING_ENABLED=False):
+            response = self.client.get('/api/expenses/', HTTP_X_PROFILE=profiling.make_token())
+        self.assertFalse(response.has_header('X-Profile-Id'))
+
+        for _ in range(3):
+            response = self.client.get('/api/expenses/', HTTP_X_PROFILE=profiling.make_token(), HTTP_X_USERNAME='alice')
+        profile = RequestProfile.objects.get(id=response['X-Profile-Id'])
+        self.assertEqual((profile.view, profile.username, profile.trigger), ('ExpenseViewSet.list', 'alice', 'header'))
+        self.assertGreater(profile.sql_queries, 0)
+        self.assertEqual(RequestProfile.objects.count(), 2)
+
+    def test_profiles_are_downloaded_by_admins_only(self):
+        profile = RequestProfile.objects.create(method='GET', path='/api/expenses/', view='ExpenseViewSet.list',
+                                                status_code=200, duration_ms=5, trigger='sample',
+                                                folded_stacks='dispatch;list 3')
+        url = f'/api/profiles/{profile.id}/folded/'
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        self.client.force_login(User.objects.create_user('admin', is_staff=True))
+        response = self.client.get(url)
+        self.assertEqual(response.content, b'dispatch;list 3')
+        self.assertIn('attachment', response['Content-Disposition'])
+
+
+class FakeExtractor:
+    """Extractor returning fixed data and recording the upload it was given"""
+
+    def __init__(self, data):
+        self.data = data
+        self.uploads = []
+
+    def extract_receipt_data(self, image, lite=False):
+        self.uploads.append(image)
+        return {'success': True, 'data': dict(self.data), 'raw_text': None}
+
+
+@override_settings(CLASSIFIER_SNAPSHOT_PATH='', CLASSIFIER_SHORTCUT_ENABLED=False)
+class UploadPipelineTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        merchants.clear_cache()
+        self.addCleanup(merchants.clear_cache)
+
+    def scan(self, upload, **data):
+        extractor = FakeExtractor(data or {'merchant_name': 'Tesco', 'amount': '12.40', 'date': '2026-01-05'})
+        with mock.patch.object(views, 'get_receipt_extractor', return_value=extractor), \
+                mock.patch.object(storage, 'hash_file', side_effect=AssertionError('hashed again')):
+            response = self.client.post('/api/expenses/scan_receipt/', {'receipt_image': upload})
+        return response, extractor
+
+    def test_upload_is_hashed_once_and_shared_with_the_extractor(self):
+        upload = image_upload()
+        content = upload.read()
+        upload.seek(0)
+        response, extractor = self.scan(upload)
+        self.assertEqual(response.status_code, 201)
+
+        received = extractor.uploads[0]
+        self.assertEqual(received.sha256, hashlib.sha256(content).hexdigest())
+        # Small uploads never touch the disk before storage
+        self.assertFalse(received.file._rolled)
+        expense = Expense.objects.get(id=response.json()['expense']['id'])
+        self.assertEqual(expense.receipt_image.name, f'receipts/{received.sha256[:2]}/{received.sha256}.png')
+        with expense.receipt_image.open('rb') as stored:
+            self.assertEqual(stored.read(), content)
+
+    @override_settings(RECEIPT_UPLOAD_MAX_MEMORY_SIZE=1024)
+    def test_large_uploads_spill_to_disk(self):
+        response, extractor = self.scan(image_upload(size=(400, 400)))
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(extractor.uploads[0].file._rolled)
+
+    def test_invalid_uploads_are_rejected(self):
+        response, extractor = self.scan(SimpleUploadedFile('r.png', b'not an image'))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(extractor.uploads, [])
+
+
+@override_settings(CLASSIFIER_SNAPSHOT_PATH='')
+class BulkCounterTests(TestCase):
+    def setUp(self):
+        self.own = Budget.objects.create(username='alice', category='food', amount=Decimal('100.00'))
+        self.shared = Budget.objects.create(category='transport', amount=Decimal('100.00'))
+        self.expenses = [make_expense('10.00', username='alice', items=[{'name': 'bread'}]),
+                         make_expense('15.50', username='alice'), make_expense('4.00', username='bob')]
+
+    def assertCountersMatchExpenses(self):
+        for row in budgets.status(Budget.objects.all()):
+            budget = Budget.objects.get(id=row['id'])
+            self.assertEqual(row['spent'], budgets.period_spend(budget, row['period_start']), budget.category)
+
+    def test_bulk_update_moves_counters(self):
+        ids = [expense.id for expense in self.expenses]
+        self.assertEqual(bulk.bulk_update(ids, {'category': 'transport'}), 3)
+        spent = {row['category']: row['spent'] for row in budgets.status(Budget.objects.all())}
+        self.assertEqual(spent, {'food': Decimal('0.00'), 'transport': Decimal('29.50')})
+        self.assertCountersMatchExpenses()
+
+    def test_bulk_delete_moves_counters(self):
+        self.assertEqual(bulk.bulk_delete([self.expenses[0].id]), 1)
+        self.assertEqual(budgets.status([self.own])[0]['spent'], Decimal('15.50'))
+        self.assertCountersMatchExpenses()
+
+    def test_large_deletes_are_batched(self):
+        ids = [expense.id for expense in self.expenses]
+        self.assertTrue(ExpenseItem.objects.exists())
+        with mock.patch.object(bulk, 'DELETE_BATCH_SIZE', 2):
+            self.assertEqual(bulk.bulk_delete(ids), 3)
+        self.assertFalse(Expense.objects.exists())
+        self.assertFalse(ExpenseItem.objects.exists())
+        self.assertCountersMatchExpenses()
+
+    def test_expenses_cannot_be_moved_to_another_user(self):
+        body = {'ids': [self.expenses[0].id], 'update': {'username': 'bob'}}
+        response = self.client.patch('/api/expenses/bulk/', body, content_type='application/json',
+                                     HTTP_X_USERNAME='alice')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Expense.objects.get(id=self.expenses[0].id).username, 'alice')
+        self.assertEqual(bulk.bulk_update([self.expenses[0].id], {'username': 'bob'}), 0)
+
+
+@override_settings(CLASSIFIER_SNAPSHOT_PATH='')
+class SyncBatchTests(TestCase):
+    data = {'amount': '5.00', 'category': 'food', 'date': '2026-01-01', 'description': 'lunch'}
+
+    def test_replayed_create_returns_the_stored_result(self):
+        first = sync.apply_batch([{'key': 'a', 'op': 'create', 'data': self.data}], username='alice')
+        again = sync.apply_batch([{'key': 'a', 'op': 'create', 'data': self.data}], username='alice')
+        self.assertEqual(first[0]['status'], 201)
+        self.assertFalse(first[0]['replayed'])
+        self.assertTrue(again[0]['replayed'])
+        self.assertEqual(again[0]['data']['id'], first[0]['data']['id'])
+        self.assertEqual(Expense.objects.count(), 1)
+
+    def test_keys_are_scoped_to_the_user(self):
+        sync.apply_batch([{'key': 'a', 'op': 'create', 'data': self.data}], username='alice')
+        result = sync.apply_batch([{'key': 'a', 'op': 'create', 'data': self.data}], username='bob')
+        self.assertFalse(result[0]['replayed'])
+        self.assertEqual(sorted(Expense.objects.values_list('username', flat=True)), ['alice', 'bob'])
+
+    def test_creates_are_saved_under_the_header_user(self):
+        result = sync.apply_batch([{'key': 'a', 'op': 'create', 'data': self.data}], username='alice')
+        self.assertEqual(Expense.objects.get(id=result[0]['data']['id']).username, 'alice')
+
+        conflicting = {**self.data, 'username': 'bob'}
+        result = sync.apply_batch([{'key': 'b', 'op': 'create', 'data': conflicting}], username='alice')
+        self.assertEqual(result[0]['status'], 400)
+        self.assertEqual(Expense.objects.count(), 1)
+
+    def test_other_users_expenses_are_not_found(self):
+        expense = make_expense(username='bob')
+        result = sync.apply_batch([{'key': 'u', 'op': 'update', 'id': expense.id, 'data': {'amount': '1.00'}},
+                                   {'key': 'd', 'op': 'delete', 'id': str(expense.id)}], username='alice')
+        self.assertEqual([row['status'] for row in result], [404, 404])
+        self.assertTrue(Expense.objects.filter(id=expense.id, amount=Decimal('10.00')).exists())
+
+    def test_update_may_name_an_earlier_create(self):
+        result = sync.apply_batch([
+            {'key': 'a', 'op': 'create', 'data': self.data},
+            {'key': 'b', 'op': 'update', 'id': 'a', 'data': {'amount': '7.00'}},
+        ], username='alice')
+        self.assertEqual([row['status'] for row in result], [201, 200])
+        self.assertEqual(Expense.objects.get().amount, Decimal('7.00'))
+
+    def test_failed_mutations_are_not_stored(self):
+        invalid = {**self.data, 'amount': 'twelve'}
+        result = sync.apply_batch([{'key': 'a', 'op': 'create', 'data': invalid}], username='alice')
+        self.assertEqual(result[0]['status'], 400)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+        retry = sync.apply_batch([{'key': 'a', 'op': 'create', 'data': self.data}], username='alice')
+        self.assertEqual(retry[0]['status'], 201)
+        self.assertFalse(retry[0]['replayed'])
+
+
+@override_settings(CLASSIFIER_SNAPSHOT_PATH='')
+class ArchiveTotalsTests(TestCase):
+    def setUp(self):
+        day = date(2023, 1, 3)
+        categories = ['food', 'transport', 'shopping']
+        for index in range(40):
+            make_expense(f'{index + 1}.25', category=categories[index % 3],
+                         when=timezone.make_aware(datetime.combine(day, datetime.min.time())) + timedelta(hours=13),
+                         username='alice' if index % 2 else 'bob')
+            day += timedelta(days=3)
+
+    def live_totals(self, start, end, username=None, group_by=None):
+        expenses = Expense.objects.filter(date__gte=start, date__lt=end)
+        if username is not None:
+            expenses = expenses.filter(username=username)
+        if group_by is None:
+            row = expenses.aggregate(total=Sum('amount_base'), count=Count('id'))
+            return row['total'] or Decimal('0.00'), row['count']
+        return {key: (total, count) for key, total, count in
+                expenses.values_list(group_by).annotate(total=Sum('amount_base'), count=Count('id')).order_by()}
+
+    def test_archived_totals_match_the_live_rows(self):
+        windows = [
+            (archive.start_of_day(date(2023, 1, 15)), archive.start_of_day(date(2023, 3, 10))),
+            (archive.start_of_day(date(2023, 2, 1)), archive.start_of_day(date(2023, 4, 1))),
+            (archive.start_of_day(date(2023, 2, 5)), archive.start_of_day(date(2023, 2, 20))),
+        ]
+        expected = [(self.live_totals(*window), self.live_totals(*window, username='alice'),
+                     self.live_totals(*window, group_by='category')) for window in windows]
+
+        self.assertEqual(archive.archive_before(date(2024, 1, 1), batch_size=7), 40)
+        self.assertFalse(Expense.objects.exists())
+        for window, (total, alice, by_category) in zip(windows, expected):
+            self.assertEqual(archive.archived_totals(*window), total)
+            self.assertEqual(archive.archived_totals(*window, username='alice'), alice)
+            self.assertEqual(archive.archived_totals(*window, group_by='category'), by_category)
+
+    def test_archived_expenses_stay_readable(self):
+        expense = Expense.objects.order_by('id').first()
+        archive.archive_before(date(2024, 1, 1))
+        response = self.client.get(f'/api/expenses/{expense.id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Decimal(str(response.json()['amount'])), expense.amount)
+
+    def test_cutoff_must_precede_current_budget_periods(self):
+        with self.assertRaises(ValueError):
+            archive.archive_before(timezone.localdate())
+        self.assertEqual(Expense.objects.count(), 40)
+
+
+@override_settings(CLASSIFIER_SNAPSHOT_PATH='', READ_YOUR_WRITES_SECONDS=10)
+class ReplicaRoutingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def test_reporting_reads_go_to_the_replica(self):
+        router = routers.ReplicaRouter()
+        request = RequestFactory().get('/', HTTP_X_USERNAME='alice')
+        with override_settings(REPLICA_DATABASE='replica'):
+            self.assertIsNone(router.db_for_read(Expense))
+            with routers.reporting_reads(request) as on_replica:
+                self.assertTrue(on_replica)
+                self.assertEqual(router.db_for_read(Expense), 'replica')
+                self.assertEqual(router.db_for_write(Expense), 'default')
+            self.assertIsNone(router.db_for_read(Expense))
+            self.assertFalse(router.allow_migrate('replica', 'expenses'))
+
+        with routers.reporting_reads(request) as on_replica:
+            self.assertFalse(on_replica)
+            self.assertIsNone(router.db_for_read(Expense))
+
+    # The primary stands in for the replica: only the routing decision is checked
+    @override_settings(REPLICA_DATABASE='default')
+    def test_reads_stick_to_the_primary_after_a_write(self):
+        summary = '/api/expenses/summary/'
+        self.assertEqual(self.client.get(summary, HTTP_X_USERNAME='alice')['X-Read-Source'], 'replica')
+
+        response = self.client.post('/api/expenses/', {'amount': '4.20', 'category': 'food',
+                                                       'date': '2026-01-01T00:00:00Z'},
+                                    content_type='application/json', HTTP_X_USERNAME='alice')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.client.get(summary, HTTP_X_USERNAME='alice')['X-Read-Source'], 'primary')
+        self.assertEqual(self.client.get(summary, HTTP_X_USERNAME='bob')['X-Read-Source'], 'replica')
+
+        # A failed write does not make the client sticky
+        self.client.post('/api/expenses/', {}, content_type='application/json', HTTP_X_USERNAME='bob')
+        self.assertEqual(self.client.get(summary, HTTP_X_USERNAME='bob')['X-Read-Source'], 'replica')
+
+    @override_settings(REPLICA_DATABASE='default')
+    def test_async_requests_are_marked(self):
+        async def view(request):
+            return HttpResponse(status=201)
+
+        middleware = routers.ReadYourWritesMiddleware(view)
+        self.assertTrue(iscoroutinefunction(middleware))
+        asyncio.run(middleware(RequestFactory().post('/', HTTP_X_USERNAME='carol')))
+        with routers.reporting_reads(RequestFactory().get('/', HTTP_X_USERNAME='carol')) as on_replica:
+            self.assertFalse(on_replica)
+
+
+
+class IncrementalObjectParserTests(TestCase):
+    text = '```json\n{"merchant_name": "Caf\\u00e9 {\\"B\\"}", "items": [{"name": "a, b", "total": 1.5}, ' \
+           '{"name": "c"}], "amount": 3.5, "tags": [1, [2]]}\n```'
+
+    def feed(self, chunk_size):
+        parser = IncrementalObjectParser(stream_arrays=('items',))
+        events = []
+        for start in range(0, len(self.text), chunk_size):
+            events += parser.feed(self.text[start:start + chunk_size])
+        return parser, events
+
+    def test_events_do_not_depend_on_chunking(self):
+        whole_parser, whole = self.feed(len(self.text))
+        self.assertTrue(whole_parser.done)
+        for chunk_size in (1, 2, 7):
+            parser, events = self.feed(chunk_size)
+            self.assertTrue(parser.done)
+            self.assertEqual(events, whole)
+
+    def test_items_come_before_their_field(self):
+        _, events = self.feed(5)
+        self.assertEqual(events, [
+            ('field', 'merchant_name', 'Café {"B"}'),
+            ('item', 'items', 0, {'name': 'a, b', 'total': 1.5}),
+            ('item', 'items', 1, {'name': 'c'}),
+            ('field', 'items', [{'name': 'a, b', 'total': 1.5}, {'name': 'c'}]),
+            ('field', 'amount', 3.5),
+            ('field', 'tags', [1, [2]]),
+        ])
+
+    def test_incomplete_object_is_not_done(self):
+        parser = IncrementalObjectParser()
+        self.assertEqual(parser.feed('{"amount": 3'), [])
+        self.assertFalse(parser.done)
+
+
+class FakeModel:
+    """Stands in for a genai.GenerativeModel, answering each call with the next of `replies`"""
+
+    def __init__(self, replies):
+        self.replies = list(replies)
+
+    def generate_content(self, parts, stream=False):
+        text = self.replies.pop(0)
+        if stream:
+            return [SimpleNamespace(text=text[start:start + 7]) for start in range(0, len(text), 7)]
+        return SimpleNamespace(text=text, usage_metadata=None)
+
+
+def fake_extractor(*tiers):
+    """GeminiReceiptExtractor over FakeModels, one list of replies per tier"""
+    extractor = gemini_service.GeminiReceiptExtractor.__new__(gemini_service.GeminiReceiptExtractor)
+    extractor.tiers = [(f'tier-{index}', FakeModel(replies)) for index, replies in enumerate(tiers)]
+    return extractor
+
+
+@override_settings(CLASSIFIER_SNAPSHOT_PATH='')
+class StreamedExtractionTests(TestCase):
+    def test_items_are_cleaned_and_numbered_as_they_arrive(self):
+        reply = orjson.dumps({
+            'merchant_name': ' Tesco ', 'amount': '$5.50', 'currency': 'gbp', 'date': '2026-01-05',
+            'items': [{'name': ' Milk ', 'total': '1.50'}, 'noise', {'name': 'Bread', 'price': '4', 'quantity': 1}],
+        }).decode()
+        events = list(fake_extractor([reply]).stream_receipt_data(image_upload(), lite=True))
+        self.assertEqual([event for event in events if event[0] == 'item'], [
+            ('item', 0, {'name': 'Milk', 'total': 1.5, 'quantity': None, 'price': None}),
+            ('item', 1, {'name': 'Bread', 'price': 4.0, 'quantity': 1.0, 'total': None}),
+        ])
+        fields = {event[1]: event[2] for event in events if event[0] == 'field'}
+        self.assertEqual((fields['amount'], fields['currency']), (5.5, 'GBP'))
+        result = events[-1][1]
+        self.assertTrue(result['success'])
+        self.assertEqual(len(result['data']['items']), 2)
+
+    def test_truncated_reply_fails(self):
+        events = list(fake_extractor(['{"merchant_name": "Tesco", "amo']).stream_receipt_data(
+            image_upload(), lite=True))
+        self.assertEqual(events[-1][0], 'result')
+        self.assertFalse(events[-1][1]['success'])
+
+
+@override_settings(CLASSIFIER_SNAPSHOT_PATH='', CLASSIFIER_SHORTCUT_ENABLED=False, EXTRACTION_TOTAL_TOLERANCE=0.01)
+class TieringTests(MediaTestCase):
+    good = {'merchant_name': 'Tesco', 'amount': 5.5, 'date': '2026-01-05',
+            'items': [{'name': 'milk', 'total': 1.5}, {'name': 'bread', 'total': 4}]}
+
+    def setUp(self):
+        super().setUp()
+        merchants.clear_cache()
+        self.addCleanup(merchants.clear_cache)
+
+    def reply(self, **changes):
+        return orjson.dumps({**self.good, **changes}).decode()
+
+    def test_failed_checks_escalate_to_the_next_tier(self):
+        extractor = fake_extractor([self.reply(amount=55)], [self.reply()])
+        result = extractor.extract_receipt_data(image_upload(), lite=True)
+        self.assertTrue(result['success'])
+        self.assertEqual(result['data']['amount'], 5.5)
+
+        calls = list(ExtractionCall.objects.order_by('tier').values_list('model', 'failed_checks', 'escalated'))
+        self.assertEqual(calls, [('tier-0', 'items_total', True), ('tier-1', '', False)])
+
+        fake_extractor([self.reply()], []).extract_receipt_data(image_upload(), lite=True)
+        report = tiering.report()
+        self.assertEqual((report['scans'], report['escalated_scans'], report['final_tier']), (2, 1, {'0': 1, '1': 1}))
+        first_tier = next(row for row in report['calls'] if row['model'] == 'tier-0')
+        self.assertEqual((first_tier['calls'], first_tier['escalations']), (2, 1))
+        self.assertEqual(first_tier['failed_checks'], {'items_total': 1})
+        self.assertIsNotNone(first_tier['p95_latency_ms'])
+
+    def test_the_last_tier_is_accepted_without_its_future_date(self):
+        future = (timezone.localdate() + timedelta(days=30)).isoformat()
+        extractor = fake_extractor([self.reply(date=future)], [self.reply(date=future)])
+        with mock.patch.object(views, 'get_receipt_extractor', return_value=extractor):
+            response = self.client.post('/api/expenses/scan_receipt/', {'receipt_image': image_upload()})
+        self.assertEqual(response.status_code, 201)
+        expense = Expense.objects.get()
+        self.assertEqual(expense.amount, Decimal('5.50'))
+        self.assertLessEqual(expense.date, timezone.now())
+        self.assertEqual(ExtractionCall.objects.filter(failed_checks='date').count(), 2)
+
+
+@override_settings(CLASSIFIER_SNAPSHOT_PATH='')
+class ItemTests(TestCase):
+    def setUp(self):
+        fx.load_rates([(date(2026, 1, 1), 'EUR', '1.20')])
+
+    def test_items_store_base_amounts_at_the_expense_rate(self):
+        expense = make_expense('10.00', currency='EUR', items=[
+            {'name': ' Whole  MILK ', 'quantity': 2, 'price': '1.25'},
+            {'name': 'Bread', 'total': '7.50'},
+            {'name': '', 'total': '1.00'},
+        ])
+        milk, bread = ExpenseItem.objects.filter(expense=expense)
+        self.assertEqual(milk.normalized_name, 'whole milk')
+        self.assertEqual((milk.total, milk.total_base, milk.unit_price_base),
+                         (Decimal('2.50'), Decimal('3.00'), Decimal('1.50')))
+        self.assertEqual((bread.unit_price, bread.total_base), (Decimal('7.50'), Decimal('9.00')))
+
+    def test_rate_changes_update_item_base_amounts(self):
+        expense = make_expense('10.00', currency='EUR', items=[{'name': 'Milk', 'total': '10.00'}])
+        fx.load_rates([(date(2026, 1, 1), 'EUR', '1.50')])
+        self.assertEqual(ExpenseItem.objects.get(expense=expense).total_base, Decimal('15.00'))
+
+    def test_search_matches_the_whole_item_name(self):
+        make_expense('5.00', items=[{'name': 'Milk', 'quantity': 2, 'price': '1.00'}])
+        make_expense('5.00', items=[{'name': 'MILK', 'total': '3.00'}, {'name': 'Milkshake', 'total': '2.00'}])
+        make_expense('10.00', currency='EUR', items=[{'name': 'milk', 'quantity': 4, 'price': '2.50'}])
+
+        milk = items.item_queryset(name=' milk ')
+        self.assertEqual(milk.count(), 3)
+        (row,) = items.top_items(milk)
+        self.assertEqual((row['normalized_name'], row['spent'], row['units'], row['purchases']),
+                         ('milk', Decimal('17.00'), Decimal('7.000'), 3))
+        self.assertEqual((row['min_unit_price'], row['max_unit_price']), (Decimal('1.00'), Decimal('3.00')))
+
+        data = self.client.get('/api/expenses/items/analytics/?item=Milkshake').json()
+        self.assertEqual([item['normalized_name'] for item in data['top_items']], ['milkshake'])
+        self.assertEqual(data['item'], 'milkshake')
+        self.assertEqual(len(data['price_history']), 1)
+        self.assertEqual(Decimal(str(data['price_history'][0]['spent'])), Decimal('2.00'))
+
+
+@override_settings(CLASSIFIER_SNAPSHOT_PATH='', ADMIN_COUNT_LIMIT=3)
+class AdminPaginatorTests(TestCase):
+    def setUp(self):
+        for _ in range(5):
+            make_expense(category='food')
+        make_expense(category='transport')
+
+    def test_filtered_counts_stop_at_the_limit(self):
+        paginator = admin.EstimatedCountPaginator(Expense.objects.filter(category='food').order_by('id'), 2)
+        self.assertEqual((paginator.count, paginator.num_pages), (3, 2))
+        self.assertTrue(paginator.is_capped)
+
+        paginator = admin.EstimatedCountPaginator(Expense.objects.filter(category='transport').order_by('id'), 2)
+        self.assertEqual(paginator.count, 1)
+        self.assertFalse(paginator.is_capped)
+
+    def test_unfiltered_counts_use_the_row_estimate(self):
+        estimate = admin._row_estimate(Expense)
+        paginator = admin.EstimatedCountPaginator(Expense.objects.order_by('id'), 2)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(paginator.count, estimate)
+        self.assertFalse(any('COUNT(' in query['sql'] for query in queries.captured_queries))
+        self.assertGreaterEqual(estimate, 6)
+        self.assertFalse(paginator.is_capped)
+
+    def test_changelist_says_when_pages_are_out_of_reach(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        response = self.client.get('/admin/expenses/expense/?category__exact=food')
+        self.assertContains(response, 'only the first 3 can be paged through')
+        response = self.client.get('/admin/expenses/expense/?category__exact=transport')
+        self.assertNotContains(response, 'can be paged through')
+
+
+@override_settings(CLASSIFIER_SNAPSHOT_PATH='')
+class ExtractionBenchmarkTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        for name, color in [('coffee', 'white'), ('fuel', 'gray')]:
+            with open(os.path.join(self.directory, f'{name}.png'), 'wb') as f:
+                f.write(image_upload(color=color, size=(60, 80)).read())
+            with open(os.path.join(self.directory, f'{name}.json'), 'w') as f:
+                json.dump({'date': time.strftime('%Y-%m-%d'), 'category': 'food'}, f)
+        with open(os.path.join(self.directory, 'notes.txt'), 'w') as f:
+            f.write('not a receipt')
+
+    def run_benchmark(self, *args):
+        backend = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        return subprocess.run(
+            [sys.executable, '-W', 'ignore', '-m', 'benchmarks.bench_extraction', self.directory,
+             '--extractor', 'benchmarks.extractors.StubReceiptExtractor', '--concurrency', '2', *args],
+            cwd=backend, capture_output=True, text=True, timeout=300,
+        )
+
+    def test_scores_extractions_against_ground_truth(self):
+        from benchmarks.bench_extraction import score
+
+        truth = {'merchant_name': 'Starbucks Coffee', 'amount': 7.45, 'date': '2026-05-01', 'category': 'food'}
+        data = {'merchant_name': 'STARBUCKS', 'amount': '7.449', 'date': '2026-05-02', 'category': 'food'}
+        self.assertEqual(score(data, truth, lite=False),
+                         {'amount': True, 'date': False, 'merchant': True, 'category': True})
+        self.assertNotIn('category', score(data, truth, lite=True))
+        self.assertEqual(score(None, {'amount': 1}, lite=False), {'amount': False})
+
+    def test_cli_reports_and_caches_a_directory_run(self):
+        first, second = (os.path.join(self.directory, name) for name in ('first.json', 'second.json'))
+        cache_dir = os.path.join(self.directory, 'cache')
+
+        run = self.run_benchmark('--cache', cache_dir, '--output', first)
+        self.assertEqual(run.returncode, 0, run.stderr)
+        with open(first) as f:
+            results = json.load(f)
+        summary = results['summary']
+        self.assertEqual([row['file'] for row in results['receipts']], ['coffee.png', 'fuel.png'])
+        self.assertEqual((summary['receipts'], summary['successes'], summary['cached']), (2, 2, 0))
+        self.assertEqual(summary['accuracy']['date'], 1.0)
+        self.assertIsNotNone(summary['latency_ms']['p50'])
+
+        # A rerun takes every result from the cache and compares with the first
+        run = self.run_benchmark('--cache', cache_dir, '--output', second, '--compare', first)
+        self.assertEqual(run.returncode, 0, run.stderr)
+        with open(second) as f:
+            self.assertEqual(json.load(f)['summary']['cached'], 2)
+        self.assertIn('Change against', run.stdout)
+
+
+@override_settings(CLASSIFIER_SNAPSHOT_PATH='', LIVE_UPDATES_ENABLED=True)
+class LiveDeltaTests(TestCase):
+    def setUp(self):
+        self.own = Budget.objects.create(username='alice', category='food', amount=Decimal('50.00'))
+        self.shared = Budget.objects.create(category='food', amount=Decimal('100.00'))
+        LiveEvent.objects.all().delete()
+
+    def test_write_publishes_user_delta_and_shared_budgets_to_everyone(self):
+        make_expense('12.00', username='alice')
+        events = list(LiveEvent.objects.order_by('id'))
+        self.assertEqual([(event.username, event.kind) for event in events], [('alice', 'delta'), (None, 'delta')])
+
+        mine, shared = events[0].payload, events[1].payload
+        self.assertEqual(mine['summary']['all_time'], {'total': '12.00', 'count': 1})
+        self.assertEqual([row['id'] for row in mine['budgets']], [self.own.id])
+        self.assertEqual(shared['summary'], {})
+        self.assertEqual([(row['id'], row['spent']) for row in shared['budgets']], [(self.shared.id, '12.00')])
+
+    def test_expenses_without_a_user_still_update_shared_budgets(self):
+        make_expense('3.00')
+        self.assertEqual(list(LiveEvent.objects.values_list('username', 'kind')), [(None, 'delta')])
+
+    def test_delete_publishes_negative_delta(self):
+        expense = make_expense('12.00', username='alice')
+        LiveEvent.objects.all().delete()
+        expense.delete()
+        mine = LiveEvent.objects.get(username='alice').payload
+        self.assertEqual(mine['summary']['all_time'], {'total': '-12.00', 'count': -1})
+
+    def test_bulk_writes_refresh_every_stream_for_shared_budgets(self):
+        expense = make_expense('12.00', username='alice')
+        LiveEvent.objects.all().delete()
+        bulk.bulk_update([expense.id], {'category': 'transport'})
+        self.assertEqual(list(LiveEvent.objects.values_list('username', 'kind')), [(None, 'refresh')])
+
+        self.shared.delete()
+        LiveEvent.objects.all().delete()
+        bulk.bulk_delete([expense.id])
+        self.assertEqual(list(LiveEvent.objects.values_list('username', 'kind')), [('alice', 'refresh')])
+
+    @override_settings(LIVE_EVENT_TTL_SECONDS=60)
+    def test_writes_purge_expired_events(self):
+        stale = LiveEvent.objects.create(kind='refresh')
+        LiveEvent.objects.filter(id=stale.id).update(created_at=timezone.now() - timedelta(minutes=5))
+        with mock.patch.object(live, '_purged_at', None), self.captureOnCommitCallbacks(execute=True):
+            live.publish('alice', 'refresh')
+            live.publish('bob', 'refresh')
+        self.assertEqual(sorted(LiveEvent.objects.values_list('username', flat=True)), ['alice', 'bob'])
+
+    @override_settings(LIVE_UPDATES_ENABLED=False)
+    def test_nothing_is_written_when_disabled(self):
+        make_expense('12.00', username='alice')
+        live.publish(None, 'refresh')
+        self.assertFalse(LiveEvent.objects.exists())
+
+    def test_relay_fans_out_by_username(self):
+        relay = live.Relay()
+        alice, bob = asyncio.Queue(), asyncio.Queue()
+        relay.subscribers['alice'].add(alice)
+        relay.subscribers['bob'].add(bob)
+
+        relay._deliver(LiveEvent(username='alice', kind='delta'))
+        relay._deliver(LiveEvent(username=None, kind='delta'))
+        self.assertEqual((alice.qsize(), bob.qsize()), (2, 1))
+
+    def test_full_queue_is_replaced_by_a_refresh(self):
+        relay = live.Relay()
+        queue = asyncio.Queue(maxsize=2)
+        relay.subscribers['alice'].add(queue)
+        for _ in range(3):
+            relay._deliver(LiveEvent(username='alice', kind='delta'))
+        self.assertEqual(queue.qsize(), 1)
+        self.assertEqual(queue.get_nowait().kind, 'refresh')
+
+
+class MergePagesTests(TestCase):
+    def page(self, **fields):
+        base = {'merchant_name': None, 'amount': 0.0, 'currency': 'USD', 'date': None, 'category': 'other',
+                'payment_method': 'other', 'tax': 0.0, 'tip': 0.0, 'items': [], 'description': None}
+        return {**base, **fields}
+
+    def test_totals_from_the_last_page_other_fields_from_the_first(self):
+        merged = merge_pages([
+            self.page(merchant_name='Shop', date='2026-01-02', category='food',
+                      items=[{'name': 'milk', 'total': 2.0}], description='first'),
+            None,
+            self.page(merchant_name='Shop Inc', amount=5.5, currency='EUR', tax=0.5,
+                      items=[{'name': 'bread', 'total': 3.0}], description='first'),
+        ])
+        self.assertEqual(merged['merchant_name'], 'Shop')
+        self.assertEqual(merged['date'], '2026-01-02')
+        self.assertEqual(merged['category'], 'food')
+        self.assertEqual((merged['amount'], merged['currency'], merged['tax']), (5.5, 'EUR', 0.5))
+        self.assertEqual([item['name'] for item in merged['items']], ['milk', 'bread'])
+        self.assertEqual(merged['description'], 'first')
+
+    def test_amount_falls_back_to_the_items(self):
+        merged = merge_pages([
+            self.page(items=[{'name': 'a', 'price': 1.25, 'quantity': 2}]),
+            self.page(items=[{'name': 'b', 'total': 3.0}, {'name': 'c'}]),
+        ])
+        self.assertEqual(merged['amount'], 5.5)
+
+
+def multipage_tiff(*sizes):
+    buffer = io.BytesIO()
+    frames = [Image.new('RGB', size, 'white') for size in sizes]
+    frames[0].save(buffer, 'TIFF', save_all=True, append_images=frames[1:])
+    buffer.seek(0)
+    return buffer
+
+
+@override_settings(CLASSIFIER_SNAPSHOT_PATH='', RECEIPT_MAX_PAGES=3, RECEIPT_MAX_PAGE_PIXELS=100_000)
+class DocumentPageTests(TestCase):
+    def test_multipage_tiff_loads_every_page(self):
+        upload = multipage_tiff((100, 200), (120, 240))
+        self.assertEqual(documents.page_count(upload), 2)
+        self.assertEqual([page.size for page in documents.load_pages(upload)], [(100, 200), (120, 240)])
+        self.assertEqual(upload.tell(), 0)
+
+    def test_too_many_pages_are_rejected(self):
+        with self.assertRaisesRegex(ValueError, 'Receipt has 4 pages; at most 3'):
+            documents.load_pages(multipage_tiff(*[(50, 50)] * 4))
+
+    def test_pages_over_the_pixel_limit_are_rejected(self):
+        upload = multipage_tiff((100, 200), (400, 300))
+        with self.assertRaisesRegex(ValueError, 'Page 2 is too large'):
+            documents.check_page_sizes(upload)
+        with self.assertRaisesRegex(ValueError, 'Page 2 is too large'):
+            documents.load_pages(upload)
+        documents.check_page_sizes(multipage_tiff((250, 400)))
+
+    @skipIf(documents.pdfium is None, 'pypdfium2 is not installed')
+    @override_settings(RECEIPT_PDF_DPI=300)
+    def test_pdf_pages_render_within_the_pixel_limit(self):
+        buffer = io.BytesIO()
+        # 200 x 300 points: 833 x 1250 pixels at 300 DPI, over the limit
+        Image.new('RGB', (200, 300), 'white').save(buffer, 'PDF', resolution=72)
+        buffer.seek(0)
+        documents.check_page_sizes(buffer)
+        (page,) = documents.load_pages(buffer)
+        width, height = page.size
+        self.assertLessEqual(width * height, 100_000)
+        self.assertGreater(width * height, 90_000)
+
+    def test_scan_rejects_oversized_pages_before_extraction(self):
+        image = SimpleUploadedFile('receipt.tiff', multipage_tiff((100, 100), (500, 500)).getvalue(),
+                                   content_type='image/tiff')
+        with mock.patch.object(views, 'get_receipt_extractor') as get_extractor:
+            response = self.client.post('/api/expenses/scan_receipt/', {'receipt_image': image})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Page 2 is too large', json.dumps(response.json()))
+        get_extractor.assert_not_called()
@@ -0,0 +1,187 @@
+"""
+Tiered receipt extraction: consistency checks and model call accounting.
+
+GeminiReceiptExtractor tries the models of GEMINI_MODEL_TIERS in order,
+cheapest first, and escalates to the next one only when an extraction
+fails (error, unparsable JSON) or fails one of check_extraction()'s
+consistency checks. The last tier's result is accepted as it is.
+
+Every model call is stored as an ExtractionCall with its tier, token
+counts, latency and failed checks, grouped by scan; report() summarizes
+them for /api/extraction-calls/report/ so the policy can be tuned on real
+traffic. Calls are kept EXTRACTION_CALL_TTL_DAYS; `manage.py
+purge_extraction_calls` deletes older ones.
+"""
+
+import logging
+from collections import Counter
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import DatabaseError
+from django.db.models import Avg, Count, Exists, OuterRef, Q, Sum
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+EXTRACT_OPERATIONS = ('extract', 'lite_extract', 'extract_stream', 'lite_extract_stream')
+
+# Earliest time zone's lead on UTC: a receipt date is in the future only once
+# it has not started anywhere yet
+_LATEST_UTC_OFFSET = timedelta(hours=14)
+
+
+def _number(value):
+    if value is None or value == '':
+        return None
+    try:
+        return float(str(value).replace(',', '').replace('$', ''))
+    except (ValueError, TypeError):
+        return None
+
+
+def item_total(item):
+    """An extracted item's total, or price times quantity; None when it has neither"""
+    if not isinstance(item, dict):
+        return None
+    total = _number(item.get('total'))
+    if total is None:
+        price = _number(item.get('price'))
+        quantity = _number(item.get('quantity'))
+        total = price * (quantity if quantity is not None else 1) if price is not None else None
+    return total
+
+
+def is_future(day):
+    """Whether a receipt date has not started anywhere yet"""
+    return day > (timezone.now() + _LATEST_UTC_OFFSET).date()
+
+
+def check_extraction(data):
+    """Names of the consistency checks a cleaned extraction fails (empty when it looks right)"""
+    failed = []
+    amount = data.get('amount') or 0.0
+    if amount <= 0:
+        failed.append('amount')
+    if not data.get('merchant_name'):
+        failed.append('merchant')
+
+    if data.get('date'):
+        try:
+            if is_future(datetime.strptime(data['date'], '%Y-%m-%d').date()):
+                failed.append('date')
+        except (ValueError, TypeError):
+            failed.append('date')
+
+    # Items should add up to the total without tax and tip (or to the total
+    # when prices include tax); skipped when an item has no usable price
+    items = data.get('items') or []
+    totals = [item_total(item) for item in items]
+    if amount > 0 and totals and None not in totals:
+        items_sum = sum(totals)
+        tolerance = max(0.05, amount * settings.EXTRACTION_TOTAL_TOLERANCE)
+        expected = amount - (data.get('tax') or 0) - (data.get('tip') or 0)
+        if abs(items_sum - expected) > tolerance and abs(items_sum - amount) > tolerance:
+            failed.append('items_total')
+    return failed
+
+
+def record_call(scan_id, operation, model, tier, latency, response=None, success=True,
+                failed_checks=(), escalated=False):
+    """Store one model call; accounting errors never fail the scan"""
+    from .models import ExtractionCall
+
+    usage = getattr(response, 'usage_metadata', None)
+    try:
+        ExtractionCall.objects.create(
+            scan_id=scan_id,
+            operation=operation,
+            model=model,
+            tier=tier,
+            prompt_tokens=getattr(usage, 'prompt_token_count', None),
+            output_tokens=getattr(usage, 'candidates_token_count', None),
+            total_tokens=getattr(usage, 'total_token_count', None),
+            latency_ms=latency * 1000,
+            success=success,
+            failed_checks=','.join(failed_checks),
+            escalated=escalated,
+        )
+    except DatabaseError:
+        logger.exception("Could not record %s call to %s", operation, model)
+
+
+def record_checks(scan_id, tier, failed_checks, escalated):
+    """Store the checks of a merged multi-page extraction on the tier's successful page calls"""
+    from .models import ExtractionCall
+
+    try:
+        ExtractionCall.objects.filter(
+            scan_id=scan_id, tier=tier, operation__in=EXTRACT_OPERATIONS, success=True
+        ).update(failed_checks=','.join(failed_checks), escalated=escalated)
+    except DatabaseError:
+        logger.exception("Could not record the checks of scan %s", scan_id)
+
+
+def _percentile(calls, count, q):
+    """Latency at the q-th percentile of `calls` (`count` rows), read with one OFFSET query"""
+    if not count:
+        return None
+    return calls.order_by('latency_ms').values_list('latency_ms', flat=True)[min(int(q / 100 * count), count - 1)]
+
+
+def report(since=None):
+    """
+    Per-model call statistics and per-scan escalation figures, aggregated in
+    the database: a handful of queries per model, whatever the call count.
+    """
+    from .models import ExtractionCall
+
+    calls = ExtractionCall.objects.all()
+    if since is not None:
+        calls = calls.filter(created_at__gte=since)
+
+    check_failures = {}
+    for operation, model, failed_checks, count in calls.exclude(failed_checks='').values_list(
+        'operation', 'model', 'failed_checks'
+    ).annotate(count=Count('id')).order_by():
+        failures = check_failures.setdefault((operation, model), Counter())
+        for check in failed_checks.split(','):
+            failures[check] += count
+
+    # A scan's final tier is the highest one it made an extraction call on
+    extractions = calls.filter(operation__in=EXTRACT_OPERATIONS)
+    higher_tier = extractions.filter(scan_id=OuterRef('scan_id'), tier__gt=OuterRef('tier'))
+    final_tiers = Counter(dict(
+        extractions.exclude(Exists(higher_tier)).values_list('tier').annotate(
+            scans=Count('scan_id', distinct=True)
+        ).order_by()
+    ))
+
+    models = []
+    for row in calls.values('operation', 'model', 'tier').annotate(
+        calls=Count('id'),
+        failures=Count('id', filter=Q(success=False)),
+        escalations=Count('id', filter=Q(escalated=True)),
+        avg_latency_ms=Avg('latency_ms'),
+        prompt_tokens=Sum('prompt_tokens'),
+        output_tokens=Sum('output_tokens'),
+        total_tokens=Sum('total_tokens'),
+    ).order_by('operation', 'tier', 'model'):
+        group = calls.filter(operation=row['operation'], model=row['model'], tier=row['tier'])
+        row.update({
+            'p50_latency_ms': _percentile(group, row['calls'], 50),
+            'p95_latency_ms': _percentile(group, row['calls'], 95),
+            'failed_checks': dict(check_failures.get((row['operation'], row['model']), {})),
+        })
+        models.append(row)
+
+    scans = sum(final_tiers.values())
+    return {
+        'since': since,
+        'scans': scans,
+        'escalated_scans': scans - final_tiers.get(0, 0),
+        'escalation_rate': (scans - final_tiers.get(0, 0)) / scans if scans else 0.0,
+        'final_tier': {str(tier): count for tier, count in sorted(final_tiers.items())},
+        'tiers': settings.GEMINI_MODEL_TIERS,
+        'calls': models,
+    }
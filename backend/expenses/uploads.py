@@ -0,0 +1,116 @@
+"""
+Single-pass upload pipeline for receipt scans.
+
+Django's default handlers keep uploads up to FILE_UPLOAD_MAX_MEMORY_SIZE
+(2.5 MB) in memory and write bigger ones to a temporary file, and nothing
+is hashed on the way in. ReceiptUploadParser instead streams each file
+into a SpooledTemporaryFile that stays in memory up to
+RECEIPT_UPLOAD_MAX_MEMORY_SIZE and spills to disk only above it, hashing
+the chunks as they arrive. The resulting upload carries its SHA-256 digest
+(`upload.sha256`), so ReceiptStorage does not read it again to name it,
+and the same file object is handed to image validation, the extractor and
+storage: the bytes cross the network once and are written to media once.
+"""
+
+import hashlib
+import tempfile
+
+from django import forms
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler
+from PIL import Image
+from rest_framework.parsers import MultiPartParser
+
+from . import documents
+
+
+class HashingUploadHandler(FileUploadHandler):
+    """Buffer each uploaded file in a spooled temp file and SHA-256 it while streaming"""
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.digest = hashlib.sha256()
+        self.file = tempfile.SpooledTemporaryFile(
+            max_size=settings.RECEIPT_UPLOAD_MAX_MEMORY_SIZE, dir=settings.FILE_UPLOAD_TEMP_DIR
+        )
+
+    def receive_data_chunk(self, raw_data, start):
+        self.digest.update(raw_data)
+        self.file.write(raw_data)
+
+    def file_complete(self, file_size):
+        self.file.seek(0)
+        upload = UploadedFile(
+            file=self.file,
+            name=self.file_name,
+            content_type=self.content_type,
+            size=file_size,
+            charset=self.charset,
+            content_type_extra=self.content_type_extra,
+        )
+        upload.sha256 = self.digest.hexdigest()
+        return upload
+
+
+class ReceiptUploadParser(MultiPartParser):
+    """Multipart parser that uses HashingUploadHandler for the request's files"""
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        request = parser_context['request']
+        request.upload_handlers = [HashingUploadHandler(request)]
+        return super().parse(stream, media_type, parser_context)
+
+
+class InPlaceImageField(forms.ImageField):
+    """
+    forms.ImageField that verifies the upload through its own file object.
+    The stock field copies in-memory uploads into a BytesIO first.
+    """
+
+    def to_python(self, data):
+        upload = forms.FileField.to_python(self, data)
+        if upload is None:
+            return None
+        try:
+            data.seek(0)
+            image = Image.open(data)
+            image.verify()
+            upload.image = image
+            upload.content_type = Image.MIME.get(image.format)
+        except Exception as exc:
+            raise ValidationError(self.error_messages['invalid_image'], code='invalid_image') from exc
+        finally:
+            data.seek(0)
+        return upload
+
+
+class ReceiptFileField(InPlaceImageField):
+    """InPlaceImageField that also takes PDFs, up to RECEIPT_MAX_PAGES pages of RECEIPT_MAX_PAGE_PIXELS"""
+
+    def to_python(self, data):
+        if data is None or not hasattr(data, 'read') or not documents.is_pdf(data):
+            upload = super().to_python(data)
+            if upload is None:
+                return None
+            upload.pages = documents.page_count(data)
+        else:
+            upload = forms.FileField.to_python(self, data)
+            try:
+                upload.pages = documents.page_count(data)
+            except Exception as exc:
+                raise ValidationError(str(exc) if documents.pdfium is None else 'Upload a valid PDF.',
+                                      code='invalid_pdf') from exc
+            upload.image = None
+            upload.content_type = 'application/pdf'
+        if upload.pages > settings.RECEIPT_MAX_PAGES:
+            raise ValidationError(
+                f'Receipt has {upload.pages} pages; at most {settings.RECEIPT_MAX_PAGES} can be scanned',
+                code='too_many_pages',
+            )
+        try:
+            documents.check_page_sizes(data)
+        except ValueError as exc:
+            raise ValidationError(str(exc), code='page_too_large') from exc
+        return upload
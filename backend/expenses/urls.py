@@ -1,11 +1,16 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import ExpenseViewSet, BudgetViewSet
+from . import live
+from .views import ExpenseViewSet, BudgetViewSet, ExtractionCallViewSet, RequestProfileViewSet, SyncViewSet
 
 router = DefaultRouter()
 router.register(r'expenses', ExpenseViewSet)
 router.register(r'budgets', BudgetViewSet)
+router.register(r'profiles', RequestProfileViewSet)
+router.register(r'sync', SyncViewSet, basename='sync')
+router.register(r'extraction-calls', ExtractionCallViewSet)
 
 urlpatterns = [
+    path('live/', live.stream, name='live-stream'),
     path('', include(router.urls)),
 ]
@@ -0,0 +1,42 @@
+"""
+Per-user expense versions.
+
+Every write to a user's expenses bumps the user's ExpenseVersion row in the
+same transaction: post_save/post_delete for single rows, and the bulk and
+archive paths for the raw SQL they run. State derived from a user's
+expenses and held outside the table (the classifier's in-memory models in
+each worker process, cached insights) records the version it was built
+from and is stale as soon as the stored version differs, whichever process
+made the write and whether it updated, deleted or created rows.
+"""
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .models import ExpenseVersion
+
+
+def _key(username):
+    return username or ''
+
+
+def current(username):
+    """The stored version for `username` (0 before the first write)"""
+    return ExpenseVersion.objects.filter(username=_key(username)).values_list('version', flat=True).first() or 0
+
+
+def bump(usernames):
+    """Increment the versions of `usernames` in the current transaction; returns {username: new version}"""
+    versions = {}
+    with transaction.atomic():
+        for key in sorted({_key(username) for username in usernames}):
+            if not ExpenseVersion.objects.filter(username=key).update(version=F('version') + 1):
+                try:
+                    with transaction.atomic():
+                        ExpenseVersion.objects.create(username=key, version=1)
+                except IntegrityError:
+                    # Created concurrently; its row is there to increment now
+                    ExpenseVersion.objects.filter(username=key).update(version=F('version') + 1)
+            # The update holds the row lock, so this reads our own increment
+            versions[key] = current(key)
+    return versions
@@ -1,45 +1,114 @@
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
+from rest_framework.parsers import MultiPartParser, FormParser
+from rest_framework.permissions import IsAdminUser
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.conf import settings
 from django.db.models import Sum, Count, Q
 from django.utils import timezone
+from django.utils.dateparse import parse_date
 from datetime import timedelta, datetime
 from decimal import Decimal
-from .models import Expense, Budget
+from .models import ArchivedExpense, Expense, Budget, BudgetAlert, ExtractionCall, Merchant, RequestProfile
 from .serializers import (
-    ExpenseSerializer, BudgetSerializer, 
-    ReceiptUploadSerializer, ExpenseAnalyticsSerializer
+    ArchivedExpenseSerializer, ExpenseSerializer, BudgetSerializer, BudgetAlertSerializer,
+    ExtractionCallSerializer, ReceiptUploadSerializer, ExpenseAnalyticsSerializer, RequestProfileSerializer
 )
-from .gemini_service import GeminiReceiptExtractor
+from .gemini_service import get_receipt_extractor
+from .parsers import ORJSONParser
+from .profiling import ProfilingMixin
+from .routers import replica_reads
+from . import budgets as budget_counters
+from . import items as expense_items
+from . import live
+from . import archive, bulk, classifier, fx, insights, sync, tiering
+from .merchants import resolve_merchant
+from .search import search_expenses
+from .uploads import ReceiptUploadParser
+import json
 import logging
-import os
-import tempfile
 
 logger = logging.getLogger(__name__)
 
 
-class ExpenseViewSet(viewsets.ModelViewSet):
+def _request_username(request):
+    """Optional username passed by the client (header or query)"""
+    return request.headers.get('X-Username') or request.query_params.get('username')
+
+
+def _breakdown(expenses, field, choices, archived):
+    """{value: {'label', 'amount', 'count'}} for every choice of `field`, from one grouped query plus `archived`"""
+    live_totals = {
+        value: (total or Decimal('0.00'), count)
+        for value, total, count in expenses.values_list(field).annotate(
+            total=Sum('amount_base'), count=Count('id')
+        ).order_by()
+    }
+    breakdown = {}
+    for value, label in choices:
+        amount, count = live_totals.get(value, (Decimal('0.00'), 0))
+        archived_amount, archived_count = archived.get(value, (0, 0))
+        breakdown[value] = {'label': label, 'amount': amount + archived_amount, 'count': count + archived_count}
+    return breakdown
+
+
+def _sse(event, data):
+    """One server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n"
+
+
+def _unstreamed_events(result):
+    """Events of stream_receipt_data from an extract_receipt_data result"""
+    if result['success']:
+        for name, value in result['data'].items():
+            if name != 'items':
+                yield ('field', name, value)
+        for index, item in enumerate(result['data'].get('items') or []):
+            yield ('item', index, item)
+    yield ('result', {**result, 'raw_text': None})
+    if result['success'] and result.get('raw_text') is not None:
+        yield ('raw_text', result['raw_text'])
+
+
+class ExpenseViewSet(ProfilingMixin, viewsets.ModelViewSet):
     queryset = Expense.objects.all()
     serializer_class = ExpenseSerializer
-    parser_classes = [JSONParser, MultiPartParser, FormParser]
+    parser_classes = [ORJSONParser, MultiPartParser, FormParser]
+    
+    def retrieve(self, request, *args, **kwargs):
+        """Expense by id; archived expenses are served read-only from the archive"""
+        try:
+            return super().retrieve(request, *args, **kwargs)
+        except Http404:
+            pk = str(kwargs.get('pk', ''))
+            archived = ArchivedExpense.objects.filter(pk=pk).first() if pk.isdigit() else None
+            if archived is None:
+                raise
+            return Response(ArchivedExpenseSerializer(archived, context=self.get_serializer_context()).data)
     
     def perform_create(self, serializer):
         """Save expense"""
-        expense = serializer.save()
+        merchant_id = resolve_merchant(serializer.validated_data.get('merchant_name'))
+        expense = serializer.save(merchant_id=merchant_id)
     
     def perform_update(self, serializer):
         """Update expense"""
-        expense = serializer.save()
+        if 'merchant_name' in serializer.validated_data:
+            merchant_id = resolve_merchant(serializer.validated_data['merchant_name'])
+            expense = serializer.save(merchant_id=merchant_id)
+        else:
+            expense = serializer.save()
     
     def perform_destroy(self, instance):
         """Delete expense"""
         instance.delete()
     
-    @action(detail=False, methods=['post'], parser_classes=[MultiPartParser, FormParser])
+    @action(detail=False, methods=['post'], parser_classes=[ReceiptUploadParser, FormParser])
     def scan_receipt(self, request):
         """
-        Scan receipt image and extract data using Gemini API
+        Scan a receipt (image, multi-page TIFF or PDF) and extract data using Gemini API
         """
         logger.info("[scan_receipt] content_type=%s keys=%s files=%s",
                     request.content_type, list(request.data.keys()), list(request.FILES.keys()))
@@ -51,77 +120,36 @@ class ExpenseViewSet(viewsets.ModelViewSet):
             return Response({'error': 'Invalid image file', 'details': serializer.errors},
                             status=status.HTTP_400_BAD_REQUEST)
         
+        # Read once by ReceiptUploadParser: in memory (or spilled to disk
+        # when large) and already hashed for storage
         receipt_image = serializer.validated_data['receipt_image']
-        temp_path = None
-        try:
-            # Ensure we have a file path on disk (some uploads are in-memory)
-            suffix = os.path.splitext(getattr(receipt_image, 'name', 'receipt'))[1] or '.jpg'
-            with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
-                for chunk in receipt_image.chunks():
-                    tmp.write(chunk)
-                temp_path = tmp.name
-            logger.info("[scan_receipt] saved temp image: %s (size=%s)", temp_path, os.path.getsize(temp_path))
-        except Exception as e:
-            logger.exception("[scan_receipt] failed to persist temp image: %s", e)
-            return Response({'error': f'Failed to read uploaded image: {e}'},
-                            status=status.HTTP_400_BAD_REQUEST)
+        logger.info("[scan_receipt] upload %s (size=%s)", receipt_image.name, receipt_image.size)
         
         # Extract data using Gemini
-        extractor = GeminiReceiptExtractor()
-        result = extractor.extract_receipt_data(temp_path or receipt_image)
-        logger.info("[scan_receipt] extractor success=%s", result.get('success'))
+        # Users whose recent predictions were mostly confident get the smaller
+        # prompt; their category is predicted locally instead of by the model.
+        username = _request_username(request)
+        # A model that is not trained yet trains in the background; the scan uses the full prompt
+        user_classifier = classifier.registry.get(username, wait=False)
+        lite = settings.CLASSIFIER_SHORTCUT_ENABLED and user_classifier.shortcut_worthwhile()
+
+        extractor = get_receipt_extractor()
+        result = extractor.extract_receipt_data(receipt_image, lite=lite)
+        logger.info("[scan_receipt] extractor success=%s lite=%s", result.get('success'), lite)
         
         if not result['success']:
             logger.error("[scan_receipt] extraction failed: %s", result.get('error'))
-            # Cleanup temp file
-            if temp_path and os.path.exists(temp_path):
-                try:
-                    os.remove(temp_path)
-                except Exception:
-                    pass
             return Response({'error': result.get('error', 'Failed to extract receipt data')},
                             status=status.HTTP_502_BAD_GATEWAY)
         
         extracted_data = result['data']
         
+        if lite:
+            self._apply_predictions(extractor, user_classifier, extracted_data)
+        
         # Create expense with extracted data
         try:
-            # Parse date
-            date = timezone.now()
-            if extracted_data.get('date'):
-                try:
-                    date = datetime.strptime(extracted_data['date'], '%Y-%m-%d')
-                except ValueError:
-                    pass
-            
-            # Safe decimal conversions
-            def to_decimal(val, default='0.00'):
-                try:
-                    return Decimal(str(val))
-                except Exception:
-                    return Decimal(default)
-
-            amount_dec = to_decimal(extracted_data.get('amount', 0))
-            tax_dec = to_decimal(extracted_data.get('tax', 0))
-            tip_dec = to_decimal(extracted_data.get('tip', 0))
-
-            # Optional username passing (header or query)
-            username = request.headers.get('X-Username') or request.query_params.get('username')
-
-            expense = Expense.objects.create(
-                merchant_name=extracted_data.get('merchant_name'),
-                amount=amount_dec,
-                currency=extracted_data.get('currency', 'USD'),
-                category=extracted_data.get('category', 'other'),
-                payment_method=extracted_data.get('payment_method', 'other'),
-                date=date,
-                description=extracted_data.get('description'),
-                items=extracted_data.get('items'),
-                tax=tax_dec,
-                tip=tip_dec,
-                receipt_image=receipt_image,
-                username=username
-            )
+            expense = self._create_scanned_expense(extracted_data, receipt_image, username)
             
             return Response(
                 {
@@ -137,15 +165,222 @@ class ExpenseViewSet(viewsets.ModelViewSet):
             logger.exception("[scan_receipt] failed to create expense: %s", e)
             return Response({'error': f'Failed to create expense: {str(e)}'},
                             status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-        finally:
-            # Cleanup temp file
-            if temp_path and os.path.exists(temp_path):
+    
+    @action(detail=False, methods=['post'], parser_classes=[ReceiptUploadParser, FormParser])
+    def scan_receipt_stream(self, request):
+        """
+        Scan a receipt and stream the extraction as server-sent events:
+        `field` and `item` as the model produces them, then `expense` once it
+        is saved, `raw_text` (full extractions) and `done`; `error` on failure.
+        `escalated` means the fields so far are replaced by a stronger model's
+        """
+        serializer = ReceiptUploadSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response({'error': 'Invalid image file', 'details': serializer.errors},
+                            status=status.HTTP_400_BAD_REQUEST)
+        receipt_image = serializer.validated_data['receipt_image']
+        
+        username = _request_username(request)
+        # A model that is not trained yet trains in the background; the scan uses the full prompt
+        user_classifier = classifier.registry.get(username, wait=False)
+        lite = settings.CLASSIFIER_SHORTCUT_ENABLED and user_classifier.shortcut_worthwhile()
+        
+        events = self._scan_events(get_receipt_extractor(), receipt_image, username, user_classifier, lite)
+        response = StreamingHttpResponse(events, content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'  # Don't let nginx buffer the stream
+        return response
+    
+    def _scan_events(self, extractor, receipt_image, username, user_classifier, lite):
+        # Sent at once so the client sees the stream open before the model answers
+        yield ': scanning\n\n'
+        
+        if hasattr(extractor, 'stream_receipt_data'):
+            events = extractor.stream_receipt_data(receipt_image, lite=lite)
+        else:
+            events = _unstreamed_events(extractor.extract_receipt_data(receipt_image, lite=lite))
+        
+        for event in events:
+            kind = event[0]
+            if kind == 'field':
+                yield _sse('field', {'name': event[1], 'value': event[2]})
+            elif kind == 'item':
+                yield _sse('item', {'index': event[1], 'item': event[2]})
+            elif kind == 'raw_text':
+                yield _sse('raw_text', {'raw_text': event[1]})
+            elif kind == 'escalated':
+                yield _sse('escalated', {'model': event[1]})
+            elif kind == 'result':
+                result = event[1]
+                if not result['success']:
+                    logger.error("[scan_receipt_stream] extraction failed: %s", result.get('error'))
+                    yield _sse('error', {'error': result.get('error', 'Failed to extract receipt data')})
+                    return
+                
+                extracted_data = result['data']
+                if lite:
+                    self._apply_predictions(extractor, user_classifier, extracted_data)
+                    for name in ('category', 'payment_method'):
+                        yield _sse('field', {'name': name, 'value': extracted_data.get(name)})
                 try:
-                    os.remove(temp_path)
-                except Exception:
-                    pass
+                    expense = self._create_scanned_expense(extracted_data, receipt_image, username)
+                except Exception as e:
+                    logger.exception("[scan_receipt_stream] failed to create expense: %s", e)
+                    yield _sse('error', {'error': f'Failed to create expense: {str(e)}'})
+                    return
+                yield _sse('expense', {
+                    'expense': ExpenseSerializer(expense, context=self.get_serializer_context()).data,
+                    'extracted_data': extracted_data,
+                })
+        yield _sse('done', {})
+    
+    def _create_scanned_expense(self, extracted_data, receipt_image, username):
+        """Save the expense for an extraction result"""
+        # Parse date
+        date = timezone.now()
+        if extracted_data.get('date'):
+            try:
+                parsed = datetime.strptime(extracted_data['date'], '%Y-%m-%d')
+                # The last tier is accepted even when its date fails the
+                # checks; a date in the future is dropped for the scan time
+                if not tiering.is_future(parsed.date()):
+                    date = parsed
+            except ValueError:
+                pass
+        
+        # Safe decimal conversions
+        def to_decimal(val, default='0.00'):
+            try:
+                return Decimal(str(val))
+            except Exception:
+                return Decimal(default)
+        
+        return Expense.objects.create(
+            merchant_name=extracted_data.get('merchant_name'),
+            merchant_id=resolve_merchant(extracted_data.get('merchant_name')),
+            amount=to_decimal(extracted_data.get('amount', 0)),
+            currency=extracted_data.get('currency', 'USD'),
+            category=extracted_data.get('category', 'other'),
+            payment_method=extracted_data.get('payment_method', 'other'),
+            date=date,
+            description=extracted_data.get('description'),
+            items=extracted_data.get('items'),
+            tax=to_decimal(extracted_data.get('tax', 0)),
+            tip=to_decimal(extracted_data.get('tip', 0)),
+            receipt_image=receipt_image,
+            username=username
+        )
+    
+    def _apply_predictions(self, extractor, user_classifier, extracted_data):
+        """Fill category/payment method left open by a lite extraction"""
+        threshold = settings.CLASSIFIER_CONFIDENCE_THRESHOLD
+        prediction = user_classifier.predict(extracted_data.get('merchant_name'), extracted_data.get('items'))
+        
+        confident = prediction['category']['confidence'] >= threshold
+        user_classifier.record_outcome(confident)
+        if confident:
+            extracted_data['category'] = prediction['category']['value']
+        else:
+            extracted_data['category'] = extractor.suggest_category(
+                extracted_data.get('merchant_name'), extracted_data.get('items'))
+        
+        if (extracted_data.get('payment_method') in (None, 'other')
+                and prediction['payment_method']['confidence'] >= threshold):
+            extracted_data['payment_method'] = prediction['payment_method']['value']
+    
+    @action(detail=False, methods=['patch'])
+    def bulk(self, request):
+        """
+        Update many expenses with one UPDATE.
+        Body: {"ids": [...]} or {"filter": {...}}, plus {"update": {"category": ..., ...}}
+        """
+        update = request.data.get('update')
+        if not isinstance(update, dict) or not update:
+            return Response({'error': '"update" must be a non-empty object'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        unknown = set(update) - set(bulk.UPDATE_FIELDS)
+        if unknown:
+            return Response({'error': f"Cannot bulk update: {', '.join(sorted(unknown))}",
+                             'allowed': bulk.UPDATE_FIELDS}, status=status.HTTP_400_BAD_REQUEST)
+        
+        serializer = self.get_serializer(data=update, partial=True)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            ids = bulk.select_ids(request.data.get('ids'), request.data.get('filter'), _request_username(request))
+        except bulk.BulkError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        updated = bulk.bulk_update(ids, serializer.validated_data)
+        return Response({'updated': updated})
+    
+    @action(detail=False, methods=['post'])
+    def bulk_delete(self, request):
+        """
+        Delete many expenses with one DELETE.
+        Body: {"ids": [...]} or {"filter": {...}}
+        """
+        try:
+            ids = bulk.select_ids(request.data.get('ids'), request.data.get('filter'), _request_username(request))
+        except bulk.BulkError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        deleted = bulk.bulk_delete(ids)
+        return Response({'deleted': deleted})
     
     @action(detail=False, methods=['get'])
+    def suggest(self, request):
+        """
+        Suggest category and payment method for a manual entry
+        """
+        merchant_name = request.query_params.get('merchant_name', '')
+        items = [{'name': name} for name in request.query_params.getlist('item') if name]
+        prediction = classifier.predict(_request_username(request), merchant_name, items)
+        return Response(prediction)
+    
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """
+        Full-text search over merchant, description and line item names
+        """
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({'error': 'Query parameter "q" is required'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = min(max(int(request.query_params.get('limit', 50)), 1), 200)
+        except ValueError:
+            limit = 50
+
+        expenses = search_expenses(query, username=_request_username(request), limit=limit)
+        serializer = self.get_serializer(expenses, many=True)
+        return Response(serializer.data)
+    
+    @action(detail=False, methods=['get'])
+    def archived(self, request):
+        """
+        Archived expenses, newest first (?from=YYYY-MM-DD&to=YYYY-MM-DD&limit=)
+        """
+        try:
+            limit = min(max(int(request.query_params.get('limit', 50)), 1), 200)
+        except ValueError:
+            limit = 50
+        
+        expenses = ArchivedExpense.objects.all()
+        username = _request_username(request)
+        if username:
+            expenses = expenses.filter(username=username)
+        date_from = parse_date(request.query_params.get('from') or '')
+        if date_from:
+            expenses = expenses.filter(date__date__gte=date_from)
+        date_to = parse_date(request.query_params.get('to') or '')
+        if date_to:
+            expenses = expenses.filter(date__date__lte=date_to)
+        
+        serializer = ArchivedExpenseSerializer(expenses[:limit], many=True, context=self.get_serializer_context())
+        return Response(serializer.data)
+    
+    @action(detail=False, methods=['get'])
+    @replica_reads
     def analytics(self, request):
         """
         Get expense analytics and statistics
@@ -172,161 +407,247 @@ class ExpenseViewSet(viewsets.ModelViewSet):
         else:
             expenses = Expense.objects.all()
         
+        # Expenses moved to the archive are counted from its aggregates
+        latest_archived = archive.latest_archived_date()
+        use_archive = latest_archived is not None and (start_date is None or start_date <= latest_archived)
+        
         # Total spent
-        total_spent = expenses.aggregate(total=Sum('amount'))['total'] or Decimal('0.00')
+        totals = expenses.aggregate(total=Sum('amount_base'), count=Count('id'))
+        total_spent = totals['total'] or Decimal('0.00')
+        expense_count = totals['count']
+        if use_archive:
+            archived_total, archived_count = archive.archived_totals(start_date)
+            total_spent += archived_total
+            expense_count += archived_count
         
         # Category breakdown
-        category_breakdown = {}
-        for category, label in Expense.CATEGORY_CHOICES:
-            amount = expenses.filter(category=category).aggregate(total=Sum('amount'))['total'] or Decimal('0.00')
-            category_breakdown[category] = {
-                'label': label,
-                'amount': float(amount),
-                'count': expenses.filter(category=category).count()
-            }
-        
-        # Monthly trend (last 12 months)
-        monthly_trend = []
+        archived_categories = archive.archived_totals(start_date, group_by='category') if use_archive else {}
+        category_breakdown = _breakdown(expenses, 'category', Expense.CATEGORY_CHOICES, archived_categories)
+        
+        # Monthly trend (last 12 months), one filtered aggregate per month in a single query
+        windows, month_aggregates = [], {}
         for i in range(12):
             month_start = now - timedelta(days=30 * i)
             month_end = now - timedelta(days=30 * (i - 1)) if i > 0 else now
-            month_expenses = Expense.objects.filter(
-                date__gte=month_start,
-                date__lt=month_end
-            )
-            month_total = month_expenses.aggregate(total=Sum('amount'))['total'] or Decimal('0.00')
+            windows.append((month_start, month_end))
+            in_month = Q(date__gte=month_start, date__lt=month_end)
+            month_aggregates[f'total_{i}'] = Sum('amount_base', filter=in_month)
+            month_aggregates[f'count_{i}'] = Count('id', filter=in_month)
+        month_totals = Expense.objects.aggregate(**month_aggregates)
+        monthly_trend = []
+        for i, (month_start, month_end) in enumerate(windows):
+            month_total = month_totals[f'total_{i}'] or Decimal('0.00')
+            month_count = month_totals[f'count_{i}']
+            if latest_archived is not None and month_start <= latest_archived:
+                archived_total, archived_count = archive.archived_totals(month_start, month_end)
+                month_total += archived_total
+                month_count += archived_count
             monthly_trend.insert(0, {
                 'month': month_start.strftime('%b %Y'),
-                'amount': float(month_total),
-                'count': month_expenses.count()
+                'amount': month_total,
+                'count': month_count
             })
         
-        # Top merchants
+        # Top merchants (grouped by the merchant key, names fetched for the top 10 only)
         top_merchants = []
-        merchants = expenses.values('merchant_name').annotate(
-            total=Sum('amount'),
+        merchants = expenses.filter(merchant__isnull=False).values('merchant_id').annotate(
+            total=Sum('amount_base'),
             count=Count('id')
-        ).order_by('-total')[:10]
+        ).order_by('-total')
+        if use_archive:
+            merged = {m['merchant_id']: [m['total'] or Decimal('0.00'), m['count']] for m in merchants}
+            for merchant_id, (amount, count) in archive.archived_totals(start_date, group_by='merchant_id').items():
+                if merchant_id is not None:
+                    totals = merged.setdefault(merchant_id, [Decimal('0.00'), 0])
+                    totals[0] += amount
+                    totals[1] += count
+            merchants = sorted(
+                ({'merchant_id': merchant_id, 'total': total, 'count': count}
+                 for merchant_id, (total, count) in merged.items()),
+                key=lambda m: m['total'], reverse=True,
+            )
+        merchants = merchants[:10]
+        merchant_names = Merchant.objects.in_bulk([m['merchant_id'] for m in merchants])
         
         for merchant in merchants:
-            if merchant['merchant_name']:
-                top_merchants.append({
-                    'name': merchant['merchant_name'],
-                    'amount': float(merchant['total']),
-                    'count': merchant['count']
-                })
+            top_merchants.append({
+                'id': merchant['merchant_id'],
+                'name': merchant_names[merchant['merchant_id']].canonical_name,
+                'amount': merchant['total'],
+                'count': merchant['count']
+            })
         
         # Payment method breakdown
-        payment_breakdown = {}
-        for method, label in Expense.PAYMENT_METHOD_CHOICES:
-            amount = expenses.filter(payment_method=method).aggregate(total=Sum('amount'))['total'] or Decimal('0.00')
-            payment_breakdown[method] = {
-                'label': label,
-                'amount': float(amount),
-                'count': expenses.filter(payment_method=method).count()
-            }
+        archived_methods = archive.archived_totals(start_date, group_by='payment_method') if use_archive else {}
+        payment_breakdown = _breakdown(expenses, 'payment_method', Expense.PAYMENT_METHOD_CHOICES, archived_methods)
         
         analytics_data = {
-            'total_spent': float(total_spent),
-            'expense_count': expenses.count(),
+            'total_spent': total_spent,
+            'expense_count': expense_count,
             'category_breakdown': category_breakdown,
             'monthly_trend': monthly_trend,
             'top_merchants': top_merchants,
             'payment_breakdown': payment_breakdown,
-            'period': period
+            'period': period,
+            'currency': settings.BASE_CURRENCY,
+            # Expenses in currencies without rates, not included in the totals
+            'unconverted': fx.unconverted(expenses),
         }
         
         return Response(analytics_data)
     
+    @action(detail=False, methods=['get'], url_path='items/analytics', url_name='item-analytics')
+    @replica_reads
+    def item_analytics(self, request):
+        """
+        Top line items by spend, and the monthly price history of ?item=
+        (?period=day|week|month|year|all&limit=)
+        """
+        period = request.query_params.get('period', 'year')
+        days = {'day': 1, 'week': 7, 'month': 30, 'year': 365}.get(period)
+        start_date = timezone.now() - timedelta(days=days) if days else None
+        try:
+            limit = min(max(int(request.query_params.get('limit', 10)), 1), 100)
+        except ValueError:
+            limit = 10
+        
+        name = request.query_params.get('item', '').strip()
+        line_items = expense_items.item_queryset(_request_username(request), start_date, name)
+        return Response({
+            'top_items': expense_items.top_items(line_items, limit),
+            'price_history': expense_items.price_history(line_items) if name else [],
+            'item': expense_items.normalize_item_name(name) or None,
+            'period': period,
+            'currency': settings.BASE_CURRENCY,
+        })
+    
     @action(detail=False, methods=['get'])
+    @replica_reads
+    def insights(self, request):
+        """
+        Median/percentile spend, rolling averages, volatility and a month-end forecast
+        """
+        username = _request_username(request)
+        include_series = request.query_params.get('series') in ('1', 'true')
+        try:
+            days = min(max(int(request.query_params.get('days', settings.INSIGHTS_WINDOW_DAYS)), 7), 366)
+        except ValueError:
+            days = settings.INSIGHTS_WINDOW_DAYS
+        
+        # The nightly batch covers the default window without series
+        data = None
+        if username and not include_series and days == settings.INSIGHTS_WINDOW_DAYS:
+            data = insights.cached_insights(username)
+        if data is None:
+            data = insights.user_insights(username, days=days, include_series=include_series)
+        data['currency'] = settings.BASE_CURRENCY
+        return Response(data)
+    
+    @action(detail=False, methods=['get'])
+    @replica_reads
     def summary(self, request):
         """
         Get quick summary statistics
         """
-        now = timezone.now()
-        
-        # Today
-        today_expenses = Expense.objects.filter(date__date=now.date())
-        today_total = today_expenses.aggregate(total=Sum('amount'))['total'] or Decimal('0.00')
-        
-        # This week
-        week_start = now - timedelta(days=now.weekday())
-        week_expenses = Expense.objects.filter(date__gte=week_start)
-        week_total = week_expenses.aggregate(total=Sum('amount'))['total'] or Decimal('0.00')
-        
-        # This month
-        month_start = now.replace(day=1)
-        month_expenses = Expense.objects.filter(date__gte=month_start)
-        month_total = month_expenses.aggregate(total=Sum('amount'))['total'] or Decimal('0.00')
-        
-        # All time
-        all_total = Expense.objects.aggregate(total=Sum('amount'))['total'] or Decimal('0.00')
-        
         return Response({
-            'today': {
-                'total': float(today_total),
-                'count': today_expenses.count()
-            },
-            'week': {
-                'total': float(week_total),
-                'count': week_expenses.count()
-            },
-            'month': {
-                'total': float(month_total),
-                'count': month_expenses.count()
-            },
-            'all_time': {
-                'total': float(all_total),
-                'count': Expense.objects.count()
-            }
+            **live.summary_totals(),
+            'currency': settings.BASE_CURRENCY,
+            'unconverted': fx.unconverted(Expense.objects.all()),
         })
 
 
-class BudgetViewSet(viewsets.ModelViewSet):
+class BudgetViewSet(ProfilingMixin, viewsets.ModelViewSet):
     queryset = Budget.objects.all()
     serializer_class = BudgetSerializer
     
     @action(detail=False, methods=['get'])
+    @replica_reads
     def status(self, request):
         """
-        Get budget status for all categories
+        Get budget status for all categories (?date=YYYY-MM-DD for the periods containing that day)
         """
-        budgets = Budget.objects.all()
-        budget_status = []
-        
-        now = timezone.now()
-        
-        for budget in budgets:
-            # Calculate date range based on period
-            if budget.period == 'daily':
-                start_date = now - timedelta(days=1)
-            elif budget.period == 'weekly':
-                start_date = now - timedelta(weeks=1)
-            elif budget.period == 'monthly':
-                start_date = now - timedelta(days=30)
-            elif budget.period == 'yearly':
-                start_date = now - timedelta(days=365)
-            else:
-                start_date = now - timedelta(days=30)
-            
-            # Get expenses for this category in the period
-            spent = Expense.objects.filter(
-                category=budget.category,
-                date__gte=start_date
-            ).aggregate(total=Sum('amount'))['total'] or Decimal('0.00')
-            
-            remaining = budget.amount - spent
-            percentage = (spent / budget.amount * 100) if budget.amount > 0 else 0
-            
-            budget_status.append({
-                'id': budget.id,
-                'category': budget.category,
-                'budget': float(budget.amount),
-                'spent': float(spent),
-                'remaining': float(remaining),
-                'percentage': float(percentage),
-                'period': budget.period,
-                'is_exceeded': spent > budget.amount
-            })
+        raw_day = request.query_params.get('date')
+        try:
+            day = parse_date(raw_day) if raw_day else None
+        except ValueError:
+            day = None
+        if raw_day and day is None:
+            return Response({'error': 'date must be YYYY-MM-DD'}, status=status.HTTP_400_BAD_REQUEST)
+        budget_status = budget_counters.status(Budget.objects.all(), today=day)
         
         return Response(budget_status)
+    
+    @action(detail=False, methods=['get'])
+    @replica_reads
+    def alerts(self, request):
+        """
+        Poll budget alerts newer than ?since=<last seen alert id>
+        """
+        alerts = BudgetAlert.objects.all()
+        username = _request_username(request)
+        if username:
+            alerts = alerts.filter(Q(username=username) | Q(username__isnull=True))
+        try:
+            since = int(request.query_params.get('since', 0))
+        except ValueError:
+            since = 0
+        alerts = alerts.filter(id__gt=since)[:100]
+        return Response(BudgetAlertSerializer(alerts, many=True).data)
+
+
+class SyncViewSet(ProfilingMixin, viewsets.ViewSet):
+    """Offline mutation queue of the app (see sync.py)"""
+    parser_classes = [ORJSONParser]
+    
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        """
+        Apply an ordered list of create/update/delete mutations in one transaction
+        """
+        mutations = request.data.get('mutations')
+        try:
+            sync.validate_batch(mutations)
+            results = sync.apply_batch(mutations, _request_username(request), {'request': request})
+        except sync.SyncError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except sync.SyncConflict:
+            return Response({'error': 'A concurrent request stored some of these keys; retry the batch'},
+                            status=status.HTTP_409_CONFLICT)
+        return Response({'results': results})
+
+
+class RequestProfileViewSet(viewsets.ReadOnlyModelViewSet):
+    """Stored request profiles (admin only)"""
+    queryset = RequestProfile.objects.defer('folded_stacks')
+    serializer_class = RequestProfileSerializer
+    permission_classes = [IsAdminUser]
+    
+    @action(detail=True, methods=['get'])
+    def folded(self, request, pk=None):
+        """
+        Download the profile as folded stacks (flamegraph.pl, inferno, speedscope)
+        """
+        profile = RequestProfile.objects.filter(pk=pk).values_list('folded_stacks', flat=True).first()
+        if profile is None:
+            return Response({'error': 'Profile not found'}, status=status.HTTP_404_NOT_FOUND)
+        response = HttpResponse(profile, content_type='text/plain; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="profile-{pk}.folded"'
+        return response
+
+
+class ExtractionCallViewSet(viewsets.ReadOnlyModelViewSet):
+    """Recorded receipt extraction model calls (admin only)"""
+    queryset = ExtractionCall.objects.all()
+    serializer_class = ExtractionCallSerializer
+    permission_classes = [IsAdminUser]
+    
+    @action(detail=False, methods=['get'])
+    def report(self, request):
+        """
+        Calls, tokens, latency and escalation rate per model tier (?days=7)
+        """
+        try:
+            days = min(max(int(request.query_params.get('days', 7)), 1), 365)
+        except ValueError:
+            days = 7
+        return Response(tiering.report(since=timezone.now() - timedelta(days=days)))
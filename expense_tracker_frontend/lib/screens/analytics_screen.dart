@@ -1,3 +1,4 @@
+import 'dart:async';
 import 'package:flutter/material.dart';
 import 'package:google_fonts/google_fonts.dart';
 import 'package:fl_chart/fl_chart.dart';
@@ -19,6 +20,9 @@ class AnalyticsScreenState extends State<AnalyticsScreen> with SingleTickerProvi
   String? _error;
   String _selectedPeriod = 'month';
   late AnimationController _animationController;
+  StreamSubscription<Map<String, dynamic>>? _liveSubscription;
+  Timer? _reloadTimer;
+  bool _liveStarted = false;
 
   @override
   void initState() {
@@ -28,14 +32,43 @@ class AnalyticsScreenState extends State<AnalyticsScreen> with SingleTickerProvi
       duration: const Duration(milliseconds: 800),
     );
     _loadAnalytics();
+    // Reload when the expenses change instead of waiting for a pull to refresh
+    _liveSubscription = _apiService.liveUpdates().listen(
+      _onLiveUpdate,
+      onError: (e) => print('Live updates unavailable: $e'),
+    );
   }
 
   @override
   void dispose() {
+    _reloadTimer?.cancel();
+    _liveSubscription?.cancel();
     _animationController.dispose();
     super.dispose();
   }
 
+  void _onLiveUpdate(Map<String, dynamic> message) {
+    // The first snapshot matches what _loadAnalytics just fetched
+    if (message['event'] == 'snapshot' && !_liveStarted) {
+      _liveStarted = true;
+      return;
+    }
+    // Coalesce bursts of writes (e.g. a sync batch) into one reload
+    _reloadTimer?.cancel();
+    _reloadTimer = Timer(const Duration(seconds: 1), () {
+      if (mounted) _loadQuietly();
+    });
+  }
+
+  Future<void> _loadQuietly() async {
+    try {
+      final analytics = await _apiService.getAnalytics(period: _selectedPeriod);
+      if (mounted) setState(() => _analytics = analytics);
+    } catch (e) {
+      print('Analytics reload failed: $e');
+    }
+  }
+
   Future<void> _loadAnalytics() async {
     setState(() {
       _isLoading = true;
@@ -1,3 +1,4 @@
+import 'dart:async';
 import 'package:flutter/material.dart';
 import 'package:google_fonts/google_fonts.dart';
 import 'package:provider/provider.dart';
@@ -6,6 +7,7 @@ import 'analytics_screen.dart';
 import 'scan_receipt_screen.dart';
 import 'login_screen.dart';
 import 'backend_setup_screen.dart';
+import '../services/api_service.dart';
 import '../services/auth_service.dart';
 import '../services/theme_service.dart';
 
@@ -19,6 +21,11 @@ class HomeScreen extends StatefulWidget {
 class _HomeScreenState extends State<HomeScreen> with SingleTickerProviderStateMixin {
   int _selectedIndex = 0;
   late AnimationController _fabController;
+  final ApiService _apiService = ApiService();
+  StreamSubscription<Map<String, dynamic>>? _liveSubscription;
+  // This month's figures and budget status, kept current by the live stream
+  Map<String, dynamic>? _month;
+  final Map<int, Map<String, dynamic>> _budgets = {};
 
   final List<Widget> _screens = [
     const ExpensesScreen(),
@@ -42,14 +49,49 @@ class _HomeScreenState extends State<HomeScreen> with SingleTickerProviderStateM
       vsync: this,
       duration: const Duration(milliseconds: 200),
     );
+    _liveSubscription = _apiService.liveUpdates().listen(
+      _onLiveUpdate,
+      // Without the ASGI server there is no stream; the header stays static
+      onError: (e) => print('Live updates unavailable: $e'),
+    );
   }
 
   @override
   void dispose() {
+    _liveSubscription?.cancel();
     _fabController.dispose();
     super.dispose();
   }
 
+  void _onLiveUpdate(Map<String, dynamic> message) {
+    final data = message['data'] as Map<String, dynamic>;
+    setState(() {
+      if (message['event'] == 'snapshot') {
+        final month = data['summary']['month'];
+        _month = {'total': double.parse('${month['total']}'), 'count': month['count']};
+        _budgets.clear();
+      } else if (message['event'] == 'delta' && _month != null) {
+        final change = data['summary']['month'];
+        if (change != null) {
+          _month = {
+            'total': _month!['total'] + double.parse('${change['total']}'),
+            'count': _month!['count'] + change['count'],
+          };
+        }
+      }
+      for (final budget in (data['budgets'] as List<dynamic>? ?? [])) {
+        _budgets[budget['id']] = Map<String, dynamic>.from(budget);
+      }
+    });
+  }
+
+  String get _subtitle {
+    if (_month == null) return 'Track your spending';
+    final over = _budgets.values.where((budget) => budget['is_exceeded'] == true).length;
+    return 'This month: \$${_month!['total'].toStringAsFixed(2)} · ${_month!['count']} expenses'
+        '${over > 0 ? ' · $over over budget' : ''}';
+  }
+
   void _onItemTapped(int index) {
     setState(() {
       _selectedIndex = index;
@@ -137,7 +179,7 @@ class _HomeScreenState extends State<HomeScreen> with SingleTickerProviderStateM
                             ),
                           ),
                           Text(
-                            'Track your spending',
+                            _subtitle,
                             style: GoogleFonts.poppins(
                               fontSize: 14,
                               color: Colors.white.withOpacity(0.8),
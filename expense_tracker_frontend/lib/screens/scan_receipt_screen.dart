@@ -20,6 +20,9 @@ class ScanReceiptScreenState extends State<ScanReceiptScreen> {
   File? _imageFile;
   bool _isScanning = false;
   Expense? _scannedExpense;
+  // Fields and items received so far while the receipt streams in
+  final Map<String, dynamic> _streamedFields = {};
+  final List<Map<String, dynamic>> _streamedItems = [];
 
   Future<void> _pickImage(ImageSource source) async {
     try {
@@ -45,18 +48,44 @@ class ScanReceiptScreenState extends State<ScanReceiptScreen> {
 
     setState(() {
       _isScanning = true;
+      _scannedExpense = null;
+      _streamedFields.clear();
+      _streamedItems.clear();
     });
 
     try {
       print('📸 Starting receipt scan...');
       print('📁 Image file: ${_imageFile!.path}');
       
-      final result = await _apiService.scanReceipt(_imageFile!);
-      
-      print('✅ Scan result received: $result');
+      await for (final message in _apiService.scanReceiptStream(_imageFile!)) {
+        final data = message['data'] as Map<String, dynamic>;
+        switch (message['event']) {
+          case 'field':
+            setState(() => _streamedFields[data['name']] = data['value']);
+            break;
+          case 'item':
+            setState(() => _streamedItems.add(Map<String, dynamic>.from(data['item'])));
+            break;
+          case 'escalated':
+            // A stronger model re-extracts the receipt; its fields are sent again
+            setState(() {
+              _streamedFields.clear();
+              _streamedItems.clear();
+            });
+            break;
+          case 'expense':
+            print('✅ Scan result received: ${data['expense']}');
+            setState(() => _scannedExpense = Expense.fromJson(data['expense']));
+            break;
+          case 'error':
+            throw Exception(data['error']);
+        }
+      }
       
+      if (_scannedExpense == null) {
+        throw Exception('Scan ended without an expense');
+      }
       setState(() {
-        _scannedExpense = Expense.fromJson(result['expense']);
         _isScanning = false;
       });
 
@@ -200,6 +229,31 @@ class ScanReceiptScreenState extends State<ScanReceiptScreen> {
                   ),
                 ),
               
+              // Fields as they are extracted
+              if (_isScanning && (_streamedFields.isNotEmpty || _streamedItems.isNotEmpty))
+                Card(
+                  child: Padding(
+                    padding: const EdgeInsets.all(16),
+                    child: Column(
+                      crossAxisAlignment: CrossAxisAlignment.start,
+                      children: [
+                        if (_streamedFields['merchant_name'] != null)
+                          _buildInfoRow('Merchant', '${_streamedFields['merchant_name']}'),
+                        if (_streamedFields['amount'] != null)
+                          _buildInfoRow('Amount', '${_streamedFields['amount']}'),
+                        if (_streamedFields['date'] != null)
+                          _buildInfoRow('Date', '${_streamedFields['date']}'),
+                        if (_streamedFields['category'] != null)
+                          _buildInfoRow('Category', categoryLabels[_streamedFields['category']] ?? 'Other'),
+                        ..._streamedItems.map((item) => _buildInfoRow(
+                          'Item',
+                          '${item['name'] ?? ''}${item['total'] != null ? '  \$${item['total']}' : ''}',
+                        )),
+                      ],
+                    ),
+                  ),
+                ),
+              
               // Extracted data
               if (_scannedExpense != null && !_isScanning)
                 Card(
@@ -109,6 +109,29 @@ class ApiService {
     }
   }
   
+  // Flush queued offline mutations in one request. Each mutation is
+  // {'key': <unique id>, 'op': 'create'|'update'|'delete', 'id': ..., 'data': {...}};
+  // resending the same keys after a failed flush replays the stored results.
+  Future<List<dynamic>> syncBatch(List<Map<String, dynamic>> mutations) async {
+    try {
+      final baseUrl = await _getBaseUrl();
+      final username = await _getCurrentUsername();
+      final response = await http.post(
+        Uri.parse('$baseUrl/sync/batch/'),
+        headers: {'Content-Type': 'application/json', 'X-Username': username},
+        body: json.encode({'mutations': mutations}),
+      );
+      
+      if (response.statusCode == 200) {
+        return json.decode(response.body)['results'];
+      } else {
+        throw Exception('Failed to sync changes');
+      }
+    } catch (e) {
+      throw Exception('Error: $e');
+    }
+  }
+  
   Future<Map<String, dynamic>> scanReceipt(File imageFile) async {
     try {
       final baseUrl = await _getBaseUrl();
@@ -143,6 +166,62 @@ class ApiService {
     }
   }
   
+  // Scan with server-sent events: yields {'event': name, 'data': {...}} for
+  // each `field`/`item` as it is extracted, then `expense`, `raw_text` and
+  // `done` (or `error`).
+  Stream<Map<String, dynamic>> scanReceiptStream(File imageFile) async* {
+    final baseUrl = await _getBaseUrl();
+    final username = await _getCurrentUsername();
+    final request = http.MultipartRequest(
+      'POST',
+      Uri.parse('$baseUrl/expenses/scan_receipt_stream/'),
+    );
+    request.headers['X-Username'] = username;
+    request.files.add(
+      await http.MultipartFile.fromPath('receipt_image', imageFile.path),
+    );
+    
+    final response = await request.send();
+    if (response.statusCode != 200) {
+      throw Exception('Failed to scan receipt: ${await response.stream.bytesToString()}');
+    }
+    
+    String? event;
+    await for (final line in response.stream.transform(utf8.decoder).transform(const LineSplitter())) {
+      if (line.startsWith('event: ')) {
+        event = line.substring(7);
+      } else if (line.startsWith('data: ') && event != null) {
+        yield {'event': event, 'data': json.decode(line.substring(6))};
+        event = null;
+      }
+    }
+  }
+  
+  /// Server-pushed summary and budget updates: a `snapshot` event first, then
+  /// `delta` events after each write (needs the backend's ASGI server).
+  Stream<Map<String, dynamic>> liveUpdates() async* {
+    final baseUrl = await _getBaseUrl();
+    final username = await _getCurrentUsername();
+    final request = http.Request('GET', Uri.parse('$baseUrl/live/'));
+    request.headers['X-Username'] = username;
+    request.headers['Accept'] = 'text/event-stream';
+    
+    final response = await http.Client().send(request);
+    if (response.statusCode != 200) {
+      throw Exception('Failed to open live updates: ${await response.stream.bytesToString()}');
+    }
+    
+    String? event;
+    await for (final line in response.stream.transform(utf8.decoder).transform(const LineSplitter())) {
+      if (line.startsWith('event: ')) {
+        event = line.substring(7);
+      } else if (line.startsWith('data: ') && event != null) {
+        yield {'event': event, 'data': json.decode(line.substring(6))};
+        event = null;
+      }
+    }
+  }
+  
   Future<Map<String, dynamic>> getAnalytics({String period = 'month'}) async {
     try {
       final baseUrl = await _getBaseUrl();
@@ -160,6 +239,26 @@ class ApiService {
     }
   }
   
+  Future<Map<String, dynamic>> getItemAnalytics({String period = 'year', String? item}) async {
+    try {
+      final baseUrl = await _getBaseUrl();
+      final username = await _getCurrentUsername();
+      final query = {'period': period, if (item != null && item.isNotEmpty) 'item': item};
+      final response = await http.get(
+        Uri.parse('$baseUrl/expenses/items/analytics/').replace(queryParameters: query),
+        headers: {'X-Username': username},
+      );
+      
+      if (response.statusCode == 200) {
+        return json.decode(response.body);
+      } else {
+        throw Exception('Failed to load item analytics');
+      }
+    } catch (e) {
+      throw Exception('Error: $e');
+    }
+  }
+  
   Future<Map<String, dynamic>> getSummary() async {
     try {
       final baseUrl = await _getBaseUrl();